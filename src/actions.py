@@ -7,12 +7,8 @@ from typing import List, Optional, Tuple, Dict, Any
 import cv2
 import numpy as np
 
-try:
-    import mediapipe as mp
-except ImportError:
-    mp = None
-
 from . import config
+from .lazy_imports import mediapipe
 
 
 def get_face_mesh_landmarks(frame: np.ndarray) -> Optional[List[Any]]:
@@ -20,7 +16,9 @@ def get_face_mesh_landmarks(frame: np.ndarray) -> Optional[List[Any]]:
     Run MediaPipe Face Mesh on frame; return first face landmark list or None.
     Caller must have at least one face in frame for meaningful results.
     """
-    if mp is None:
+    try:
+        mp = mediapipe()
+    except RuntimeError:
         return None
     H, W = frame.shape[:2]
     rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
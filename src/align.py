@@ -9,13 +9,8 @@ import numpy as np
 import time
 from pathlib import Path
 
-try:
-    import mediapipe as mp
-except ImportError:
-    print("ERROR: mediapipe not installed. Run: pip install mediapipe")
-    sys.exit(1)
-
 from . import config
+from .lazy_imports import mediapipe
 
 
 class FaceAligner:
@@ -89,6 +84,12 @@ def main():
         print(f"ERROR: Failed to load cascade.")
         return False
     
+    try:
+        mp = mediapipe()
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return False
+    
     mp_face_mesh = mp.solutions.face_mesh.FaceMesh(
         static_image_mode=config.FACEMESH_STATIC_MODE,
         max_num_faces=1,
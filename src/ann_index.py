@@ -0,0 +1,267 @@
+"""
+Approximate nearest-neighbour search for large galleries.
+IVF-flat index in pure NumPy: vectors are bucketed by their nearest coarse
+centroid (spherical k-means), and a query only scans the NPROBE buckets
+whose centroids are closest to it. Used by FaceGallery above
+GALLERY_ANN_MIN_TEMPLATES templates; smaller galleries use exact search.
+Bucket vectors are kept in the gallery's storage precision.
+"""
+
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from . import config
+from .matching import dequantize_rows, quantize_rows, similarities
+
+ANN_FORMAT_VERSION = 2
+
+
+def _normalize_rows(E: np.ndarray) -> np.ndarray:
+    return E / (np.linalg.norm(E, axis=1, keepdims=True) + 1e-12)
+
+
+def auto_nlist(n: int) -> int:
+    """Bucket count for n vectors (about 4 * sqrt(n), at least 1)."""
+    return max(1, min(n, int(round(4 * np.sqrt(max(n, 1))))))
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index over L2-normalized vectors (cosine distance).
+
+    Each bucket keeps its vectors in one contiguous (n_i, D) array (float32,
+    float16 or int8 with per-row scales) next to their integer labels.
+    Several vectors may share a label (e.g. the templates of one identity).
+    Adds and removes only touch the affected buckets; centroids stay fixed
+    until the index is retrained.
+    """
+
+    def __init__(self, dim: int, nlist: int = 0, nprobe: int = None, storage: str = "float32"):
+        """
+        Args:
+            dim: Vector dimension
+            nlist: Buckets (0 = auto from the training set size)
+            nprobe: Buckets scanned per query (None = config.GALLERY_ANN_NPROBE)
+            storage: Bucket vector precision ("float32", "float16" or "int8")
+        """
+        self.dim = int(dim)
+        self.nlist = int(nlist)
+        self.nprobe = config.GALLERY_ANN_NPROBE if nprobe is None else int(nprobe)
+        self.storage = storage
+        self.centroids: Optional[np.ndarray] = None  # (nlist, D)
+        self._vectors: List[np.ndarray] = []
+        self._scales: List[Optional[np.ndarray]] = []  # int8 row scales per bucket
+        self._labels: List[np.ndarray] = []
+        self._where: Dict[int, Set[int]] = {}  # label -> buckets holding it
+
+    def copy(self) -> "IVFFlatIndex":
+        """Independent index sharing the bucket arrays (add/remove replace them, never modify them)."""
+        fresh = IVFFlatIndex.__new__(IVFFlatIndex)
+        fresh.__dict__.update(self.__dict__)
+        fresh._vectors = list(self._vectors)
+        fresh._scales = list(self._scales)
+        fresh._labels = list(self._labels)
+        fresh._where = {label: set(buckets) for label, buckets in self._where.items()}
+        return fresh
+
+    # ---- build ------------------------------------------------------------
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return sum(len(l) for l in self._labels)
+
+    def train(self, vectors: np.ndarray, iterations: int = 8, seed: int = 0,
+              scales: np.ndarray = None) -> None:
+        """
+        Fit the coarse centroids with spherical k-means on (a sample of) vectors.
+        Existing contents are dropped.
+
+        Args:
+            vectors: (N, D) training vectors (any storage dtype)
+            iterations: k-means iterations
+            seed: Sampling seed
+            scales: Row scales if vectors are int8
+        """
+        X = dequantize_rows(np.asarray(vectors), scales).astype(np.float32, copy=False)
+        nlist = self.nlist or auto_nlist(len(X))
+        nlist = max(1, min(nlist, len(X)))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(X), nlist * config.GALLERY_ANN_TRAIN_POINTS_PER_LIST)
+        sample = X[rng.choice(len(X), size=sample_size, replace=False)] if sample_size < len(X) else X
+        C = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assign = self._nearest_centroid(sample, C)
+            sums = np.zeros_like(C)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=nlist) == 0
+            sums[empty] = C[empty]  # Keep empty buckets where they were
+            C = _normalize_rows(sums).astype(np.float32)
+
+        self.nlist = nlist
+        self.centroids = np.ascontiguousarray(C)
+        empty, empty_scales = quantize_rows(np.zeros((0, self.dim), dtype=np.float32), self.storage)
+        self._vectors = [empty for _ in range(nlist)]
+        self._scales = [empty_scales for _ in range(nlist)]
+        self._labels = [np.zeros(0, dtype=np.int64) for _ in range(nlist)]
+        self._where = {}
+
+    @staticmethod
+    def _nearest_centroid(X: np.ndarray, C: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        out = np.empty(len(X), dtype=np.intp)
+        for s in range(0, len(X), chunk):
+            out[s:s + chunk] = np.argmax(X[s:s + chunk] @ C.T, axis=1)
+        return out
+
+    def add(self, labels, vectors: np.ndarray, scales: np.ndarray = None) -> None:
+        """
+        Insert vectors (the index must be trained).
+
+        Args:
+            labels: (N,) integer labels
+            vectors: (N, D) vectors, float32 or already in the index's storage dtype
+            scales: Row scales if vectors are int8
+        """
+        if not self.is_trained:
+            raise RuntimeError("IVFFlatIndex.add() before train()")
+        labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+        data = np.asarray(vectors).reshape(len(labels), self.dim)
+        X = dequantize_rows(data, scales).astype(np.float32, copy=False)
+        if data.dtype != np.dtype(self.storage):
+            data, scales = quantize_rows(X, self.storage)
+        assign = self._nearest_centroid(X, self.centroids)
+        for b in np.unique(assign):
+            rows = assign == b
+            self._vectors[b] = np.concatenate([self._vectors[b], data[rows]])
+            if scales is not None:
+                self._scales[b] = np.concatenate([self._scales[b], scales[rows]])
+            self._labels[b] = np.concatenate([self._labels[b], labels[rows]])
+            for label in np.unique(labels[rows]):
+                self._where.setdefault(int(label), set()).add(int(b))
+
+    def remove(self, labels) -> int:
+        """Delete every vector carrying one of these labels. Returns how many went."""
+        labels = {int(l) for l in np.asarray(labels).reshape(-1)}
+        buckets = set().union(*(self._where.pop(l, set()) for l in labels)) if labels else set()
+        removed = 0
+        drop = np.fromiter(labels, dtype=np.int64)
+        for b in buckets:
+            keep = ~np.isin(self._labels[b], drop)
+            removed += int((~keep).sum())
+            self._vectors[b] = self._vectors[b][keep]
+            if self._scales[b] is not None:
+                self._scales[b] = self._scales[b][keep]
+            self._labels[b] = self._labels[b][keep]
+        return removed
+
+    # ---- search -----------------------------------------------------------
+
+    def search(self, queries: np.ndarray, k: int = 1, nprobe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate k nearest vectors per query.
+
+        Returns:
+            labels: (F, k) int64, -1 where fewer than k vectors were scanned
+            distances: (F, k) float32 cosine distances, ascending (inf for -1)
+        """
+        Q = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        f = len(Q)
+        out_labels = np.full((f, k), -1, dtype=np.int64)
+        out_dists = np.full((f, k), np.inf, dtype=np.float32)
+        if not self.is_trained or f == 0 or k <= 0:
+            return out_labels, out_dists
+
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        coarse = Q @ self.centroids.T
+        if nprobe < self.nlist:
+            probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.nlist), (f, self.nlist))
+
+        for i in range(f):
+            sims, labs = [], []
+            for b in probes[i]:
+                if len(self._labels[b]):
+                    sims.append(similarities(Q[i:i + 1], self._vectors[b], self._scales[b])[0])
+                    labs.append(self._labels[b])
+            if not sims:
+                continue
+            sims = np.concatenate(sims)
+            labs = np.concatenate(labs)
+            kk = min(k, len(sims))
+            top = np.argpartition(-sims, kk - 1)[:kk] if kk < len(sims) else np.arange(len(sims))
+            top = top[np.argsort(-sims[top], kind="stable")]
+            out_labels[i, :kk] = labs[top]
+            out_dists[i, :kk] = 1.0 - sims[top]
+        return out_labels, out_dists
+
+    # ---- persistence ------------------------------------------------------
+
+    def save(self, path, **extra) -> None:
+        """
+        Write the index to an .npz (no pickled objects), atomically.
+
+        Args:
+            path: Output file
+            **extra: Additional arrays stored alongside (e.g. label names)
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        sizes = np.array([len(l) for l in self._labels], dtype=np.int64)
+        empty, empty_scales = quantize_rows(np.zeros((0, self.dim), dtype=np.float32), self.storage)
+        if empty_scales is not None:
+            scales = np.concatenate(self._scales) if self._scales else empty_scales
+        else:
+            scales = np.zeros(0, np.float32)
+        tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                format=np.int64(ANN_FORMAT_VERSION),
+                dim=np.int64(self.dim),
+                nprobe=np.int64(self.nprobe),
+                storage=np.array(self.storage),
+                centroids=self.centroids if self.is_trained else np.zeros((0, self.dim), np.float32),
+                offsets=np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+                vectors=np.concatenate(self._vectors) if self._vectors else empty,
+                scales=scales,
+                labels=np.concatenate(self._labels) if self._labels else np.zeros(0, np.int64),
+                **extra,
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path) -> Tuple["IVFFlatIndex", Dict[str, np.ndarray]]:
+        """
+        Read an index written by save().
+
+        Returns:
+            (index, extra arrays)
+
+        Raises:
+            ValueError: If the file isn't a compatible index
+        """
+        with np.load(str(path), allow_pickle=False) as data:
+            if int(data["format"]) != ANN_FORMAT_VERSION:
+                raise ValueError(f"{path}: unsupported ANN index format {int(data['format'])}")
+            index = cls(int(data["dim"]), nprobe=int(data["nprobe"]), storage=str(data["storage"]))
+            index.centroids = data["centroids"] if len(data["centroids"]) else None
+            index.nlist = len(data["centroids"])
+            offsets, vectors, labels = data["offsets"], data["vectors"], data["labels"]
+            scales = data["scales"] if index.storage == "int8" else None
+            for b in range(index.nlist):
+                s, e = offsets[b], offsets[b + 1]
+                index._vectors.append(np.ascontiguousarray(vectors[s:e]))
+                index._scales.append(scales[s:e].copy() if scales is not None else None)
+                index._labels.append(labels[s:e].copy())
+                for label in np.unique(labels[s:e]):
+                    index._where.setdefault(int(label), set()).add(b)
+            keys = {"format", "dim", "nprobe", "storage", "centroids", "offsets", "vectors", "scales", "labels"}
+            extra = {k: data[k] for k in data.files if k not in keys}
+        return index, extra
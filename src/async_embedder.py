@@ -0,0 +1,275 @@
+"""
+Asynchronous embedding service.
+Runs ArcFace inference on a background thread so the display / servo loop
+never blocks on session.run. Crops are tagged with frame and track IDs and
+results come back through futures and a result queue.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import config
+from .embed import EmbeddingBuffer
+
+
+@dataclass
+class EmbeddingResult:
+    """Embedding for one face crop."""
+    frame_id: int
+    track_id: int
+    embedding: np.ndarray  # (512,) L2-normalized float32 (view into a reused buffer, see poll)
+    norm: float  # Raw norm before L2 normalization
+    latency_ms: float  # Submit-to-result time
+
+
+@dataclass
+class _Job:
+    frame_id: int
+    track_ids: List[int]
+    crops: List[np.ndarray]
+    future: Future
+    submitted_at: float
+
+
+class AsyncEmbedder:
+    """
+    Background embedding worker around an ArcFaceEmbedder.
+
+    ONNX Runtime releases the GIL while running, so one worker thread overlaps
+    inference with rendering and tracking. Pending jobs are merged into a
+    single embed_batch() call. When the queue is full the oldest job is
+    dropped: a live loop only cares about the newest frames. Inference writes
+    into EmbeddingBuffers that are recycled once their results were polled,
+    so steady-state frames allocate no result arrays.
+    """
+
+    def __init__(
+        self,
+        embedder,
+        max_queue: int = config.ASYNC_EMBEDDING_MAX_QUEUE,
+        batch_size: int = config.EMBEDDING_BATCH_SIZE,
+        synchronous: bool = False,
+    ):
+        """
+        Args:
+            embedder: ArcFaceEmbedder instance
+            max_queue: Max pending jobs before the oldest is dropped
+            batch_size: Max crops merged into one inference call
+            synchronous: Run inference inline in submit() (no thread); results
+                         are then available from poll() right away
+        """
+        self.embedder = embedder
+        self.batch_size = max(1, batch_size)
+        self.synchronous = synchronous
+
+        self._jobs: "queue.Queue[_Job]" = queue.Queue(maxsize=max(1, max_queue))
+        self._results: "queue.Queue[Tuple[EmbeddingResult, EmbeddingBuffer]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._dropped = 0
+        self._completed = 0
+        self._last_latency_ms = 0.0
+        self._mean_latency_ms = 0.0
+        self._pending_tracks: Dict[int, int] = {}
+        self._dropped_tracks: List[int] = []  # Tracks whose crops produced no result, until dropped_tracks()
+        self._free_buffers: List[EmbeddingBuffer] = []
+        self._lent_buffers: List[EmbeddingBuffer] = []  # Rows handed out by the last poll()
+        self._unpolled: Dict[int, int] = {}  # id(buffer) -> its results not polled yet
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        if not synchronous:
+            self._thread = threading.Thread(target=self._worker, name="AsyncEmbedder", daemon=True)
+            self._thread.start()
+
+    def submit(self, crops: Sequence[np.ndarray], frame_id: int, track_ids: Sequence[int]) -> Future:
+        """
+        Queue aligned crops for embedding.
+
+        Args:
+            crops: Aligned 112x112 BGR crops
+            frame_id: Frame the crops were taken from
+            track_ids: Track ID for each crop
+
+        Returns:
+            Future resolving to a list of EmbeddingResult (cancelled if dropped)
+        """
+        if len(crops) != len(track_ids):
+            raise ValueError("crops and track_ids must have the same length")
+
+        job = _Job(frame_id, list(track_ids), list(crops), Future(), time.perf_counter())
+        with self._stats_lock:
+            self._in_flight += len(job.crops)
+            for tid in job.track_ids:
+                self._pending_tracks[tid] = self._pending_tracks.get(tid, 0) + 1
+
+        if self.synchronous:
+            self._run([job])
+            return job.future
+
+        while True:
+            try:
+                self._jobs.put_nowait(job)
+                break
+            except queue.Full:
+                try:
+                    stale = self._jobs.get_nowait()
+                except queue.Empty:
+                    continue
+                stale.future.cancel()
+                with self._stats_lock:
+                    self._finish(stale)
+                    self._dropped += len(stale.crops)
+                    self._dropped_tracks.extend(stale.track_ids)
+        return job.future
+
+    def is_pending(self, track_id: int) -> bool:
+        """True if an embedding for this track is queued or running."""
+        with self._stats_lock:
+            return track_id in self._pending_tracks
+
+    def dropped_tracks(self) -> List[int]:
+        """
+        Track IDs whose crops were dropped, cancelled or failed since the last
+        call (each reported once). Their tracks should be re-requested rather
+        than wait for the refresh interval.
+        """
+        with self._stats_lock:
+            dropped, self._dropped_tracks = self._dropped_tracks, []
+        return dropped
+
+    def poll(self) -> List[EmbeddingResult]:
+        """
+        Return all results that completed since the last poll (non-blocking).
+        Their embeddings (and those of the futures) are views into reused
+        buffers, valid until the next poll(): copy the rows you keep.
+        """
+        with self._stats_lock:
+            self._free_buffers.extend(self._lent_buffers)
+            self._lent_buffers.clear()
+        out = []
+        while True:
+            try:
+                result, buf = self._results.get_nowait()
+            except queue.Empty:
+                return out
+            out.append(result)
+            with self._stats_lock:
+                left = self._unpolled.pop(id(buf)) - 1
+                if left:
+                    self._unpolled[id(buf)] = left
+                else:
+                    self._lent_buffers.append(buf)
+
+    def stats(self) -> Dict[str, float]:
+        """Queue depth, crops in flight, drops and latency (ms)."""
+        with self._stats_lock:
+            return {
+                "queue_depth": self._jobs.qsize(),
+                "in_flight": self._in_flight,
+                "dropped": self._dropped,
+                "completed": self._completed,
+                "last_latency_ms": self._last_latency_ms,
+                "mean_latency_ms": self._mean_latency_ms,
+            }
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Stop the worker thread and cancel the jobs still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            job.future.cancel()
+            with self._stats_lock:
+                self._finish(job)
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                job = self._jobs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            jobs = [job]
+            n = len(job.crops)
+            # Merge whatever else is already waiting into the same ONNX call
+            while n < self.batch_size:
+                try:
+                    more = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                jobs.append(more)
+                n += len(more.crops)
+            self._run(jobs)
+
+    def _run(self, jobs: List[_Job]):
+        # Futures cancelled by their caller while queued are skipped; the rest can no longer be
+        cancelled = [job for job in jobs if not job.future.set_running_or_notify_cancel()]
+        if cancelled:
+            with self._stats_lock:
+                for job in cancelled:
+                    self._finish(job)
+                    self._dropped_tracks.extend(job.track_ids)
+            jobs = [job for job in jobs if job not in cancelled]
+            if not jobs:
+                return
+        crops = [c for job in jobs for c in job.crops]
+        with self._stats_lock:
+            buf = self._free_buffers.pop() if self._free_buffers else EmbeddingBuffer(self.embedder.embedding_dim)
+        out, norms_out = buf.views(len(crops))
+        try:
+            embs, norms = self.embedder.embed_batch(crops, out=out, norms_out=norms_out)
+        except Exception as e:
+            with self._stats_lock:
+                self._free_buffers.append(buf)
+            for job in jobs:
+                job.future.set_exception(e)
+                with self._stats_lock:
+                    self._finish(job)
+                    self._dropped_tracks.extend(job.track_ids)
+            return
+        with self._stats_lock:
+            if crops:
+                self._unpolled[id(buf)] = len(crops)
+            else:
+                self._free_buffers.append(buf)
+
+        done = time.perf_counter()
+        row = 0
+        for job in jobs:
+            latency_ms = (done - job.submitted_at) * 1000.0
+            results = []
+            for track_id in job.track_ids:
+                r = EmbeddingResult(job.frame_id, track_id, embs[row], float(norms[row]), latency_ms)
+                results.append(r)
+                self._results.put((r, buf))
+                row += 1
+            job.future.set_result(results)
+
+            with self._stats_lock:
+                self._finish(job)
+                self._completed += len(job.crops)
+                self._last_latency_ms = latency_ms
+                if self._mean_latency_ms == 0.0:
+                    self._mean_latency_ms = latency_ms
+                else:
+                    self._mean_latency_ms = 0.9 * self._mean_latency_ms + 0.1 * latency_ms
+
+    def _finish(self, job: _Job):
+        """Release a job's in-flight accounting (caller holds _stats_lock)."""
+        self._in_flight -= len(job.crops)
+        for tid in job.track_ids:
+            left = self._pending_tracks.get(tid, 0) - 1
+            if left > 0:
+                self._pending_tracks[tid] = left
+            else:
+                self._pending_tracks.pop(tid, None)
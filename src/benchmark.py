@@ -0,0 +1,524 @@
+"""
+Performance benchmarks for the recognition pipeline.
+Run: python -m src.benchmark <command> [options]
+"""
+
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+import numpy as np
+import cv2
+
+from . import config
+from .embed import ArcFaceEmbedder
+from .model_registry import get_model_spec, registered_models
+
+
+def load_sample_crops(count: int) -> List[np.ndarray]:
+    """Aligned crops from data/enroll (random noise if nothing is enrolled)."""
+    crops = []
+    for path in sorted(config.ENROLL_DIR.glob("*/*.jpg")):
+        img = cv2.imread(str(path))
+        if img is not None and img.shape[:2] == config.EMBEDDING_INPUT_SIZE:
+            crops.append(img)
+        if len(crops) >= count:
+            break
+    rng = np.random.default_rng(0)
+    w, h = config.EMBEDDING_INPUT_SIZE
+    while len(crops) < count:
+        crops.append(rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8))
+    return crops
+
+
+def _latency_summary(times_ms: List[float]) -> str:
+    t = np.asarray(times_ms)
+    return (
+        f"p50={np.percentile(t, 50):6.2f} ms | "
+        f"p99={np.percentile(t, 99):6.2f} ms | "
+        f"max={t.max():6.2f} ms"
+    )
+
+
+def bench_alloc(model_path, faces: int, frames: int) -> None:
+    """
+    Compare per-frame allocations and latency of the live embedding path
+    (AsyncEmbedder.submit + poll, as in recognize) with fresh output arrays
+    per call (before) and reused EmbeddingBuffers (after), with and without
+    IO binding. Allocations are NumPy/Python heap bytes seen by tracemalloc;
+    ONNX Runtime's own arena is not included.
+    """
+    from .async_embedder import AsyncEmbedder
+
+    crops = load_sample_crops(faces)
+    track_ids = list(range(faces))
+    saved = config.EMBEDDING_IO_BINDING
+
+    class _FreshOutputs:
+        """Embedder wrapper dropping the reused buffers: the path before them."""
+
+        def __init__(self, embedder):
+            self.embedder = embedder
+            self.embedding_dim = embedder.embedding_dim
+
+        def embed_batch(self, aligned_list, **_):
+            return self.embedder.embed_batch(aligned_list)
+
+    print("\n" + "="*60)
+    print(f"EMBEDDING ALLOCATIONS ({faces} face(s)/frame, {frames} frames, live path)")
+    print("="*60)
+
+    try:
+        for binding in (False, True):
+            config.EMBEDDING_IO_BINDING = binding
+            embedder = ArcFaceEmbedder(model_path)
+            for label, wrapped in (("fresh outputs (before)", _FreshOutputs(embedder)),
+                                   ("reused buffers (after)", embedder)):
+                service = AsyncEmbedder(wrapped, synchronous=True)
+                for i in range(5):  # warm-up: buffers, arena, caches
+                    service.submit(crops, i, track_ids)
+                    service.poll()
+
+                tracemalloc.start()
+                transient, times = [], []
+                for i in range(frames):
+                    base, _ = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                    t = time.perf_counter()
+                    service.submit(crops, i, track_ids)
+                    service.poll()
+                    times.append((time.perf_counter() - t) * 1000.0)
+                    _, peak = tracemalloc.get_traced_memory()
+                    transient.append(peak - base)
+                tracemalloc.stop()
+                service.close()
+
+                print(f"\n{'IO binding' if binding else 'session.run'}, {label}")
+                print(f"  Allocated per frame: mean={np.mean(transient) / 1024:8.1f} KiB | "
+                      f"max={np.max(transient) / 1024:8.1f} KiB")
+                print(f"  Latency: {_latency_summary(times)}")
+    finally:
+        config.EMBEDDING_IO_BINDING = saved
+
+    print("="*60)
+
+
+def bench_models(names: List[str], threshold: float, runs: int) -> bool:
+    """
+    Latency and evaluate-style accuracy of each registered embedding model
+    on the enrollment crops.
+    """
+    from .evaluate import load_people_data, embed_people, distance_distributions, far_frr, best_threshold
+    from .offline_embed import OfflineEmbedder
+
+    specs = [get_model_spec(n) for n in names] if names else registered_models()
+    people_data = load_people_data() if config.ENROLL_DIR.exists() else {}
+    crops = load_sample_crops(5)
+
+    print("\n" + "="*60)
+    print(f"EMBEDDING MODELS ({len(people_data)} enrolled people, threshold {threshold:.2f})")
+    print("="*60)
+
+    rows = []
+    for spec in specs:
+        print(f"\n{spec.name}: {spec.description}")
+        if not spec.exists():
+            print(f"  ⚠ Skipped: {spec.path} not found")
+            continue
+        embedder = ArcFaceEmbedder(spec.path, quantized=False)
+        embedder.warm_up()
+
+        single, batch = [], []
+        for _ in range(runs):
+            t = time.perf_counter()
+            embedder.embed(crops[0])
+            single.append((time.perf_counter() - t) * 1000.0)
+            t = time.perf_counter()
+            embedder.embed_batch(crops)
+            batch.append((time.perf_counter() - t) * 1000.0)
+        print(f"  1 face:  {_latency_summary(single)}")
+        print(f"  5 faces: {_latency_summary(batch)}")
+
+        row = {"name": spec.name, "p50_ms": float(np.percentile(single, 50))}
+        epp = embed_people(OfflineEmbedder(spec.path, quantized=False, verbose=False), people_data)
+        if len(epp) >= 2:
+            genuine, impostor = distance_distributions(epp)
+            far, frr = far_frr(genuine, impostor, threshold)
+            best = best_threshold(genuine, impostor)
+            row.update(far=far, frr=frr, best=best)
+            print(f"  At {threshold:.2f}: FAR {far:6.2f}% | FRR {frr:6.2f}%")
+            if best is not None:
+                print(f"  Recommended threshold: {best[0]:.2f} "
+                      f"(FAR {best[1]:.2f}% | FRR {best[2]:.2f}%)")
+            else:
+                print(f"  No threshold met target FAR ({config.TARGET_FAR*100:.2f}%)")
+        else:
+            print("  Accuracy: n/a (enroll at least 2 people)")
+        rows.append(row)
+
+    if rows:
+        print("\n" + "-"*60)
+        print(f"{'Model':<16} | {'1-face p50':>10} | {'FAR (%)':>7} | {'FRR (%)':>7}")
+        print("-"*60)
+        for r in rows:
+            far = f"{r['far']:7.2f}" if "far" in r else f"{'n/a':>7}"
+            frr = f"{r['frr']:7.2f}" if "frr" in r else f"{'n/a':>7}"
+            print(f"{r['name']:<16} | {r['p50_ms']:7.2f} ms | {far} | {frr}")
+    print("="*60)
+    return bool(rows)
+
+
+def synthetic_gallery(identities: int, dim: int = config.EMBEDDING_DIM, seed: int = 0) -> np.ndarray:
+    """
+    (N, D) normalized stand-in embeddings with some cluster structure
+    (groups of ~200 identities share a direction, like real face embeddings).
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((identities // 200 + 1, dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    G = centres[rng.integers(0, len(centres), identities)]
+    G += 1.7 * rng.standard_normal((identities, dim)).astype(np.float32) / np.sqrt(dim)
+    return G / np.linalg.norm(G, axis=1, keepdims=True)
+
+
+def synthetic_probes(G: np.ndarray, count: int, distance: float, seed: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Genuine probes: noisy copies of random gallery rows at about `distance`.
+
+    Returns:
+        (probes (count, D), true row per probe)
+    """
+    rng = np.random.default_rng(seed)
+    truth = rng.integers(0, len(G), count)
+    sigma = np.sqrt(1.0 / (1.0 - distance) ** 2 - 1.0)
+    Q = G[truth] + sigma * rng.standard_normal((count, G.shape[1])).astype(np.float32) / np.sqrt(G.shape[1])
+    return Q / np.linalg.norm(Q, axis=1, keepdims=True), truth
+
+
+def bench_ann(identities: int, probes: int, nprobes: List[int], threshold: float) -> None:
+    """
+    ANN (IVF) vs brute-force gallery search on a synthetic gallery:
+    build time, per-face latency and recall@1 at the recognition threshold.
+    """
+    from .gallery import FaceGallery
+
+    G = synthetic_gallery(identities)
+    Q, _ = synthetic_probes(G, probes, distance=0.6 * threshold)
+    gallery = FaceGallery({f"id{i:07d}": g for i, g in enumerate(G)}, template_budget=1, build_index=False)
+
+    print("\n" + "="*60)
+    print(f"ANN GALLERY SEARCH ({identities} identities, {probes} probes, threshold {threshold:.2f})")
+    print("="*60)
+
+    saved = config.GALLERY_ANN_MIN_TEMPLATES
+    config.GALLERY_ANN_MIN_TEMPLATES = 0
+    try:
+        t = time.perf_counter()
+        gallery.build_index()
+        print(f"\nIndex build: {time.perf_counter() - t:.1f}s ({gallery.ann.nlist} buckets)")
+    finally:
+        config.GALLERY_ANN_MIN_TEMPLATES = saved
+
+    exact_idx, exact_ms = [], []
+    for q in Q:
+        t = time.perf_counter()
+        idx, dists = gallery.search(q[None, :], exact=True)
+        exact_ms.append((time.perf_counter() - t) * 1000.0)
+        exact_idx.append(idx[0, 0] if dists[0, 0] <= threshold else -1)
+    exact_idx = np.asarray(exact_idx)
+    matched = exact_idx >= 0
+    print(f"Brute force:      {_latency_summary(exact_ms)} ({int(matched.sum())}/{probes} probes within threshold)")
+
+    print(f"\n{'nprobe':>6} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | {'speed-up':>8} | {'recall@1':>8}")
+    print("-"*60)
+    for nprobe in nprobes:
+        gallery.ann.nprobe = nprobe
+        times, hits = [], 0
+        for q, want in zip(Q, exact_idx):
+            t = time.perf_counter()
+            idx, dists = gallery.search(q[None, :])
+            times.append((time.perf_counter() - t) * 1000.0)
+            hits += int(want >= 0 and idx[0, 0] == want and dists[0, 0] <= threshold)
+        recall = hits / max(1, int(matched.sum()))
+        print(f"{nprobe:>6} | {np.percentile(times, 50):8.2f} | {np.percentile(times, 99):8.2f} | "
+              f"{np.percentile(exact_ms, 50) / np.percentile(times, 50):7.1f}x | {recall:8.3f}")
+    print("="*60)
+
+
+def bench_storage(identities: int, probes: int, threshold: float) -> None:
+    """
+    Gallery memory, exact-search latency and top-1 agreement with float32
+    for each storage precision, on a synthetic gallery.
+    """
+    from .gallery import FaceGallery
+    from .matching import STORAGE_DTYPES
+
+    G = synthetic_gallery(identities)
+    Q, _ = synthetic_probes(G, probes, distance=0.6 * threshold)
+    embeddings = {f"id{i:07d}": g for i, g in enumerate(G)}
+
+    print("\n" + "="*60)
+    print(f"GALLERY STORAGE ({identities} identities, {probes} probes)")
+    print("="*60)
+    print(f"\n{'storage':>7} | {'memory (MB)':>11} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | {'vs float32':>10} | "
+          f"{'top-1 agree':>11} | {'max |Δd|':>8}")
+    print("-"*85)
+    reference, base_p50 = None, None
+    for storage in STORAGE_DTYPES:
+        gallery = FaceGallery(embeddings, template_budget=1, build_index=False, storage=storage)
+        times, idx, dists = [], [], []
+        for q in Q:
+            t = time.perf_counter()
+            i, d = gallery.search(q[None, :], exact=True)
+            times.append((time.perf_counter() - t) * 1000.0)
+            idx.append(i[0, 0])
+            dists.append(d[0, 0])
+        idx, dists = np.asarray(idx), np.asarray(dists)
+        p50 = float(np.percentile(times, 50))
+        if reference is None:
+            reference, base_p50 = (idx, dists), p50
+        agree = float(np.mean(idx == reference[0]))
+        delta = float(np.abs(dists - reference[1]).max()) if len(dists) else 0.0
+        print(f"{storage:>7} | {gallery.nbytes / 1e6:11.1f} | {p50:8.2f} | "
+              f"{np.percentile(times, 99):8.2f} | {p50 / base_p50:9.2f}x | {agree:11.3f} | {delta:8.5f}")
+    print("\nfloat16 only saves memory: converting it costs more than the smaller read saves,")
+    print("so it scans slower than float32. int8 saves more memory and closes in on float32")
+    print("speed once the gallery no longer fits in cache (~50k identities and up).")
+    print("="*60)
+
+
+def bench_shards(identities: int, probes: int, faces: int, shard_counts: List[int], storage: str) -> None:
+    """
+    Parallel sharded exact search vs the single-threaded scan on a synthetic
+    gallery: per-frame latency for each shard count and agreement with the scan.
+    """
+    from .gallery import FaceGallery
+    from .gallery_shards import ShardedSearch, auto_shards, available_cores
+
+    G = synthetic_gallery(identities)
+    Q, _ = synthetic_probes(G, probes * faces, distance=0.3)
+    frames = Q.reshape(probes, faces, -1)
+    saved = config.GALLERY_SEARCH_SHARDS
+    config.GALLERY_SEARCH_SHARDS = 1
+    try:
+        gallery = FaceGallery({f"id{i:07d}": g for i, g in enumerate(G)}, template_budget=1,
+                              build_index=False, storage=storage)
+    finally:
+        config.GALLERY_SEARCH_SHARDS = saved
+    del G
+
+    cores = available_cores()
+    auto = auto_shards(len(gallery.matrix), cores)
+    print("\n" + "="*60)
+    print(f"SHARDED EXACT SEARCH ({identities} identities, {storage}, {faces} face(s)/frame, "
+          f"{cores} core(s), auto = {auto} shard(s))")
+    print("="*60)
+
+    def run(search):
+        times, idx = [], []
+        for frame in frames:
+            t = time.perf_counter()
+            i, _ = search(frame, 5)
+            times.append((time.perf_counter() - t) * 1000.0)
+            idx.append(i)
+        return np.asarray(times), np.concatenate(idx)
+
+    base_ms, base_idx = run(lambda q, k: gallery.search(q, k, exact=True))
+    print(f"\n{'shards':>6} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | {'speed-up':>8} | {'top-5 agree':>11}")
+    print("-"*60)
+    print(f"{'scan':>6} | {np.percentile(base_ms, 50):8.2f} | {np.percentile(base_ms, 99):8.2f} | "
+          f"{1.0:7.1f}x | {1.0:11.3f}")
+    for count in sorted(set(shard_counts or [2, 4, 8, cores]) | {auto}):
+        sharded = ShardedSearch(gallery.offsets, gallery.matrix, gallery.scales, count)
+        ms, idx = run(sharded.search)
+        label = f"{len(sharded)}{'*' if count == auto else ''}"
+        print(f"{label:>6} | {np.percentile(ms, 50):8.2f} | {np.percentile(ms, 99):8.2f} | "
+              f"{np.percentile(base_ms, 50) / np.percentile(ms, 50):7.1f}x | {np.mean(idx == base_idx):11.3f}")
+    print("* = GALLERY_SEARCH_SHARDS = 0 (auto) on this machine")
+    print("="*60)
+
+
+def bench_lock(identities: int, probes: int, threshold: float) -> None:
+    """
+    Lock-target fast path (identify_target) vs full identify() on a synthetic
+    gallery: per-face latency, share of faces decided on the target's
+    templates alone, and agreement of the lock decision.
+    """
+    from .gallery import FaceGallery
+
+    G = synthetic_gallery(identities)
+    gallery = FaceGallery({f"id{i:07d}": g for i, g in enumerate(G)}, template_budget=1, build_index=False)
+    target = gallery.names[0]
+    genuine, _ = synthetic_probes(G[:1], probes // 2, distance=0.6 * threshold)
+    others, _ = synthetic_probes(G[1:], probes - len(genuine), distance=0.6 * threshold, seed=2)
+    Q = np.concatenate([genuine, others])
+
+    print("\n" + "="*60)
+    print(f"LOCK-TARGET FAST PATH ({identities} identities, {probes} faces, half of them the target)")
+    print("="*60)
+    t = time.perf_counter()
+    gallery._target_separation(gallery.index(target))
+    print(f"\nTarget separation (once per gallery change): {(time.perf_counter() - t) * 1000.0:.1f} ms")
+
+    full_ms, fast_ms, agree = [], [], 0
+    for q in Q:
+        t = time.perf_counter()
+        full = gallery.identify(q[None, :])[0]
+        full_ms.append((time.perf_counter() - t) * 1000.0)
+        t = time.perf_counter()
+        fast = gallery.identify_target(q[None, :], target, threshold)[0]
+        fast_ms.append((time.perf_counter() - t) * 1000.0)
+        agree += (full.name == target and full.accepted(threshold)) == \
+                 (fast.name == target and fast.accepted(threshold))
+    _, _, unsure = gallery.check_target(Q, target, threshold)
+    print(f"identify():        {_latency_summary(full_ms)}")
+    print(f"identify_target(): target faces {_latency_summary(fast_ms[:len(genuine)])}")
+    print(f"                   other faces  {_latency_summary(fast_ms[len(genuine):])}")
+    print(f"\nShort-circuited: target faces {int((~unsure[:len(genuine)]).sum())}/{len(genuine)}, "
+          f"other faces {int((~unsure[len(genuine):]).sum())}/{len(Q) - len(genuine)} | "
+          f"lock decision agreement: {agree / len(Q):.3f}")
+    print("="*60)
+
+
+# CLI entry points whose import cost matters (service restarts, quick tools)
+IMPORT_PROFILE_MODULES = [
+    "src.recognize",
+    "src.recognize_with_tracking",
+    "src.lock",
+    "src.enroll",
+    "src.evaluate",
+    "src.view_activity_logs",
+]
+
+# Third-party packages reported individually
+HEAVY_DEPENDENCIES = ["numpy", "cv2", "onnxruntime", "mediapipe", "paho"]
+
+
+def profile_import(module: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        total_ms: Cumulative import time of the module
+        deps_ms: Cumulative time of each HEAVY_DEPENDENCIES package it pulled in
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=str(config.PROJECT_ROOT),
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        last = proc.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        raise RuntimeError(f"import {module} failed: {last[0]}")
+
+    total_ms, deps_ms = 0.0, {}
+    for line in proc.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        cumulative_ms = int(parts[1]) / 1000.0
+        name = parts[2].strip()
+        if name == module:
+            total_ms = cumulative_ms
+        elif name in HEAVY_DEPENDENCIES and name not in deps_ms:
+            deps_ms[name] = cumulative_ms
+    return total_ms, deps_ms
+
+
+def bench_imports(modules: List[str], repeat: int) -> None:
+    """Print import time per CLI module and which heavy dependencies it loads."""
+    print("\n" + "="*60)
+    print(f"IMPORT TIME (median of {repeat} fresh interpreter(s))")
+    print("="*60)
+
+    for module in modules:
+        try:
+            runs = [profile_import(module) for _ in range(repeat)]
+        except RuntimeError as e:
+            print(f"\n{module}: ERROR: {e}")
+            continue
+        total = float(np.median([r[0] for r in runs]))
+        deps = runs[-1][1]
+        print(f"\n{module}: {total:7.1f} ms")
+        for dep in HEAVY_DEPENDENCIES:
+            if dep in deps:
+                print(f"  {dep:<12} {deps[dep]:7.1f} ms")
+        lazy = [d for d in ("onnxruntime", "mediapipe") if d not in deps]
+        if lazy:
+            print(f"  (not imported: {', '.join(lazy)})")
+
+    print("\n" + "="*60)
+
+
+def main():
+    """Command-line entry point."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Face recognition pipeline benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_alloc = sub.add_parser("alloc", help="Per-frame allocations of the live embedding path")
+    p_alloc.add_argument("--model", default=str(config.ARCFACE_MODEL_PATH))
+    p_alloc.add_argument("--faces", type=int, default=2, help="Faces per frame")
+    p_alloc.add_argument("--frames", type=int, default=200)
+
+    p_models = sub.add_parser("models", help="Latency and accuracy of each registered embedding model")
+    p_models.add_argument("models", nargs="*", help="Registry names (default: all)")
+    p_models.add_argument("--threshold", type=float, default=config.DEFAULT_DISTANCE_THRESHOLD)
+    p_models.add_argument("--runs", type=int, default=50)
+
+    p_imports = sub.add_parser("imports", help="Import time of each CLI module")
+    p_imports.add_argument("modules", nargs="*", default=IMPORT_PROFILE_MODULES)
+    p_imports.add_argument("--repeat", type=int, default=3)
+
+    p_ann = sub.add_parser("ann", help="ANN index vs brute-force gallery search (recall and latency)")
+    p_ann.add_argument("--identities", type=int, default=200000)
+    p_ann.add_argument("--probes", type=int, default=200)
+    p_ann.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32, 64])
+    p_ann.add_argument("--threshold", type=float, default=config.DEFAULT_DISTANCE_THRESHOLD)
+
+    p_storage = sub.add_parser("storage", help="float32 vs float16 vs int8 gallery memory, latency and accuracy")
+    p_storage.add_argument("--identities", type=int, default=100000)
+    p_storage.add_argument("--probes", type=int, default=200)
+    p_storage.add_argument("--threshold", type=float, default=config.DEFAULT_DISTANCE_THRESHOLD)
+
+    p_shards = sub.add_parser("shards", help="Parallel sharded vs single-threaded exact gallery search")
+    p_shards.add_argument("--identities", type=int, default=300000)
+    p_shards.add_argument("--probes", type=int, default=100, help="Frames searched")
+    p_shards.add_argument("--faces", type=int, default=1, help="Faces per frame")
+    p_shards.add_argument("--shards", type=int, nargs="*", default=[], help="Shard counts (default: 2 4 8 cores)")
+    p_shards.add_argument("--storage", default="float32", choices=["float32", "float16", "int8"])
+
+    p_lock = sub.add_parser("lock", help="Lock-target fast path vs full open-set search")
+    p_lock.add_argument("--identities", type=int, default=100000)
+    p_lock.add_argument("--probes", type=int, default=200)
+    p_lock.add_argument("--threshold", type=float, default=config.DEFAULT_DISTANCE_THRESHOLD)
+
+    args = parser.parse_args()
+
+    if args.command == "alloc":
+        bench_alloc(args.model, args.faces, args.frames)
+    elif args.command == "imports":
+        bench_imports(args.modules, max(1, args.repeat))
+    elif args.command == "models":
+        return bench_models(args.models, args.threshold, max(1, args.runs))
+    elif args.command == "ann":
+        bench_ann(args.identities, args.probes, args.nprobe, args.threshold)
+    elif args.command == "storage":
+        bench_storage(args.identities, args.probes, args.threshold)
+    elif args.command == "lock":
+        bench_lock(args.identities, args.probes, args.threshold)
+    elif args.command == "shards":
+        bench_shards(args.identities, args.probes, max(1, args.faces), args.shards, args.storage)
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -22,11 +22,41 @@ HISTORY_DIR = DATA_DIR / "history"
 ACTIVITY_LOGS_DIR = HISTORY_DIR  # Alias for backward compatibility
 
 # Database files
-DB_NPZ_PATH = DB_DIR / "face_db.npz"
-DB_JSON_PATH = DB_DIR / "face_db.json"
+DB_PATH = DB_DIR / "face_db.fdb"  # Versioned database (src/face_db.py)
+DB_NPZ_PATH = DB_DIR / "face_db.npz"  # Legacy database, migrated to DB_PATH on first load
+DB_JSON_PATH = DB_DIR / "face_db.json"  # Legacy metadata
+DB_JOURNAL_PATH = DB_DIR / "face_db.journal"  # Changes since the last full write (src/face_journal.py)
+DB_LOCK_PATH = DB_DIR / "face_db.lock"  # Serializes commits across processes
+
+# Embedding model registry (see src/model_registry.py).
+# Each entry describes how to run one ONNX face embedder.
+EMBEDDING_MODELS = {
+    "arcface_r50": {
+        "path": MODELS_DIR / "embedder_arcface.onnx",
+        "input_size": (112, 112),  # (width, height) fed to the network
+        "mean": 127.5,  # x = (pixel - mean) / scale
+        "scale": 128.0,
+        "channels": "rgb",  # Channel order the network expects
+        "embedding_dim": 512,
+        "sha256": None,  # Optional: pin the exact file (refuse anything else at this path)
+        "description": "InsightFace w600k_r50 (accurate, heavy; strong nodes)",
+    },
+    "mobilefacenet": {
+        "path": MODELS_DIR / "embedder_mobilefacenet.onnx",
+        "input_size": (112, 112),
+        "mean": 127.5,
+        "scale": 128.0,
+        "channels": "rgb",
+        "embedding_dim": 512,
+        "sha256": None,
+        "description": "InsightFace w600k_mbf, MobileFaceNet-class (fast; weak nodes)",
+    },
+}
+EMBEDDING_MODEL = "arcface_r50"  # Active model (key of EMBEDDING_MODELS)
+LEGACY_GALLERY_MODEL = "arcface_r50"  # Model assumed for galleries saved without a model tag
 
 # ONNX Model paths
-ARCFACE_MODEL_PATH = MODELS_DIR / "embedder_arcface.onnx"
+ARCFACE_MODEL_PATH = EMBEDDING_MODELS[EMBEDDING_MODEL]["path"]  # Active model file
 
 # ============================================================================
 # FACE DETECTION SETTINGS
@@ -74,10 +104,30 @@ EMBEDDING_INPUT_SIZE = (112, 112)
 EMBEDDING_DIM = 512
 EMBEDDING_NORM_EPSILON = 1e-12
 ONNX_EXECUTION_PROVIDER = "CPUExecutionProvider"
+EMBEDDING_BATCH_SIZE = 32  # Max aligned crops per ONNX call in embed_batch()
+EMBEDDING_IO_BINDING = True  # Reuse preallocated input/output buffers via ORT IO binding
+
+# ONNX Runtime session tuning (0 = let ONNX Runtime decide)
+ONNX_INTRA_OP_THREADS = 0  # Threads used inside one operator (e.g. a conv)
+ONNX_INTER_OP_THREADS = 0  # Threads used across operators (parallel mode only)
+ONNX_EXECUTION_MODE = "sequential"  # "sequential" or "parallel"
+ONNX_GRAPH_OPTIMIZATION_LEVEL = "all"  # "disable", "basic", "extended", "all"
+ONNX_ENABLE_MEM_ARENA = True  # CPU memory arena (faster, holds on to memory)
+ONNX_ENABLE_MEM_PATTERN = True  # Pre-plan allocations for fixed input shapes
+ONNX_CACHE_OPTIMIZED_MODEL = True  # Save optimized graph next to the model and reuse it (saved at "extended" when "all": portable across CPUs)
+
+# INT8 quantized embedder (built by: python -m src.quantize)
+EMBEDDING_USE_INT8 = False  # Load embedder_arcface_int8.onnx instead of the FP32 model
+QUANT_MODE = "static"  # "static" (calibrated QDQ, fastest on CPU) or "dynamic"
+QUANT_CALIBRATION_CROPS_PER_PERSON = 20  # Enrollment crops per person used for calibration
+QUANT_MAX_FAR_INCREASE = 0.5  # Accuracy gate: max FAR increase (percentage points)
+QUANT_MAX_FRR_INCREASE = 2.0  # Accuracy gate: max FRR increase (percentage points)
+QUANT_MIN_EMBEDDING_COSINE = 0.98  # Accuracy gate: mean cos(FP32, INT8) per crop
 
 # Preprocessing constants (standard for ArcFace/InsightFace)
 EMBEDDING_PREPROCESS_MEAN = 127.5
 EMBEDDING_PREPROCESS_SCALE = 128.0
+EMBEDDING_PREPROCESS_VERSION = 1  # Bump when preprocessing code changes (invalidates cached embeddings)
 
 # ============================================================================
 # ENROLLMENT SETTINGS
@@ -86,6 +136,16 @@ EMBEDDING_PREPROCESS_SCALE = 128.0
 SAMPLES_NEEDED_FOR_ENROLLMENT = 15
 MIN_SAMPLES_TO_SAVE = 3
 MAX_EXISTING_CROPS_PER_PERSON = 300
+
+# Offline (bulk) embedding of saved crops: enrollment re-scan, evaluation
+OFFLINE_EMBED_WORKERS = 0  # Inference processes (0 = auto: half the CPU cores)
+OFFLINE_DECODE_THREADS = 4  # Threads decoding JPEGs
+OFFLINE_MIN_CROPS_FOR_POOL = 64  # Smaller jobs run in-process (no worker start-up cost)
+
+# Persistent cache of crop embeddings (reused by enroll, evaluate and tests)
+EMBED_CACHE_ENABLED = True
+EMBED_CACHE_DIR = DATA_DIR / "cache" / "embeddings"
+EMBED_CACHE_KEY = "stat"  # "stat" (path + size + mtime) or "content" (SHA-1 of the file)
 AUTO_CAPTURE_INTERVAL_SECONDS = 0.25
 SAVE_ENROLLMENT_CROPS = True
 
@@ -98,15 +158,78 @@ SIMILARITY_THRESHOLD = 0.66  # 1 - distance_threshold (for reference)
 TARGET_FAR = 0.01  # 1% False Accept Rate for threshold tuning
 THRESHOLD_SWEEP_RANGE = (0.10, 1.20, 0.01)  # (start, end, step)
 
+# Open-set decision
+MATCH_MIN_MARGIN = 0.04  # Reject if the 2nd-nearest identity is within this distance of the nearest
+IDENTITY_THRESHOLDS_ENABLED = True  # Per-identity thresholds from `evaluate --save-thresholds` (face_db.fdb)
+IDENTITY_THRESHOLD_MAX_DELTA = 0.08  # Calibrated thresholds stay within this of DEFAULT_DISTANCE_THRESHOLD
+IDENTITY_THRESHOLD_MIN_SAMPLES = 5  # Fewer samples than this: identity keeps the global threshold
+
+# Scoped search
+WATCHLIST = None  # Named watchlist this camera searches (see src/watchlist.py; None = whole gallery)
+LOCK_FAST_PATH = True  # With a lock, check faces against the locked person's templates first (others show as "not <target>")
+
 # ============================================================================
 # RECOGNITION PIPELINE OPTIMIZATION
 # ============================================================================
 
 PROCESS_EVERY_N_FRAMES = 2  # Skip frames for detection (1 = every frame)
 ROI_MARGIN_FACTOR = 0.25  # Expand ROI by this fraction of width/height
-SMOOTHING_WINDOW = 5  # Temporal smoothing for stability
+SMOOTHING_WINDOW = 5  # Embeddings averaged per track into the query vector
 ACCEPT_HOLD_FRAMES = 3  # Hold "accepted" state for N frames
 
+# Face tracking across frames (src/face_tracker.py)
+TRACK_MIN_IOU = 0.3  # Min box overlap to continue a track
+TRACK_MAX_MISSED_FRAMES = 15  # Drop a track after this many frames unseen
+
+# Per-track embedding reuse: re-embed only on schedule or significant change
+EMBED_REFRESH_FRAMES = 30  # Re-embed a stable face at least this often
+EMBED_POSE_TOLERANCE = 0.12  # Max landmark shift (x eye distance) before re-embedding
+EMBED_SCALE_TOLERANCE = 0.15  # Max relative eye-distance change before re-embedding
+TRACK_EMBEDDING_RESET_DISTANCE = 0.6  # New embedding this far from the track's mean = new person
+
+# Background embedding (src/async_embedder.py)
+ASYNC_EMBEDDING = True  # Run ArcFace off the display loop; faces keep their last identity meanwhile
+ASYNC_EMBEDDING_MAX_QUEUE = 4  # Pending jobs before the oldest frame is dropped
+
+# ============================================================================
+# GALLERY SETTINGS
+# ============================================================================
+
+# Templates per identity (src/gallery.py). With a budget > 1, enrollment keeps
+# every sample up to the budget and clusters down to it beyond.
+GALLERY_TEMPLATE_BUDGET = 1  # Max templates kept per identity (1 = one mean template)
+GALLERY_TEMPLATE_AGGREGATION = "max"  # Identity score over its templates: "max" or "topk_mean"
+GALLERY_TEMPLATE_TOP_K = 3  # Best templates averaged by "topk_mean"
+
+# In-memory precision of gallery templates (face_db.fdb stays float32)
+GALLERY_STORAGE_DTYPE = "float32"  # "float32", "float16" (2x smaller, memory only: ~2x slower scans) or "int8" (4x, per-template scale, float32 speed)
+GALLERY_SCAN_CHUNK_ROWS = 512  # float16/int8 templates converted per block while scoring (cache-sized)
+GALLERY_MMAP_ENABLED = True  # Load via a memory-mapped copy (DB_DIR/face_db.<storage>.gallery, see src/gallery_file.py)
+GALLERY_SEARCH_SHARDS = 0  # Exact-search threads (0 = one per core, 1 = single-threaded scan; src/gallery_shards.py)
+GALLERY_SHARD_MIN_ROWS = 32768  # Smallest shard; galleries under twice this are scanned on one thread
+
+# Journaled commits (src/face_journal.py)
+DB_JOURNAL_ENABLED = True  # Saves append changed identities to DB_JOURNAL_PATH instead of rewriting the database
+DB_JOURNAL_COMPACT_ENTRIES = 64  # Fold the journal into the database once it holds this many entries
+
+# Hot reload in the live loops (src/gallery_watcher.py)
+GALLERY_WATCH_ENABLED = True  # Pick up enrollments made elsewhere without pressing 'r'
+GALLERY_WATCH_INTERVAL_S = 2.0  # Seconds between checks of the database files' size/mtime
+
+# Shared-memory gallery for worker pools (src/shared_gallery.py)
+SHARED_GALLERY_ENABLED = False  # load() attaches to the snapshot of `python -m src.shared_gallery` if running
+SHARED_GALLERY_NAME = "facegal"  # Shared-memory name prefix (one owner per name)
+SHARED_GALLERY_KEEP = 2  # Newest snapshots kept linked so workers mid-attach never miss theirs
+
+# Approximate search for very large galleries (src/ann_index.py, IVF-flat)
+GALLERY_ANN_ENABLED = True  # Use the index once the gallery reaches GALLERY_ANN_MIN_TEMPLATES
+GALLERY_ANN_MIN_TEMPLATES = 50000  # Below this, exact search is fast enough
+GALLERY_ANN_NLIST = 0  # Buckets (0 = auto: ~4 x sqrt(templates))
+GALLERY_ANN_NPROBE = 32  # Buckets scanned per query (higher = better recall, slower)
+GALLERY_ANN_CANDIDATES = 32  # Templates fetched from the index, then re-ranked exactly
+GALLERY_ANN_TRAIN_POINTS_PER_LIST = 32  # k-means training sample per bucket
+GALLERY_ANN_INDEX_PATH = DB_DIR / "face_db.ivf.npz"  # Saved index (rebuilt if the DB changed)
+
 # ============================================================================
 # CAMERA SETTINGS
 # ============================================================================
@@ -115,6 +238,12 @@ CAMERA_INDEX = 2 # Default: first camera
 CAMERA_FRAME_WIDTH = 640
 CAMERA_FRAME_HEIGHT = 480
 CAMERA_FPS_TARGET = 30
+CAMERA_OPEN_ATTEMPTS = 3
+CAMERA_OPEN_RETRY_DELAY = 0.5  # Seconds between attempts to open the camera
+
+# Startup (src/startup.py)
+PARALLEL_STARTUP = True  # Load DB, detector, embedder, camera and MQTT concurrently
+STARTUP_WARMUP_RUNS = 2  # Dummy inferences per model before the first real frame
 
 # ============================================================================
 # DISPLAY SETTINGS
@@ -158,6 +287,7 @@ MQTT_BROKER_HOST = "157.173.101.159"  # Your MQTT broker IP
 MQTT_BROKER_PORT = 1883
 MQTT_USERNAME = None  # Optional: Set if broker requires authentication
 MQTT_PASSWORD = None  # Optional: Set if broker requires authentication
+MQTT_CONNECT_TIMEOUT = 1.5  # Max seconds to wait for the broker at startup
 
 # MQTT Topics
 MQTT_TOPIC_HORIZONTAL = "camera/track/horizontal"
@@ -189,6 +319,13 @@ SAVE_DEBUG_FRAMES = False
 REQUIRE_ALIGNED_CROP_SIZE = (112, 112)
 MIN_FACE_BBOX_AREA = 60 * 60  # Minimum 60x60 for detection
 
+# Face-quality gate (src/quality.py): skip embedding faces that can't match anyway
+QUALITY_GATE_ENABLED = True
+QUALITY_MIN_SHARPNESS = 60.0  # Laplacian variance on the face ROI (lower = blurrier)
+QUALITY_SHARPNESS_SIZE = 64  # ROI is resized to this square before measuring
+QUALITY_MAX_YAW = 0.35  # Nose offset from eye midpoint, in eye distances
+QUALITY_MAX_ROLL_DEG = 25.0  # Eye-line tilt
+
 # Geometry constraints
 KPS_MUST_BE_IN_HAAR_BOX = True
 KPS_IN_BOX_MARGIN = 0.35  # Generous margin
@@ -0,0 +1,221 @@
+"""
+Persistent embedding cache for enrollment crops.
+Embeddings are stored as one raw float32 matrix (memory-mapped on read) plus a
+JSON index mapping each crop file to its row. A cache belongs to one model
+file hash + preprocessing setup; changing either starts a fresh cache.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import config
+
+CACHE_FORMAT_VERSION = 1
+
+
+def file_key(path, mode: str = None) -> str:
+    """
+    Cache key of one crop file.
+
+    Args:
+        path: Crop path
+        mode: "stat" (size + mtime, no read) or "content" (SHA-1 of the bytes)
+    """
+    mode = mode or config.EMBED_CACHE_KEY
+    if mode == "content":
+        with open(path, "rb") as f:
+            return "sha1:" + hashlib.sha1(f.read()).hexdigest()
+    if mode != "stat":
+        raise ValueError(f"Unknown EMBED_CACHE_KEY '{mode}'. Choose 'stat' or 'content'.")
+    st = os.stat(path)
+    return f"stat:{st.st_size}:{st.st_mtime_ns}"
+
+
+class EmbeddingCache:
+    """
+    On-disk cache: crop path -> embedding, for one model + preprocessing.
+
+    Layout (under cache_dir/<namespace>/):
+        embeddings.f32  raw (rows, dim) float32, append-only
+        index.json      header + {path: [file key, row]}
+
+    Rows of files that changed or disappeared stay in the matrix until it is
+    compacted on save (when they outnumber live rows). When the model file
+    changes, caches built from its previous contents are deleted on save.
+    One writer at a time.
+    """
+
+    def __init__(self, model_path, model_hash: str, preprocess: str,
+                 dim: int = config.EMBEDDING_DIM, cache_dir=None):
+        """
+        Args:
+            model_path: Model file the embeddings come from
+            model_hash: SHA-256 of that file (see embed.model_file_hash)
+            preprocess: Preprocessing signature
+                        (see EmbeddingModelSpec.preprocess_signature)
+            dim: Embedding dimension
+            cache_dir: Root cache directory (default config.EMBED_CACHE_DIR)
+        """
+        self.root = Path(cache_dir or config.EMBED_CACHE_DIR)
+        self.model_path = str(Path(model_path).resolve())
+        self.model_hash = model_hash
+        self.dim = int(dim)
+        self.preprocess = preprocess
+        namespace = hashlib.sha256(f"{model_hash}|{self.preprocess}".encode()).hexdigest()[:16]
+        self.dir = self.root / namespace
+        self.matrix_path = self.dir / "embeddings.f32"
+        self.index_path = self.dir / "index.json"
+
+        self._entries: Dict[str, List] = {}  # path -> [key, row]
+        self._rows = 0
+        self._pending: List[np.ndarray] = []  # Rows appended since the last save
+        self._mm: Optional[np.memmap] = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (
+            index.get("format") != CACHE_FORMAT_VERSION
+            or index.get("model_hash") != self.model_hash
+            or index.get("preprocess") != self.preprocess
+            or index.get("dim") != self.dim
+        ):
+            return
+        rows = int(index.get("rows", 0))
+        expected = rows * self.dim * 4
+        if not self.matrix_path.exists() or self.matrix_path.stat().st_size < expected:
+            return  # Truncated matrix: start over
+        self._entries = index.get("entries", {})
+        self._rows = rows
+        if rows:
+            self._mm = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    @staticmethod
+    def _path_id(path) -> str:
+        return str(Path(path).resolve())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, paths: Sequence) -> Tuple[np.ndarray, np.ndarray, List[Optional[str]]]:
+        """
+        Find cached embeddings.
+
+        Returns:
+            embeddings: (H, D) float32 rows for the hits, in order
+            hit: (N,) bool mask over `paths`
+            keys: File key per path (None if the file is unreadable); pass them
+                  back to put() for the misses
+        """
+        hit = np.zeros(len(paths), dtype=bool)
+        rows, keys = [], []
+        for i, path in enumerate(paths):
+            try:
+                key = file_key(path)
+            except OSError:
+                keys.append(None)
+                continue
+            keys.append(key)
+            entry = self._entries.get(self._path_id(path))
+            if entry is not None and entry[0] == key and self._mm is not None and entry[1] < self._rows:
+                hit[i] = True
+                rows.append(entry[1])
+        self.hits += int(hit.sum())
+        self.misses += len(paths) - int(hit.sum())
+        if rows:
+            embs = np.asarray(self._mm[np.asarray(rows)], dtype=np.float32)
+        else:
+            embs = np.zeros((0, self.dim), dtype=np.float32)
+        return embs, hit, keys
+
+    def put(self, paths: Sequence, keys: Sequence[Optional[str]], embeddings: np.ndarray) -> None:
+        """Queue freshly computed embeddings; written by save()."""
+        for path, key, emb in zip(paths, keys, embeddings):
+            if key is None:
+                continue
+            self._entries[self._path_id(path)] = [key, self._rows + len(self._pending)]
+            self._pending.append(np.asarray(emb, dtype=np.float32).reshape(self.dim))
+
+    def save(self) -> None:
+        """Append queued rows and atomically rewrite the index."""
+        if not self._pending and self.index_path.exists():
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._prune_stale_namespaces()
+        self._mm = None  # Release the mapping before touching the file
+
+        if self._pending:
+            with open(self.matrix_path, "ab") as f:
+                # Drop anything past the indexed rows (unusable index, interrupted save)
+                f.truncate(self._rows * self.dim * 4)
+                f.write(np.stack(self._pending).tobytes())
+            self._rows += len(self._pending)
+            self._pending = []
+
+        # Forget crops that were deleted; their rows go at the next compaction
+        self._entries = {p: e for p, e in self._entries.items() if os.path.exists(p)}
+        if self._rows > 2 * max(256, len(self._entries)):
+            self._compact()
+        self._write_index()
+        if self._rows:
+            self._mm = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+
+    def _compact(self):
+        """Rewrite the matrix with only the rows the index still points to."""
+        live = sorted(self._entries.items(), key=lambda kv: kv[1][1])
+        src = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+        tmp = self.matrix_path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp, "wb") as f:
+            for new_row, (path, entry) in enumerate(live):
+                f.write(np.asarray(src[entry[1]], dtype=np.float32).tobytes())
+                entry[1] = new_row
+        del src
+        os.replace(tmp, self.matrix_path)
+        self._rows = len(live)
+
+    def _write_index(self):
+        index = {
+            "format": CACHE_FORMAT_VERSION,
+            "model_path": self.model_path,
+            "model_hash": self.model_hash,
+            "preprocess": self.preprocess,
+            "dim": self.dim,
+            "rows": self._rows,
+            "entries": self._entries,
+        }
+        tmp = self.index_path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_path)
+
+    def _prune_stale_namespaces(self):
+        """Delete caches of this model path built from a different file or preprocessing."""
+        for d in self.root.iterdir():
+            if not d.is_dir() or d == self.dir:
+                continue
+            try:
+                with open(d / "index.json", "r") as f:
+                    other = json.load(f).get("model_path")
+            except (OSError, ValueError):
+                other = self.model_path  # Broken cache: remove it too
+            if other == self.model_path:
+                shutil.rmtree(d, ignore_errors=True)
+
+
+def clear_cache(cache_dir=None) -> None:
+    """Remove every cached embedding."""
+    shutil.rmtree(Path(cache_dir or config.EMBED_CACHE_DIR), ignore_errors=True)
@@ -4,10 +4,9 @@ Captures multiple face samples, extracts embeddings, and stores a template.
 """
 
 import sys
-import json
 import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Optional
 import cv2
 import numpy as np
 
@@ -15,29 +14,9 @@ from . import config
 from .haar_5pt import HaarMediaPipeFaceDetector
 from .align import FaceAligner
 from .embed import ArcFaceEmbedder
-
-
-def load_existing_db():
-    """Load existing face database."""
-    if not config.DB_NPZ_PATH.exists():
-        return {}
-    data = np.load(str(config.DB_NPZ_PATH), allow_pickle=True)
-    return {k: data[k].astype(np.float32) for k in data.files}
-
-
-def save_db(db: Dict[str, np.ndarray], metadata: dict):
-    """Save face database and metadata."""
-    config.ensure_dirs()
-    np.savez(str(config.DB_NPZ_PATH), **db)
-    config.DB_JSON_PATH.write_text(json.dumps(metadata, indent=2), encoding="utf-8")
-
-
-def mean_embedding(embeddings: List[np.ndarray]) -> np.ndarray:
-    """Compute mean embedding and L2 normalize."""
-    E = np.stack([e.reshape(-1) for e in embeddings], axis=0).astype(np.float32)
-    mean = E.mean(axis=0)
-    mean = mean / (np.linalg.norm(mean) + 1e-12)
-    return mean.astype(np.float32)
+from .offline_embed import OfflineEmbedder
+from .model_registry import check_gallery_model
+from .gallery import FaceGallery, select_templates
 
 
 def main():
@@ -59,20 +38,18 @@ def main():
     person_dir = config.ENROLL_DIR / name
     person_dir.mkdir(parents=True, exist_ok=True)
     
-    db = load_existing_db()
+    gallery = FaceGallery.load(check_model=False, storage="float32", shared=False)  # Saved DB stays full precision
+    if len(gallery) and not check_gallery_model(embedder.spec):
+        return False
     
     # Load existing samples from disk if re-enrolling
     existing_samples = []
     if list(person_dir.glob("*.jpg")):
         print(f"Found existing enrollment for {name}. Loading samples...")
-        for img_path in sorted(person_dir.glob("*.jpg"))[:config.MAX_EXISTING_CROPS_PER_PERSON]:
-            img = cv2.imread(str(img_path))
-            if img is not None and img.shape[:2] == config.EMBEDDING_INPUT_SIZE:
-                try:
-                    emb, _ = embedder.embed(img)
-                    existing_samples.append(emb)
-                except Exception:
-                    pass
+        paths = sorted(person_dir.glob("*.jpg"))[:config.MAX_EXISTING_CROPS_PER_PERSON]
+        engine = OfflineEmbedder(config.ARCFACE_MODEL_PATH, embedder=embedder)
+        embs, _ = engine.embed_paths(paths)
+        existing_samples = list(embs)
         print(f"Loaded {len(existing_samples)} existing samples.")
     
     cap = cv2.VideoCapture(config.CAMERA_INDEX)
@@ -131,15 +108,18 @@ def main():
                 
                 aligned_vis, _ = aligner.align(frame, f.landmarks)
                 
-                # Auto capture
+                # Auto capture (faces failing the quality gate are not stored)
                 if auto_mode and (time.time() - last_auto_capture) >= config.AUTO_CAPTURE_INTERVAL_SECONDS:
-                    emb, _ = embedder.embed(aligned_vis)
-                    new_samples.append(emb)
-                    last_auto_capture = time.time()
-                    
-                    ts = int(time.time() * 1000)
-                    cv2.imwrite(str(person_dir / f"{ts}.jpg"), aligned_vis)
-                    status_msg = f"Auto-captured {len(new_samples)}"
+                    if not f.embeddable:
+                        status_msg = f"Rejected sample: {f.quality.reason}"
+                    else:
+                        emb, _ = embedder.embed(aligned_vis)
+                        new_samples.append(emb)
+                        last_auto_capture = time.time()
+                        
+                        ts = int(time.time() * 1000)
+                        cv2.imwrite(str(person_dir / f"{ts}.jpg"), aligned_vis)
+                        status_msg = f"Auto-captured {len(new_samples)}"
             else:
                 cv2.imshow("Enrollment - Aligned", aligned_vis)
             
@@ -177,6 +157,8 @@ def main():
             elif key == ord(" "):  # SPACE
                 if not faces:
                     status_msg = "No face detected"
+                elif not faces[0].embeddable:
+                    status_msg = f"Rejected sample: {faces[0].quality.reason}"
                 else:
                     emb, _ = embedder.embed(aligned_vis)
                     new_samples.append(emb)
@@ -189,22 +171,28 @@ def main():
                     status_msg = f"Not enough samples ({total})"
                     continue
                 
-                # Compute template
+                # Compute templates (one mean, or up to GALLERY_TEMPLATE_BUDGET poses)
                 all_embeddings = existing_samples + new_samples
-                template = mean_embedding(all_embeddings)
+                templates = select_templates(all_embeddings)
                 
-                db[name] = template
+                model_tag = embedder.spec.gallery_tag()
+                gallery.add(name, templates, samples=total, model=model_tag.get("sha256"))
                 
                 metadata = {
-                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "embedding_dim": int(template.size),
-                    "names": sorted(db.keys()),
-                    "samples_used": total,
+                    "embedding_dim": int(templates.shape[1]),
+                    "model": model_tag,
                 }
+                # Calibrated thresholds of everyone else still hold; this person's is stale
+                thresholds = {n: t for n, t in gallery.metadata.get("identity_thresholds", {}).items()
+                              if n != name and n in gallery}
+                if thresholds:
+                    metadata["identity_thresholds"] = thresholds
+                if gallery.watchlists:
+                    metadata["watchlists"] = gallery.watchlists
                 
-                save_db(db, metadata)
+                gallery.save(metadata)
                 
-                print(f"\n✓ Enrolled '{name}' with {total} samples")
+                print(f"\n✓ Enrolled '{name}' with {total} samples ({len(templates)} template(s))")
                 return True
     
     finally:
@@ -6,20 +6,13 @@ Recommends optimal recognition threshold.
 
 import sys
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 import cv2
 
 from . import config
-from .embed import ArcFaceEmbedder
-
-
-def cosine_distance(a: np.ndarray, b: np.ndarray) -> float:
-    """Compute cosine distance between two vectors."""
-    a = a.reshape(-1).astype(np.float32)
-    b = b.reshape(-1).astype(np.float32)
-    similarity = float(np.dot(a, b))
-    return 1.0 - similarity
+from .matching import STORAGE_DTYPES, quantize_rows, similarities
+from .offline_embed import OfflineEmbedder
 
 
 def load_people_data():
@@ -42,8 +35,207 @@ def load_people_data():
     return people
 
 
-def evaluate():
-    """Run threshold evaluation."""
+def load_crops(img_paths) -> List[np.ndarray]:
+    """Read aligned crops from disk, skipping unreadable or wrongly sized files."""
+    crops = []
+    for path in img_paths[:config.MAX_EXISTING_CROPS_PER_PERSON]:
+        img = cv2.imread(str(path))
+        if img is None or img.shape[:2] != config.EMBEDDING_INPUT_SIZE:
+            continue
+        crops.append(img)
+    return crops
+
+
+def embed_people(engine, people_data, min_samples: int = 5) -> Dict[str, np.ndarray]:
+    """
+    Embed every person's enrollment crops in one bulk pass.
+    
+    Args:
+        engine: OfflineEmbedder
+        people_data: name -> list of crop paths
+        min_samples: Skip people with fewer valid crops
+    
+    Returns:
+        name -> (K, D) L2-normalized embeddings
+    """
+    names, paths = [], []
+    for name, img_paths in people_data.items():
+        person_paths = img_paths[:config.MAX_EXISTING_CROPS_PER_PERSON]
+        names.extend([name] * len(person_paths))
+        paths.extend(person_paths)
+    
+    embs, valid = engine.embed_paths(paths)
+    owners = np.asarray(names, dtype=object)[valid]
+    
+    embeddings_per_person = {}
+    for name in people_data:
+        rows = embs[owners == name]
+        if len(rows) >= min_samples:
+            embeddings_per_person[name] = rows
+    return embeddings_per_person
+
+
+def distance_distributions(embeddings_per_person, storage: str = "float32") -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Genuine (same person) and impostor (different people) cosine distances.
+    
+    Args:
+        embeddings_per_person: name -> (K, D) L2-normalized embeddings
+        storage: Precision of the gallery side of each pair ("float32", "float16"
+                 or "int8"), scored the way FaceGallery scores it
+    
+    Returns:
+        genuine: (G,) float32 distances over all same-person pairs
+        impostor: (I,) float32 distances over all cross-person pairs
+    """
+    names = sorted(embeddings_per_person.keys())
+    mats = [np.asarray(embeddings_per_person[n], dtype=np.float32) for n in names]
+    stored = [quantize_rows(E, storage) for E in mats]
+    
+    genuine_distances = []
+    for E, (G, scales) in zip(mats, stored):
+        iu = np.triu_indices(len(E), k=1)
+        genuine_distances.append(1.0 - similarities(E, G, scales)[iu])
+    
+    impostor_distances = []
+    for i in range(len(mats)):
+        for j in range(i + 1, len(mats)):
+            impostor_distances.append(1.0 - similarities(mats[i], *stored[j]).reshape(-1))
+    
+    genuine = np.concatenate(genuine_distances) if genuine_distances else np.zeros(0)
+    impostor = np.concatenate(impostor_distances) if impostor_distances else np.zeros(0)
+    return genuine.astype(np.float32), impostor.astype(np.float32)
+
+
+def far_frr(genuine: np.ndarray, impostor: np.ndarray, thr: float) -> Tuple[float, float]:
+    """False accept / false reject rates (percent) at a distance threshold."""
+    far = float(np.mean(impostor <= thr)) * 100 if len(impostor) > 0 else 0
+    frr = float(np.mean(genuine > thr)) * 100 if len(genuine) > 0 else 0
+    return far, frr
+
+
+def best_threshold(genuine: np.ndarray, impostor: np.ndarray) -> Optional[Tuple[float, float, float]]:
+    """
+    Lowest-FRR threshold on the THRESHOLD_SWEEP_RANGE grid that meets TARGET_FAR.
+    
+    Returns:
+        (threshold, far, frr) or None if no threshold meets the target
+    """
+    start, end, step = config.THRESHOLD_SWEEP_RANGE
+    best = None
+    for thr in np.arange(start, end + 1e-9, step):
+        far, frr = far_frr(genuine, impostor, thr)
+        if far <= config.TARGET_FAR * 100 and (best is None or frr < best[2]):
+            best = (float(thr), far, frr)
+    return best
+
+
+def identity_thresholds(embeddings_per_person, base: float) -> Dict[str, float]:
+    """
+    Per-identity accept thresholds: for each person, the lowest-FRR threshold
+    meeting TARGET_FAR against their own genuine pairs and their impostor
+    pairs with everyone else. Its offset from `base` is kept within
+    IDENTITY_THRESHOLD_MAX_DELTA and applied to DEFAULT_DISTANCE_THRESHOLD,
+    the threshold the live loops shift from, so a person is never accepted
+    more than the delta past the live global threshold.
+    People with fewer than IDENTITY_THRESHOLD_MIN_SAMPLES samples are left out
+    (they keep the global threshold); people no threshold works for get the
+    strictest allowed one.
+    
+    Args:
+        embeddings_per_person: name -> (K, D) L2-normalized embeddings
+        base: Global threshold recommended by the sweep (the offsets are measured from it)
+    
+    Returns:
+        name -> threshold
+    """
+    names = sorted(embeddings_per_person.keys())
+    mats = [np.asarray(embeddings_per_person[n], dtype=np.float32) for n in names]
+    delta = config.IDENTITY_THRESHOLD_MAX_DELTA
+    thresholds = {}
+    for i, (name, E) in enumerate(zip(names, mats)):
+        if len(E) < config.IDENTITY_THRESHOLD_MIN_SAMPLES or len(mats) < 2:
+            continue
+        genuine = 1.0 - (E @ E.T)[np.triu_indices(len(E), k=1)]
+        others = np.concatenate([M for j, M in enumerate(mats) if j != i])
+        impostor = 1.0 - (E @ others.T).reshape(-1)
+        best = best_threshold(genuine, impostor)
+        offset = -delta if best is None else float(np.clip(best[0] - base, -delta, delta))
+        thresholds[name] = round(config.DEFAULT_DISTANCE_THRESHOLD + offset, 4)
+    return thresholds
+
+
+def save_identity_thresholds(thresholds: Dict[str, float]) -> bool:
+    """Store per-identity thresholds in the gallery metadata (face_db.fdb)."""
+    from .gallery import FaceGallery
+    
+    gallery = FaceGallery.load(check_model=False, storage="float32", shared=False)
+    if not len(gallery):
+        print("ERROR: No gallery to store thresholds in. Run enrollment first.")
+        return False
+    stored = {n: t for n, t in thresholds.items() if n in gallery}
+    gallery.save_metadata({**gallery.metadata, "identity_thresholds": stored})
+    print(f"✓ Saved {len(stored)} per-identity thresholds to {config.DB_PATH}")
+    return True
+
+
+def storage_report(embeddings_per_person, genuine: np.ndarray, impostor: np.ndarray,
+                   threshold: float) -> None:
+    """
+    Print how each gallery storage precision shifts the distance distributions.
+    
+    Args:
+        embeddings_per_person: name -> (K, D) L2-normalized embeddings
+        genuine, impostor: float32 reference distances (distance_distributions)
+        threshold: Distance threshold the FAR/FRR columns are measured at
+    """
+    dim = next(iter(embeddings_per_person.values())).shape[1]
+    print("\n" + "="*60)
+    print(f"GALLERY STORAGE PRECISION (threshold {threshold:.2f})")
+    print("="*60)
+    print("\nStorage | Bytes/tmpl | Max |Δd| | Genuine mean | Impostor mean | FAR (%) | FRR (%)")
+    print("-" * 86)
+    for storage in STORAGE_DTYPES:
+        if storage == "float32":
+            g, i = genuine, impostor
+        else:
+            g, i = distance_distributions(embeddings_per_person, storage)
+        delta = max(
+            float(np.abs(g - genuine).max()) if len(g) else 0.0,
+            float(np.abs(i - impostor).max()) if len(i) else 0.0,
+        )
+        bytes_per = dim * np.dtype(storage).itemsize + (4 if storage == "int8" else 0)
+        far, frr = far_frr(g, i, threshold)
+        g_mean = f"{g.mean():.4f}" if len(g) else "-"
+        i_mean = f"{i.mean():.4f}" if len(i) else "-"
+        print(f"{storage:>7} | {bytes_per:>10} | {delta:8.5f} | {g_mean:>12} | {i_mean:>13} | "
+              f"{far:7.2f} | {frr:7.2f}")
+    print(f"\nSet GALLERY_STORAGE_DTYPE in config.py (current: {config.GALLERY_STORAGE_DTYPE}).")
+
+
+def stats_str(arr):
+    """One-line summary of a distance distribution."""
+    if len(arr) == 0:
+        return "n=0 (empty)"
+    return (
+        f"n={len(arr)} | "
+        f"mean={arr.mean():.3f} | "
+        f"std={arr.std():.3f} | "
+        f"min={arr.min():.3f} | "
+        f"max={arr.max():.3f} | "
+        f"p25={np.percentile(arr, 25):.3f} | "
+        f"p50={np.percentile(arr, 50):.3f} | "
+        f"p75={np.percentile(arr, 75):.3f}"
+    )
+
+
+def evaluate(save_thresholds: bool = False):
+    """
+    Run threshold evaluation.
+    
+    Args:
+        save_thresholds: Store the per-identity thresholds in the gallery metadata
+    """
     config.ensure_dirs()
     
     people_data = load_people_data()
@@ -54,69 +246,22 @@ def evaluate():
     
     print(f"\nLoading embeddings from {len(people_data)} enrolled people...")
     
-    embedder = ArcFaceEmbedder(config.ARCFACE_MODEL_PATH)
+    engine = OfflineEmbedder(config.ARCFACE_MODEL_PATH)
     
     # Load embeddings per person
-    embeddings_per_person = {}
-    for name, img_paths in people_data.items():
-        embeddings = []
-        for path in img_paths[:config.MAX_EXISTING_CROPS_PER_PERSON]:
-            img = cv2.imread(str(path))
-            if img is None or img.shape[:2] != config.EMBEDDING_INPUT_SIZE:
-                continue
-            try:
-                emb, _ = embedder.embed(img)
-                embeddings.append(emb)
-            except Exception:
-                pass
-        
-        if len(embeddings) >= 5:
-            embeddings_per_person[name] = embeddings
+    embeddings_per_person = embed_people(engine, people_data)
     
     if len(embeddings_per_person) < 1:
         print("ERROR: Not enough valid embeddings.")
         return False
     
-    # Compute genuine distances (same person)
-    genuine_distances = []
-    for name, embeddings in embeddings_per_person.items():
-        for i in range(len(embeddings)):
-            for j in range(i + 1, len(embeddings)):
-                dist = cosine_distance(embeddings[i], embeddings[j])
-                genuine_distances.append(dist)
-    
-    # Compute impostor distances (different people)
-    impostor_distances = []
-    names = sorted(embeddings_per_person.keys())
-    for i in range(len(names)):
-        for j in range(i + 1, len(names)):
-            for emb_i in embeddings_per_person[names[i]]:
-                for emb_j in embeddings_per_person[names[j]]:
-                    dist = cosine_distance(emb_i, emb_j)
-                    impostor_distances.append(dist)
-    
-    genuine = np.array(genuine_distances, dtype=np.float32)
-    impostor = np.array(impostor_distances, dtype=np.float32)
+    genuine, impostor = distance_distributions(embeddings_per_person)
     
     # Statistics
     print("\n" + "="*60)
     print("DISTANCE DISTRIBUTION ANALYSIS")
     print("="*60)
     
-    def stats_str(arr):
-        if len(arr) == 0:
-            return "n=0 (empty)"
-        return (
-            f"n={len(arr)} | "
-            f"mean={arr.mean():.3f} | "
-            f"std={arr.std():.3f} | "
-            f"min={arr.min():.3f} | "
-            f"max={arr.max():.3f} | "
-            f"p25={np.percentile(arr, 25):.3f} | "
-            f"p50={np.percentile(arr, 50):.3f} | "
-            f"p75={np.percentile(arr, 75):.3f}"
-        )
-    
     print(f"\nGenuine distances (same person): {stats_str(genuine)}")
     print(f"Impostor distances (diff people): {stats_str(impostor)}")
     
@@ -130,39 +275,23 @@ def evaluate():
     start, end, step = config.THRESHOLD_SWEEP_RANGE
     thresholds = np.arange(start, end + 1e-9, step)
     
-    best_threshold = None
-    best_far = float('inf')
-    best_frr = float('inf')
-    
     for thr in thresholds:
-        if len(impostor) > 0:
-            far = float(np.mean(impostor <= thr)) * 100
-        else:
-            far = 0
-        
-        if len(genuine) > 0:
-            frr = float(np.mean(genuine > thr)) * 100
-        else:
-            frr = 0
+        far, frr = far_frr(genuine, impostor, thr)
         
         # Print sampled thresholds
         if len(thresholds) > 0 and int((thr - start) / step) % max(1, len(thresholds) // 10) == 0:
             print(f"  {thr:.2f}   |  {far:6.2f}  |  {frr:6.2f}")
-        
-        # Find best threshold meeting target FAR
-        if far <= (config.TARGET_FAR * 100):
-            if frr < best_frr:
-                best_frr = frr
-                best_threshold = thr
-                best_far = far
-    
-    # Recommendation
+    
+    # Recommendation: best threshold meeting target FAR
+    best = best_threshold(genuine, impostor)
+    
     print("\n" + "="*60)
-    if best_threshold is not None:
-        print(f"RECOMMENDED THRESHOLD: {best_threshold:.2f}")
+    if best is not None:
+        best_threshold_value, best_far, best_frr = best
+        print(f"RECOMMENDED THRESHOLD: {best_threshold_value:.2f}")
         print(f"  FAR: {best_far:.2f}% (target: {config.TARGET_FAR*100:.2f}%)")
         print(f"  FRR: {best_frr:.2f}%")
-        print(f"\nEquivalent cosine similarity: {1.0 - best_threshold:.3f}")
+        print(f"\nEquivalent cosine similarity: {1.0 - best_threshold_value:.3f}")
     else:
         print(f"No threshold met target FAR ({config.TARGET_FAR*100:.2f}%).")
         print("Consider:")
@@ -170,10 +299,40 @@ def evaluate():
         print("  - Using higher quality images")
         print("  - Relaxing the FAR target")
     
+    base = best[0] if best is not None else config.DEFAULT_DISTANCE_THRESHOLD
+    
+    # Per-identity thresholds (open-set decision, see MATCH_MIN_MARGIN)
+    per_identity = identity_thresholds(embeddings_per_person, base)
+    print("\n" + "="*60)
+    print(f"PER-IDENTITY THRESHOLDS (within ±{config.IDENTITY_THRESHOLD_MAX_DELTA:.2f} "
+          f"of the default {config.DEFAULT_DISTANCE_THRESHOLD:.2f})")
     print("="*60)
+    if per_identity:
+        for name, thr in per_identity.items():
+            print(f"  {name:<20} {thr:.2f}  ({thr - config.DEFAULT_DISTANCE_THRESHOLD:+.2f})")
+        if not save_thresholds:
+            print("\nStore them in the gallery with: python -m src.evaluate --save-thresholds")
+    else:
+        print(f"  (need 2+ people with {config.IDENTITY_THRESHOLD_MIN_SAMPLES}+ samples)")
+    
+    storage_report(embeddings_per_person, genuine, impostor, base)
+    
+    print("="*60)
+    if save_thresholds and per_identity:
+        return save_identity_thresholds(per_identity)
     return True
 
 
 if __name__ == "__main__":
-    success = evaluate()
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Evaluate recognition thresholds on the enrollment crops")
+    parser.add_argument(
+        "--save-thresholds",
+        action="store_true",
+        help="Store per-identity thresholds in data/db/face_db.fdb"
+    )
+    args = parser.parse_args()
+    
+    success = evaluate(save_thresholds=args.save_thresholds)
     sys.exit(0 if success else 1)
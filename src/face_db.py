@@ -0,0 +1,310 @@
+"""
+Versioned face database (data/db/face_db.fdb).
+One self-describing, pickle-free file holds every identity's float32
+templates together with the gallery metadata and a record per identity.
+It uses the flat layout of src/gallery_file.py with a database header:
+
+    schema      FACE_DB_SCHEMA (readers refuse newer schemas)
+    created, updated
+    metadata    gallery metadata (model tag, identity thresholds, watchlists, ...)
+    identities  name -> templates, samples, model (embedder file hash),
+                created, updated, checksum (BLAKE2b of its template bytes)
+
+Commits write a temp file and rename it over the database, so a crash never
+leaves a half-written database and readers (hot reload, other processes)
+only ever see a complete old or new one. Saves in between go to the
+journal (src/face_journal.py) and are folded in by compaction. The legacy
+face_db.npz + face_db.json pair is migrated on first load.
+
+Usage:
+    python -m src.face_db            # summary
+    python -m src.face_db verify     # check every checksum
+    python -m src.face_db compact    # fold the journal into the database
+    python -m src.face_db migrate    # convert face_db.npz + face_db.json
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+import numpy as np
+
+from . import config
+from .embedding_cache import file_key
+from .face_journal import read_journal
+from .gallery_file import GalleryLayout, map_gallery_file, read_gallery_header
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+FACE_DB_SCHEMA = 1
+
+
+def timestamp() -> str:
+    """Timestamp format of the database records."""
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def template_checksum(rows: np.ndarray) -> str:
+    """Checksum of one identity's float32 templates."""
+    data = np.ascontiguousarray(rows, dtype="<f4").tobytes()
+    return "blake2b:" + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+@contextmanager
+def database_lock():
+    """
+    Exclusive lock (across processes) for database commits: journal appends,
+    full writes and compaction. Readers never take it.
+    """
+    config.ensure_dirs()
+    with open(config.DB_LOCK_PATH, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FaceDatabase:
+    """
+    Contents of a face database file.
+
+    `matrix` is a read-only float32 view of the file; identity i owns rows
+    offsets[i]:offsets[i+1]. `records` holds each identity's record.
+    """
+
+    def __init__(self, names: List[str], offsets: np.ndarray, matrix: np.ndarray,
+                 records: Dict[str, Dict], metadata: Dict, created: str = None, updated: str = None):
+        self.names = names
+        self.offsets = offsets
+        self.matrix = matrix
+        self.records = records
+        self.metadata = metadata
+        self.created = created
+        self.updated = updated
+
+    def templates(self) -> Dict[str, np.ndarray]:
+        """name -> (M, D) float32 templates (views into the file)."""
+        return {n: self.matrix[self.offsets[i]:self.offsets[i + 1]] for i, n in enumerate(self.names)}
+
+    def verify(self) -> List[str]:
+        """Names whose templates don't match their checksum (or have none)."""
+        return [n for n, rows in self.templates().items()
+                if self.records.get(n, {}).get("checksum") != template_checksum(rows)]
+
+
+def _check_header(header: Dict) -> None:
+    schema = header.get("schema")
+    if not isinstance(schema, int):
+        raise ValueError("not a face database (no schema)")
+    if schema > FACE_DB_SCHEMA:
+        raise ValueError(f"database schema {schema} is newer than this code supports ({FACE_DB_SCHEMA}); update the code")
+
+
+def write_face_db(path, names: List[str], offsets: np.ndarray, matrix: np.ndarray,
+                  records: Dict[str, Dict], metadata: Dict, created: str = None) -> None:
+    """
+    Commit a database atomically (fsynced temp file + rename).
+
+    Args:
+        path: Database file
+        names: Sorted identity names
+        offsets: (N + 1,) identity boundaries into matrix rows
+        matrix: (T, D) float32 normalized templates
+        records: name -> record (samples, model, created, updated); template
+                 count and checksum are filled in here
+        metadata: Gallery metadata
+        created: Creation time of the database (None = now)
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    stamp = timestamp()
+    identities = {}
+    for i, name in enumerate(names):
+        rows = matrix[offsets[i]:offsets[i + 1]]
+        record = dict(records.get(name) or {})
+        record.setdefault("created", stamp)
+        record.setdefault("updated", record["created"])
+        record["templates"] = len(rows)
+        record["checksum"] = template_checksum(rows)
+        identities[name] = record
+    GalleryLayout(
+        names, offsets, matrix,
+        schema=FACE_DB_SCHEMA,
+        created=created or stamp,
+        updated=stamp,
+        metadata=metadata,
+        identities=identities,
+    ).write(path, durable=True)
+
+
+def read_face_db_header(path) -> Dict:
+    """
+    Header of a database file (metadata and records, no templates).
+
+    Raises:
+        ValueError: If the file isn't a supported face database
+    """
+    header = read_gallery_header(path)
+    try:
+        _check_header(header)
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}") from None
+    return header
+
+
+def read_face_db(path, verify: bool = True) -> FaceDatabase:
+    """
+    Map a database file read-only.
+
+    Args:
+        path: Database file
+        verify: Check every identity's checksum
+
+    Raises:
+        ValueError: If the file isn't a supported face database, or is corrupt
+    """
+    header = read_face_db_header(path)
+    if not header.get("count"):
+        dim = header["shape"][1] if len(header.get("shape", [])) == 2 else config.EMBEDDING_DIM
+        return FaceDatabase([], np.zeros(1, np.intp), np.zeros((0, dim), np.float32), {},
+                            header.get("metadata") or {}, header.get("created"), header.get("updated"))
+    header, names, offsets, matrix, _ = map_gallery_file(path)
+    try:
+        if matrix.dtype != np.float32:
+            raise ValueError(f"templates are {matrix.dtype}, expected float32")
+        db = FaceDatabase(names, offsets, matrix, header.get("identities") or {}, header.get("metadata") or {},
+                          header.get("created"), header.get("updated"))
+        bad = db.verify() if verify else []
+        if bad:
+            raise ValueError(f"checksum mismatch for {len(bad)} identities ({', '.join(bad[:5])})")
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}") from None
+    return db
+
+
+def migrate_legacy_db(force: bool = False) -> bool:
+    """
+    Convert face_db.npz + face_db.json into the versioned database.
+    The legacy files are left in place.
+
+    Args:
+        force: Overwrite an existing database
+
+    Returns:
+        True if a database was written
+    """
+    if not config.DB_NPZ_PATH.exists():
+        print(f"ERROR: No legacy database at {config.DB_NPZ_PATH}")
+        return False
+    if config.DB_PATH.exists() and not force:
+        print(f"ERROR: {config.DB_PATH} already exists (use --force to overwrite it)")
+        return False
+    metadata = {}
+    if config.DB_JSON_PATH.exists():
+        try:
+            metadata = json.loads(config.DB_JSON_PATH.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            print(f"⚠ Could not read {config.DB_JSON_PATH}; migrating without metadata")
+    try:
+        with np.load(str(config.DB_NPZ_PATH), allow_pickle=False) as data:
+            db = {name: np.asarray(data[name], dtype=np.float32) for name in data.files}
+    except ValueError as e:
+        print(f"ERROR: Cannot read {config.DB_NPZ_PATH} without pickle ({e})")
+        return False
+
+    names = sorted(db)
+    blocks = [E.reshape(-1, E.shape[-1]) for E in (db[n] for n in names)]
+    blocks = [E / (np.linalg.norm(E, axis=1, keepdims=True) + 1e-12) for E in blocks]
+    counts = [len(E) for E in blocks]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+    matrix = np.concatenate(blocks) if blocks else np.zeros((0, config.EMBEDDING_DIM), np.float32)
+
+    stamp = metadata.pop("timestamp", None) or time.strftime(
+        "%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(config.DB_NPZ_PATH)))
+    model_hash = (metadata.get("model") or {}).get("sha256")
+    # The legacy format only kept the sample count of the last enrollment
+    metadata.pop("names", None)
+    metadata.pop("samples_used", None)
+    records = {n: {"samples": None, "model": model_hash, "created": stamp, "updated": stamp} for n in names}
+    with database_lock():
+        write_face_db(config.DB_PATH, names, offsets, matrix, records, metadata, created=stamp)
+    print(f"✓ Migrated {len(names)} identities from {config.DB_NPZ_PATH.name} to {config.DB_PATH.name} "
+          f"(the legacy files are kept; delete them once you're happy)")
+    return True
+
+
+def main():
+    """Command-line entry point."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect, verify or migrate the face database")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("verify", help="Check every identity's checksum")
+    sub.add_parser("compact", help="Fold the journal into the database")
+    p_migrate = sub.add_parser("migrate", help="Convert face_db.npz + face_db.json")
+    p_migrate.add_argument("--force", action="store_true", help="Overwrite an existing database")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        return migrate_legacy_db(force=args.force)
+    if args.command == "compact":
+        from .gallery import FaceGallery
+        folded = FaceGallery.compact()
+        if folded is None:
+            print(f"ERROR: No database at {config.DB_PATH}")
+            return False
+        print(f"✓ Folded {folded} journal entries into {config.DB_PATH.name}")
+        return True
+    if not config.DB_PATH.exists():
+        print(f"ERROR: No database at {config.DB_PATH}"
+              + (" (run: python -m src.face_db migrate)" if config.DB_NPZ_PATH.exists() else ""))
+        return False
+    try:
+        key = file_key(config.DB_PATH, "stat")
+        db = read_face_db(config.DB_PATH, verify=args.command == "verify")
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        return False
+    entries, end = read_journal(key) or ([], 0)
+    if args.command == "verify":
+        print(f"✓ {len(db.names)} identities, every checksum matches")
+        if entries:
+            print(f"✓ Journal: {len(entries)} entries, every checksum matches")
+        if end and os.path.getsize(config.DB_JOURNAL_PATH) > end:
+            print("⚠ The journal ends in an incomplete entry (an interrupted save); the next save drops it")
+        return True
+
+    print(f"{config.DB_PATH} (schema {FACE_DB_SCHEMA}, created {db.created}, updated {db.updated})")
+    print(f"{len(db.names)} identities, {len(db.matrix)} templates, {db.matrix.shape[1]}-d")
+    if entries:
+        changed = sorted({e.name for e in entries if e.name is not None})
+        print(f"+ {len(entries)} journal entries not compacted yet ({len(changed)} identities changed)")
+    print(f"\n{'identity':<20} | {'templates':>9} | {'samples':>7} | {'updated':<19}")
+    print("-"*64)
+    for name in db.names:
+        r = db.records.get(name, {})
+        samples = r.get("samples")
+        print(f"{name:<20} | {r.get('templates', 0):>9} | {samples if samples is not None else '-':>7} | "
+              f"{r.get('updated') or '-':<19}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,209 @@
+"""
+Journal of database changes (data/db/face_db.journal).
+Saving an enrollment appends the identities that changed instead of
+rewriting face_db.fdb, so one enrollment costs the I/O of its own templates
+whatever the gallery size, and two stations saving at once both land
+(appends are serialized by face_db.database_lock). Readers replay the
+entries on top of the database: load() all of them, the hot-reload watcher
+only those it hasn't seen yet.
+
+A journal belongs to one database file: its header records that file's key
+(size + mtime). A journal written against another database (e.g. left over
+by a compaction interrupted right after the new database landed) is ignored
+and started over. Compaction (FaceGallery.compact) folds the journal into a
+full database write and deletes it.
+
+Layout:
+    magic (8 bytes) | header length (uint32 LE) | JSON header {"format", "base"}
+    entries, each:
+        JSON length (uint32 LE) | payload length (uint32 LE) | JSON | payload
+        | BLAKE2b-128 of JSON + payload
+    {"op": "add", "name", "shape", "record"}    payload: float32 templates
+    {"op": "remove", "name"}
+    {"op": "metadata", "set": {...}, "unset": [...]}
+An entry cut short by a crash fails its checksum: readers stop before it
+and the next append truncates it.
+"""
+
+import hashlib
+import json
+import os
+import struct
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from .embedding_cache import file_key
+
+JOURNAL_MAGIC = b"FDBJRNL\0"
+JOURNAL_FORMAT = 1
+_LENGTH = struct.Struct("<I")
+_ENTRY = struct.Struct("<II")
+_DIGEST_SIZE = 16
+
+
+@dataclass
+class JournalEntry:
+    """One database change."""
+    op: str  # "add", "remove" or "metadata"
+    name: Optional[str] = None
+    templates: Optional[np.ndarray] = None  # (M, D) float32 ("add")
+    record: Optional[Dict] = None  # Identity record ("add")
+    metadata: Optional[Dict] = None  # Metadata keys set ("metadata")
+    unset: Optional[List[str]] = None  # Metadata keys removed ("metadata")
+
+
+def metadata_entry(old: Dict, new: Dict) -> Optional[JournalEntry]:
+    """Entry turning metadata `old` into `new` key by key (None if unchanged)."""
+    changed = {k: v for k, v in new.items() if k not in old or old[k] != v}
+    unset = [k for k in old if k not in new]
+    if not changed and not unset:
+        return None
+    return JournalEntry("metadata", metadata=changed, unset=unset)
+
+
+def _encode(entry: JournalEntry) -> bytes:
+    header = {"op": entry.op}
+    payload = b""
+    if entry.op == "add":
+        T = np.ascontiguousarray(entry.templates, dtype="<f4")
+        T = T.reshape(-1, T.shape[-1])
+        header.update(name=entry.name, shape=list(T.shape), record=entry.record or {})
+        payload = T.tobytes()
+    elif entry.op == "remove":
+        header["name"] = entry.name
+    elif entry.op == "metadata":
+        header.update(set=entry.metadata or {}, unset=entry.unset or [])
+    else:
+        raise ValueError(f"Unknown journal op '{entry.op}'")
+    text = json.dumps(header).encode("utf-8")
+    digest = hashlib.blake2b(text + payload, digest_size=_DIGEST_SIZE).digest()
+    return _ENTRY.pack(len(text), len(payload)) + text + payload + digest
+
+
+def _decode(buf: bytes, pos: int) -> Optional[Tuple[JournalEntry, int]]:
+    """Entry at `pos` and the position after it, or None if incomplete or corrupt."""
+    if pos + _ENTRY.size > len(buf):
+        return None
+    n_text, n_payload = _ENTRY.unpack_from(buf, pos)
+    start = pos + _ENTRY.size
+    end = start + n_text + n_payload + _DIGEST_SIZE
+    if end > len(buf):
+        return None
+    body = buf[start:end - _DIGEST_SIZE]
+    if hashlib.blake2b(body, digest_size=_DIGEST_SIZE).digest() != buf[end - _DIGEST_SIZE:end]:
+        return None
+    try:
+        header = json.loads(body[:n_text].decode("utf-8"))
+        op = header["op"]
+        if op == "add":
+            T = np.frombuffer(body, dtype="<f4", offset=n_text).reshape(header["shape"])
+            entry = JournalEntry("add", header["name"], T.astype(np.float32), header.get("record") or {})
+        elif op == "remove":
+            entry = JournalEntry("remove", header["name"])
+        elif op == "metadata":
+            entry = JournalEntry("metadata", metadata=header.get("set") or {}, unset=header.get("unset") or [])
+        else:
+            return None  # Written by newer code: stop here rather than skip a change
+    except (KeyError, TypeError, ValueError):
+        return None
+    return entry, end
+
+
+def _read_header(f) -> Tuple[Dict, int]:
+    """Journal header and the position of the first entry."""
+    size = len(JOURNAL_MAGIC) + _LENGTH.size
+    prefix = f.read(size)
+    if len(prefix) < size or not prefix.startswith(JOURNAL_MAGIC):
+        raise ValueError("not a face database journal")
+    (length,) = _LENGTH.unpack_from(prefix, len(JOURNAL_MAGIC))
+    header = json.loads(f.read(length).decode("utf-8"))
+    if header.get("format") != JOURNAL_FORMAT:
+        raise ValueError(f"unsupported journal format {header.get('format')}")
+    return header, size + length
+
+
+def read_journal(base: str, start: int = 0, path=None) -> Optional[Tuple[List[JournalEntry], int]]:
+    """
+    Entries of the journal of one database file, from byte `start` on.
+
+    Args:
+        base: Key (file_key "stat") of the database file the entries apply to
+        start: Position returned by the previous call (0 = from the beginning)
+        path: Journal file (None = config.DB_JOURNAL_PATH)
+
+    Returns:
+        (entries, position after the last complete entry); ([], 0) if there is
+        no journal; None if the journal belongs to another database file
+    """
+    path = path or config.DB_JOURNAL_PATH
+    try:
+        with open(path, "rb") as f:
+            header, first = _read_header(f)
+            if header.get("base") != base:
+                return None
+            start = max(start, first)
+            f.seek(start)
+            buf = f.read()
+    except FileNotFoundError:
+        return [], 0
+    except (OSError, ValueError) as e:
+        print(f"⚠ Ignoring unreadable journal {path} ({e})")
+        return None
+
+    entries, pos = [], 0
+    while True:
+        decoded = _decode(buf, pos)
+        if decoded is None:
+            break
+        entry, pos = decoded
+        entries.append(entry)
+    return entries, start + pos
+
+
+def _create_journal(path, base: str) -> None:
+    """Start an empty journal for database `base` (temp file + rename)."""
+    text = json.dumps({"format": JOURNAL_FORMAT, "base": base}).encode("utf-8")
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    with open(tmp, "wb") as f:
+        f.write(JOURNAL_MAGIC + _LENGTH.pack(len(text)) + text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def append_journal(entries: List[JournalEntry]) -> int:
+    """
+    Append entries to the journal of the current database file (hold
+    face_db.database_lock). Starts a new journal if there is none or it
+    belongs to another database file, and drops an entry a crash left
+    incomplete. The journal is read once to find its end; compaction keeps
+    it short.
+
+    Returns:
+        Number of entries in the journal afterwards
+    """
+    path = config.DB_JOURNAL_PATH
+    base = file_key(config.DB_PATH, "stat")
+    current = read_journal(base, path=path)
+    if current is None or not path.exists():
+        _create_journal(path, base)
+        current = read_journal(base, path=path)
+    existing, end = current
+    with open(path, "r+b") as f:
+        f.truncate(end)
+        f.seek(end)
+        f.write(b"".join(_encode(e) for e in entries))
+        f.flush()
+        os.fsync(f.fileno())
+    return len(existing) + len(entries)
+
+
+def remove_journal() -> None:
+    """Delete the journal (after its entries went into a full database write)."""
+    try:
+        os.remove(config.DB_JOURNAL_PATH)
+    except FileNotFoundError:
+        pass
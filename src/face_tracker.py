@@ -0,0 +1,235 @@
+"""
+Lightweight frame-to-frame face tracker.
+Gives each detected face a stable track ID so identities (and embeddings)
+can be carried across frames instead of being recomputed from scratch.
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+
+
+def landmark_change(ref: np.ndarray, cur: np.ndarray) -> Tuple[float, float]:
+    """
+    How much a face changed between two 5-point landmark sets.
+    
+    Returns:
+        pose_delta: Max landmark shift after removing translation and scale,
+                    in units of eye distance (captures yaw/roll/expression)
+        scale_delta: Relative change in eye distance
+    """
+    ref_eye = float(np.linalg.norm(ref[1] - ref[0])) + 1e-6
+    cur_eye = float(np.linalg.norm(cur[1] - cur[0])) + 1e-6
+    ref_n = (ref - ref[:2].mean(axis=0)) / ref_eye
+    cur_n = (cur - cur[:2].mean(axis=0)) / cur_eye
+    pose_delta = float(np.max(np.linalg.norm(cur_n - ref_n, axis=1)))
+    scale_delta = abs(cur_eye - ref_eye) / ref_eye
+    return pose_delta, scale_delta
+
+
+@dataclass
+class Track:
+    """One tracked face, its recent embeddings and the latest identity known for it."""
+    track_id: int
+    x1: int
+    y1: int
+    x2: int
+    y2: int
+    landmarks: np.ndarray  # (5, 2) float32
+    last_seen: int
+    name: Optional[str] = None  # Best gallery match (None = not identified yet)
+    dist: float = 1.0  # Cosine distance to best match
+    margin: float = float("inf")  # Distance gap to the second-best identity
+    threshold_shift: float = 0.0  # Best match's calibrated threshold minus the default
+    identity_frame: int = -1  # Frame the current identity was computed from
+    
+    # Per-track embedding cache
+    embeddings: Deque[np.ndarray] = field(
+        default_factory=lambda: deque(maxlen=max(1, config.SMOOTHING_WINDOW))
+    )
+    query: Optional[np.ndarray] = None  # Normalized mean of `embeddings`
+    embed_frame: int = -1  # Frame the last embedding was requested for
+    embed_landmarks: Optional[np.ndarray] = None  # Landmarks at that frame
+    
+    # Accept hold (ACCEPT_HOLD_FRAMES)
+    held_name: Optional[str] = None
+    held_dist: float = 1.0
+    hold_left: int = 0
+
+    @property
+    def center(self):
+        return ((self.x1 + self.x2) / 2.0, (self.y1 + self.y2) / 2.0)
+    
+    def needs_embedding(self, frame_idx: int) -> bool:
+        """
+        True if the cached embedding can't be reused for this frame: nothing
+        cached yet, the refresh interval elapsed, or pose/scale moved too far
+        from the face that was last embedded.
+        """
+        if self.embed_landmarks is None:
+            return True
+        if frame_idx - self.embed_frame >= config.EMBED_REFRESH_FRAMES:
+            return True
+        pose_delta, scale_delta = landmark_change(self.embed_landmarks, self.landmarks)
+        return pose_delta > config.EMBED_POSE_TOLERANCE or scale_delta > config.EMBED_SCALE_TOLERANCE
+    
+    def mark_embedding_requested(self, frame_idx: int) -> None:
+        """Remember which face the next embedding will describe."""
+        self.embed_frame = frame_idx
+        self.embed_landmarks = self.landmarks.copy()
+    
+    def cancel_embedding_request(self) -> None:
+        """Forget a request that produced no embedding, so the next frame asks again."""
+        self.embed_landmarks = None
+    
+    def add_embedding(self, emb: np.ndarray) -> np.ndarray:
+        """
+        Add a fresh embedding and return the smoothed query vector
+        (normalized mean of the last SMOOTHING_WINDOW embeddings).
+        """
+        emb = np.array(emb, dtype=np.float32).reshape(-1)
+        # A very different embedding means a different face took over the track
+        if self.query is not None and 1.0 - float(np.dot(self.query, emb)) > config.TRACK_EMBEDDING_RESET_DISTANCE:
+            self.embeddings.clear()
+        self.embeddings.append(emb)
+        mean = np.mean(self.embeddings, axis=0)
+        self.query = (mean / (np.linalg.norm(mean) + config.EMBEDDING_NORM_EPSILON)).astype(np.float32)
+        return self.query
+    
+    def set_identity(self, ident, frame_id: int = None) -> None:
+        """Store a gallery Identification (name, distance, margin, threshold shift)."""
+        self.name, self.dist = ident.name, ident.dist
+        self.margin, self.threshold_shift = ident.margin, ident.threshold_shift
+        if frame_id is not None:
+            self.identity_frame = frame_id
+    
+    def ambiguous(self, threshold: float) -> bool:
+        """Close enough to accept, but another identity is within MATCH_MIN_MARGIN."""
+        return (self.name is not None and self.dist <= threshold + self.threshold_shift
+                and self.margin < config.MATCH_MIN_MARGIN)
+    
+    def decide(self, threshold: float) -> Tuple[bool, Optional[str], float]:
+        """
+        Accept or reject the current identity at `threshold` (shifted by the
+        identity's calibrated threshold). Ambiguous matches are rejected.
+        A recent accept is held for ACCEPT_HOLD_FRAMES frames so a single
+        noisy match doesn't flicker the face to Unknown.
+        
+        Returns:
+            (accepted, name, dist)
+        """
+        if (self.name is not None and self.dist <= threshold + self.threshold_shift
+                and self.margin >= config.MATCH_MIN_MARGIN):
+            self.held_name, self.held_dist = self.name, self.dist
+            self.hold_left = config.ACCEPT_HOLD_FRAMES
+            return True, self.name, self.dist
+        if self.hold_left > 0 and self.held_name is not None:
+            self.hold_left -= 1
+            return True, self.held_name, self.held_dist
+        return False, self.name, self.dist
+
+
+def _iou(a, b) -> float:
+    """Intersection-over-union of two (x1, y1, x2, y2) boxes."""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    if inter <= 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter + 1e-9)
+
+
+class FaceTracker:
+    """Greedy IoU tracker over FaceDetection boxes."""
+
+    def __init__(
+        self,
+        min_iou: float = config.TRACK_MIN_IOU,
+        max_missed_frames: int = config.TRACK_MAX_MISSED_FRAMES,
+    ):
+        self.min_iou = min_iou
+        self.max_missed_frames = max_missed_frames
+        self.tracks: Dict[int, Track] = {}
+        self._next_id = 1
+
+    def update(self, faces, frame_idx: int) -> List[Track]:
+        """
+        Associate this frame's detections with existing tracks.
+
+        Args:
+            faces: List of FaceDetection
+            frame_idx: Current frame number
+
+        Returns:
+            One Track per face, in the same order as `faces`
+        """
+        boxes = [(f.x1, f.y1, f.x2, f.y2) for f in faces]
+        candidates = []
+        for tid, tr in self.tracks.items():
+            tbox = (tr.x1, tr.y1, tr.x2, tr.y2)
+            for fi, box in enumerate(boxes):
+                iou = _iou(tbox, box)
+                if iou >= self.min_iou:
+                    candidates.append((iou, tid, fi))
+        candidates.sort(reverse=True)
+
+        assigned: Dict[int, Track] = {}
+        used_tracks = set()
+        for iou, tid, fi in candidates:
+            if tid in used_tracks or fi in assigned:
+                continue
+            used_tracks.add(tid)
+            assigned[fi] = self.tracks[tid]
+
+        result = []
+        for fi, face in enumerate(faces):
+            tr = assigned.get(fi)
+            if tr is None:
+                tr = Track(
+                    track_id=self._next_id,
+                    x1=face.x1, y1=face.y1, x2=face.x2, y2=face.y2,
+                    landmarks=face.landmarks, last_seen=frame_idx,
+                )
+                self.tracks[tr.track_id] = tr
+                self._next_id += 1
+            else:
+                tr.x1, tr.y1, tr.x2, tr.y2 = face.x1, face.y1, face.x2, face.y2
+                tr.landmarks = face.landmarks
+                tr.last_seen = frame_idx
+            result.append(tr)
+
+        # Forget faces that have been gone for too long
+        for tid in [t for t, tr in self.tracks.items()
+                    if frame_idx - tr.last_seen > self.max_missed_frames]:
+            del self.tracks[tid]
+
+        return result
+
+    def get(self, track_id: int) -> Optional[Track]:
+        return self.tracks.get(track_id)
+
+    def reset_identities(self, keep=None) -> None:
+        """
+        Drop cached identities (e.g. after the gallery changed).
+        Embeddings are kept: they don't depend on the gallery, so callers can
+        re-match each track's `query` right away.
+        
+        Args:
+            keep: Names still enrolled; tracks holding an accept for one of
+                  them keep the hold (None = drop every hold)
+        """
+        for tr in self.tracks.values():
+            tr.name = None
+            tr.dist = 1.0
+            tr.margin = float("inf")
+            tr.threshold_shift = 0.0
+            tr.identity_frame = -1
+            if keep is None or tr.held_name not in keep:
+                tr.held_name = None
+                tr.hold_left = 0
@@ -0,0 +1,891 @@
+"""
+Face gallery.
+Owns the enrolled identities: loads and saves the database, keeps the
+embeddings as one contiguous, L2-normalized matrix (float32, float16 or int8)
+with a name index, and answers searches against it. Every module reads identities through here.
+Identities may own several templates (e.g. frontal and profile), packed into
+the same matrix with per-identity offsets. Very large galleries are searched
+through an IVF index (src/ann_index.py) with exact re-ranking. Searches can
+be scoped to a named watchlist, and a lock target is checked on its own
+templates first (identify_target).
+face_db.fdb (src/face_db.py) is the source of truth; load() maps a flat copy
+of the packed matrix in the gallery's storage precision (src/gallery_file.py),
+so start-up and reloads don't re-read and re-check the database. Saves append
+the changed identities to a journal (src/face_journal.py) that load() replays
+on top, and compaction folds it back into the database.
+"""
+
+from copy import deepcopy
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from . import config
+from .ann_index import IVFFlatIndex
+from .embedding_cache import file_key
+from .face_db import (
+    database_lock, migrate_legacy_db, read_face_db, read_face_db_header, timestamp, write_face_db,
+)
+from .face_journal import JournalEntry, append_journal, metadata_entry, read_journal, remove_journal
+from .gallery_file import gallery_file_path, map_gallery_file, write_gallery_file
+from .gallery_shards import build_shards
+from .matching import (
+    _as_queries, dequantize_rows, match_embeddings, match_templates, quantize_rows, similarities,
+    template_pad_index,
+)
+from .model_registry import EmbeddingModelSpec, gallery_model_error
+
+
+def _normalize_rows(E: np.ndarray) -> np.ndarray:
+    return E / (np.linalg.norm(E, axis=1, keepdims=True) + 1e-12)
+
+
+def mean_embedding(embeddings) -> np.ndarray:
+    """Compute mean embedding and L2 normalize."""
+    E = np.stack([np.asarray(e).reshape(-1) for e in embeddings], axis=0).astype(np.float32)
+    mean = E.mean(axis=0)
+    mean = mean / (np.linalg.norm(mean) + 1e-12)
+    return mean.astype(np.float32)
+
+
+def select_templates(embeddings, budget: int = None, iterations: int = 20) -> np.ndarray:
+    """
+    Pick the templates to store for one identity.
+
+    With a budget of 1 this is the classic mean template. Otherwise every
+    sample is kept if they fit; beyond the budget the samples are clustered
+    (spherical k-means) and the sample closest to each cluster centre is kept,
+    so each distinct pose stays represented.
+
+    Args:
+        embeddings: (K, D) or list of (D,) L2-normalized sample embeddings
+        budget: Max templates (None = config.GALLERY_TEMPLATE_BUDGET)
+        iterations: k-means iterations
+
+    Returns:
+        (M, D) float32 templates, M <= budget
+    """
+    budget = max(1, config.GALLERY_TEMPLATE_BUDGET if budget is None else budget)
+    E = _normalize_rows(np.stack([np.asarray(e, dtype=np.float32).reshape(-1) for e in embeddings]))
+    if budget == 1:
+        return mean_embedding(E)[None, :]
+    if len(E) <= budget:
+        return E
+
+    # k-means++ seeding (deterministic: start from the sample nearest the mean)
+    centres = [int(np.argmax(E @ mean_embedding(E)))]
+    nearest = 1.0 - E @ E[centres[0]]
+    while len(centres) < budget:
+        centres.append(int(np.argmax(nearest)))  # Farthest sample from all centres so far
+        nearest = np.minimum(nearest, 1.0 - E @ E[centres[-1]])
+    C = E[centres]
+    for _ in range(iterations):
+        assign = np.argmax(E @ C.T, axis=1)
+        new_C = np.stack([
+            mean_embedding(E[assign == c]) if np.any(assign == c) else C[c]
+            for c in range(budget)
+        ])
+        if np.allclose(new_C, C):
+            break
+        C = new_C
+
+    # Medoids: the real sample nearest each centre
+    sims = E @ C.T
+    assign = np.argmax(sims, axis=1)
+    medoids = [int(np.flatnonzero(assign == c)[np.argmax(sims[assign == c, c])])
+               for c in range(budget) if np.any(assign == c)]
+    return E[sorted(set(medoids))]
+
+
+# Subtracted from identify_target's margin bound to cover float16/int8 rounding of template norms
+TARGET_MARGIN_SLACK = 2e-3
+
+
+@dataclass
+class Identification:
+    """Open-set match of one query: nearest identity plus what decides acceptance."""
+    name: Optional[str]  # Nearest identity (None = empty gallery)
+    dist: float  # Cosine distance to it
+    margin: float  # Second-nearest identity's distance minus dist (inf if there is none)
+    threshold_shift: float  # Calibrated threshold of `name` minus DEFAULT_DISTANCE_THRESHOLD
+
+    def accepted(self, threshold: float) -> bool:
+        """Within the identity's threshold (the live threshold shifted by its calibration) and unambiguous."""
+        return (self.name is not None and self.dist <= threshold + self.threshold_shift
+                and self.margin >= config.MATCH_MIN_MARGIN)
+
+
+class FaceGallery:
+    """
+    Enrolled identities, ready to search.
+
+    `names` is sorted. Identity i owns rows offsets[i]:offsets[i+1] of
+    `matrix` (one row each unless identities keep several templates).
+    `matrix` is stored in `storage` precision; int8 rows come with `scales`.
+    `version` increases on every change (add, remove, reload) so holders of
+    derived state, e.g. tracks matched against an older gallery, can tell it
+    is stale.
+    """
+
+    def __init__(self, embeddings: Dict[str, np.ndarray] = None, metadata: Dict = None,
+                 template_budget: int = None, build_index: bool = True, storage: str = None):
+        """
+        Args:
+            embeddings: name -> (D,) template or (M, D) templates (normalized on the way in)
+            metadata: Gallery metadata (see save)
+            template_budget: Max templates per identity; identities over it
+                             are reduced with select_templates
+                             (None = config.GALLERY_TEMPLATE_BUDGET)
+            build_index: Build the ANN index now if the gallery is large enough
+                         (load() builds it itself, reusing the saved one)
+            storage: "float32", "float16" or "int8" (None = config.GALLERY_STORAGE_DTYPE)
+        """
+        self.metadata: Dict = dict(metadata or {})
+        self.records: Dict[str, Dict] = {}  # name -> samples, model, created, updated (see src/face_db.py)
+        self.created: Optional[str] = None  # When the database was first written
+        self.journal_base: Optional[str] = None  # Key of the database file this was loaded from
+        self.journal_pos = 0  # Journal position replayed up to (see src/face_journal.py)
+        self.journal_entries = 0  # Journal entries replayed on top of the database file
+        self._dirty: Set[str] = set()  # Identities added or removed since the last save
+        self._saved_metadata: Dict = deepcopy(self.metadata)
+        self.storage = storage or config.GALLERY_STORAGE_DTYPE
+        self.template_budget = max(1, config.GALLERY_TEMPLATE_BUDGET
+                                   if template_budget is None else template_budget)
+        self.version = 0
+        self.shared = None  # SharedGalleryReader this gallery was attached from (src/shared_gallery.py)
+        self.ann: Optional[IVFFlatIndex] = None
+        self._ann_names: List[str] = []  # ANN label -> name (removed names stay as dead labels)
+        self._ann_labels: Dict[str, int] = {}
+        self._set(embeddings or {})
+        if build_index:
+            self.build_index()
+
+    def _set(self, embeddings: Dict[str, np.ndarray]):
+        names = sorted(embeddings)
+        self._pack(names, [self._prepare(embeddings[n]) for n in names])
+
+    def _prepare(self, embeddings: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """(D,) or (M, D) templates -> normalized, within budget, in storage precision."""
+        T = np.asarray(embeddings, dtype=np.float32)
+        T = _normalize_rows(T.reshape(-1, T.shape[-1]))
+        if len(T) > self.template_budget:
+            T = select_templates(T, self.template_budget)
+        return quantize_rows(T, self.storage)
+
+    def _pack(self, names: List[str], blocks: List[Tuple[np.ndarray, Optional[np.ndarray]]]):
+        """Lay out already-quantized (rows, scales) blocks, one per sorted name."""
+        counts = np.array([len(T) for T, _ in blocks], dtype=np.intp)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+        if blocks:
+            matrix = np.ascontiguousarray(np.concatenate([T for T, _ in blocks]))
+            scales = np.concatenate([S for _, S in blocks]) if self.storage == "int8" else None
+        else:
+            matrix, scales = quantize_rows(np.zeros((0, 0), dtype=np.float32), self.storage)
+        self._adopt(names, offsets, matrix, scales)
+
+    def _adopt(self, names: List[str], offsets: np.ndarray, matrix: np.ndarray,
+               scales: Optional[np.ndarray]):
+        """Take over a packed layout (possibly read-only memory maps) as the current state."""
+        counts = np.diff(offsets)
+        self.names: List[str] = names
+        self.offsets: np.ndarray = offsets
+        self.matrix, self.scales = matrix, scales
+        self._pad = template_pad_index(self.offsets) if len(names) and counts.max() > 1 else None
+        self._index = {n: i for i, n in enumerate(names)}
+        self._shards = build_shards(offsets, matrix, scales)
+        self._separation: Dict[int, float] = {}  # Identity -> angle to the nearest other identity
+        self._load_thresholds()
+        self.version += 1
+
+    def _load_thresholds(self):
+        """Per-identity accept thresholds from metadata["identity_thresholds"] (default elsewhere)."""
+        self.thresholds = np.full(len(self.names), config.DEFAULT_DISTANCE_THRESHOLD, dtype=np.float32)
+        if not config.IDENTITY_THRESHOLDS_ENABLED:
+            return
+        lo = config.DEFAULT_DISTANCE_THRESHOLD - config.IDENTITY_THRESHOLD_MAX_DELTA
+        hi = config.DEFAULT_DISTANCE_THRESHOLD + config.IDENTITY_THRESHOLD_MAX_DELTA
+        for name, thr in (self.metadata.get("identity_thresholds") or {}).items():
+            i = self._index.get(name)
+            if i is not None:
+                self.thresholds[i] = min(max(float(thr), lo), hi)
+
+    # ---- loading / saving -------------------------------------------------
+
+    @classmethod
+    def load(cls, check_model: bool = True, spec: EmbeddingModelSpec = None,
+             storage: str = None, shared: bool = None) -> "FaceGallery":
+        """
+        Load the enrolled database (empty gallery if there is none).
+
+        Args:
+            check_model: Refuse galleries built with a different embedding model
+            spec: Model the gallery will be searched with (None = active model)
+            storage: In-memory precision (None = config.GALLERY_STORAGE_DTYPE);
+                     enrollment keeps float32 so saving never re-writes quantized values
+            shared: Attach to the snapshot published by `python -m src.shared_gallery`
+                    when there is one (None = config.SHARED_GALLERY_ENABLED)
+
+        Returns:
+            The gallery; empty (after printing an ERROR) if the model check fails
+        """
+        if config.SHARED_GALLERY_ENABLED if shared is None else shared:
+            from .shared_gallery import attach_shared_gallery
+            gallery = attach_shared_gallery(storage)
+            if gallery is not None:
+                error = gallery_model_error(gallery.metadata, spec) if check_model else None
+                if error:
+                    print(f"ERROR: {error}")
+                    return cls(storage=storage)
+                return gallery
+
+        if not config.DB_PATH.exists():
+            if not config.DB_NPZ_PATH.exists() or not migrate_legacy_db():
+                return cls(storage=storage)
+        try:
+            # Stat first: a commit landing after this makes the mapped copy look stale, never current
+            key = file_key(config.DB_PATH, "stat")
+            header = read_face_db_header(config.DB_PATH)
+        except (OSError, ValueError) as e:
+            print(f"ERROR: {e}")
+            return cls(storage=storage)
+        metadata = header.get("metadata") or {}
+        if check_model:
+            error = gallery_model_error(metadata, spec)
+            if error:
+                print(f"ERROR: {error}")
+                return cls(storage=storage)
+
+        gallery = cls(metadata=metadata, build_index=False, storage=storage)
+        gallery.records, gallery.created = header.get("identities") or {}, header.get("created")
+        if not gallery._map_file(key):
+            try:
+                db = read_face_db(config.DB_PATH)
+            except (OSError, ValueError) as e:
+                print(f"ERROR: {e}")
+                return cls(storage=storage)
+            gallery.metadata, gallery.records, gallery.created = db.metadata, db.records, db.created
+            gallery._set(db.templates())
+            gallery._save_file(key)
+        if gallery.wants_index() and not gallery._load_index():
+            gallery.build_index()
+            gallery._save_index()
+
+        gallery.journal_base = key
+        replay = read_journal(key)
+        if replay is not None:
+            gallery.apply_journal(*replay)
+        gallery._saved_metadata = deepcopy(gallery.metadata)
+        if check_model and gallery.metadata.get("model") != metadata.get("model"):
+            error = gallery_model_error(gallery.metadata, spec)
+            if error:
+                print(f"ERROR: {error}")
+                return cls(storage=storage)
+        return gallery
+
+    def reload(self, check_model: bool = True) -> bool:
+        """
+        Re-read the database from disk in place.
+
+        Returns:
+            True if it loaded; on failure the current identities are kept
+        """
+        fresh = FaceGallery.load(check_model=check_model, storage=self.storage)
+        if not len(fresh) and config.DB_PATH.exists():
+            return False
+        self.swap(fresh)
+        return True
+
+    def swap(self, fresh: "FaceGallery") -> None:
+        """
+        Take over another gallery's contents in place (e.g. one loaded in the
+        background), so every holder of this object sees the new identities.
+        Call it between frames, from the thread that searches.
+        """
+        version = self.version
+        self.__dict__.update(fresh.__dict__)
+        self.version = version + 1
+
+    def copy(self) -> "FaceGallery":
+        """
+        Independent gallery over the same arrays. Only bookkeeping is copied:
+        packed arrays and index buckets are replaced on change, never
+        modified in place, so changes to one don't show in the other.
+        """
+        fresh = FaceGallery.__new__(FaceGallery)
+        fresh.__dict__.update(self.__dict__)
+        fresh.metadata = deepcopy(self.metadata)
+        fresh.records = dict(self.records)
+        fresh._dirty = set(self._dirty)
+        if self.ann is not None:
+            fresh.ann = self.ann.copy()
+            fresh._ann_names = list(self._ann_names)
+            fresh._ann_labels = dict(self._ann_labels)
+        return fresh
+
+    def save(self, metadata: Dict = None) -> None:
+        """
+        Commit the changes made since load (added/removed identities, metadata).
+
+        With DB_JOURNAL_ENABLED they are appended to the journal: only the
+        changed identities are written, and changes saved meanwhile by other
+        processes are kept. The journal is compacted once it holds
+        DB_JOURNAL_COMPACT_ENTRIES entries. Otherwise, or if there is no
+        database yet, the whole database is rewritten atomically.
+        Save from a float32 gallery: quantized templates would be written back dequantized.
+
+        Args:
+            metadata: Replaces the stored metadata if given
+        """
+        if metadata is not None:
+            self.metadata = dict(metadata)
+            self._load_thresholds()
+        entries = 0
+        with database_lock():
+            if config.DB_JOURNAL_ENABLED and self.journal_base is not None and config.DB_PATH.exists():
+                changes = self._changes()
+                if changes:
+                    entries = append_journal(changes)
+            else:
+                self._write_database()
+            self._dirty.clear()
+            self._saved_metadata = deepcopy(self.metadata)
+        if entries >= config.DB_JOURNAL_COMPACT_ENTRIES:
+            FaceGallery.compact()
+
+    def save_metadata(self, metadata: Dict) -> None:
+        """Replace the metadata and commit it (journaled: only the changed keys are written)."""
+        self.save(metadata)
+
+    def _changes(self) -> List[JournalEntry]:
+        """Journal entries for what changed since the last load or save."""
+        entries = [
+            JournalEntry("add", n, self.templates(n), self.records.get(n)) if n in self._index
+            else JournalEntry("remove", n)
+            for n in sorted(self._dirty)
+        ]
+        metadata = metadata_entry(self._saved_metadata, self.metadata)
+        if metadata is not None:
+            entries.append(metadata)
+        return entries
+
+    def _write_database(self) -> None:
+        """Rewrite the whole database atomically and drop the journal (hold database_lock)."""
+        config.ensure_dirs()
+        self.created = self.created or timestamp()
+        write_face_db(config.DB_PATH, self.names, self.offsets, self._rows(0, len(self.matrix)),
+                      self.records, self.metadata, created=self.created)
+        remove_journal()
+        key = file_key(config.DB_PATH, "stat")
+        self.journal_base, self.journal_pos, self.journal_entries = key, 0, 0
+        self._save_file(key)
+        if self.ann is not None:
+            self._save_index()
+
+    @classmethod
+    def compact(cls) -> Optional[int]:
+        """
+        Fold the journal into a full database write and delete it. Runs on its
+        own from save(); on demand: python -m src.face_db compact.
+
+        Returns:
+            Journal entries folded in (None if there is no database)
+        """
+        if not config.DB_PATH.exists():
+            return None
+        with database_lock():
+            gallery = cls.load(check_model=False, storage="float32", shared=False)
+            if gallery.journal_base is None:
+                return None
+            folded = gallery.journal_entries
+            if folded:
+                gallery._write_database()
+            else:
+                remove_journal()
+        return folded
+
+    # ---- memory-mapped copy -----------------------------------------------
+
+    def _save_file(self, source_key: str = None) -> None:
+        """
+        Write the packed layout for load() to map (only in this gallery's storage).
+
+        Args:
+            source_key: Database file key the templates were read at (None = now)
+        """
+        if not config.GALLERY_MMAP_ENABLED or not len(self.names):
+            return
+        try:
+            write_gallery_file(
+                gallery_file_path(self.storage), self.names, self.offsets, self.matrix, self.scales,
+                source_key=source_key or file_key(config.DB_PATH, "stat"),
+                budget=self.template_budget,
+                metadata=self.metadata,
+            )
+        except OSError as e:
+            print(f"⚠ Could not save mapped gallery ({e})")
+
+    def _map_file(self, source_key: str) -> bool:
+        """Adopt the mapped copy if it was written from the database file with this key."""
+        path = gallery_file_path(self.storage)
+        if not config.GALLERY_MMAP_ENABLED or not path.exists():
+            return False
+        try:
+            header, names, offsets, matrix, scales = map_gallery_file(path)
+            if (
+                header.get("source_key") != source_key
+                or header.get("budget") != self.template_budget
+                or matrix.dtype != np.dtype(self.storage)
+            ):
+                return False
+        except (OSError, KeyError, ValueError):
+            return False
+        self._adopt(names, offsets, matrix, scales)
+        return True
+
+    # ---- approximate index ------------------------------------------------
+
+    def wants_index(self) -> bool:
+        """True if the gallery is big enough for ANN search."""
+        return config.GALLERY_ANN_ENABLED and len(self.matrix) >= config.GALLERY_ANN_MIN_TEMPLATES
+
+    def _owner_labels(self) -> np.ndarray:
+        """ANN label of every template row."""
+        labels = np.array([self._ann_labels[n] for n in self.names], dtype=np.int64)
+        return np.repeat(labels, np.diff(self.offsets))
+
+    def build_index(self) -> None:
+        """(Re)train the ANN index on the current templates, or drop it if not wanted."""
+        self.ann = None
+        self._ann_names = list(self.names)
+        self._ann_labels = {n: i for i, n in enumerate(self.names)}
+        if not self.wants_index():
+            return
+        index = IVFFlatIndex(self.dim, config.GALLERY_ANN_NLIST, storage=self.storage)
+        index.train(self.matrix, scales=self.scales)
+        index.add(self._owner_labels(), self.matrix, scales=self.scales)
+        self.ann = index
+
+    def _update_index(self, name: str) -> None:
+        """Re-insert one identity's templates after add/remove."""
+        if self.ann is None:
+            if self.wants_index():
+                self.build_index()
+            return
+        label = self._ann_labels.get(name)
+        if label is not None:
+            self.ann.remove([label])
+        if name not in self._index:
+            self._ann_labels.pop(name, None)
+            return
+        if label is None:
+            label = len(self._ann_names)
+            self._ann_names.append(name)
+            self._ann_labels[name] = label
+        T = self.templates(name)
+        self.ann.add(np.full(len(T), label), T)
+
+    def _save_index(self) -> None:
+        try:
+            self.ann.save(
+                config.GALLERY_ANN_INDEX_PATH,
+                label_names=np.array(self._ann_names, dtype=str),
+                db_key=np.array(file_key(config.DB_PATH, "stat")),
+                budget=np.int64(self.template_budget),
+            )
+        except OSError as e:
+            print(f"⚠ Could not save ANN index ({e})")
+
+    def _load_index(self) -> bool:
+        """Use the saved index if it was built from this exact database file."""
+        path = config.GALLERY_ANN_INDEX_PATH
+        if not path.exists():
+            return False
+        try:
+            index, extra = IVFFlatIndex.load(path)
+            if (
+                str(extra["db_key"]) != file_key(config.DB_PATH, "stat")
+                or int(extra["budget"]) != self.template_budget
+                or index.dim != self.dim
+                or index.storage != self.storage
+            ):
+                return False
+            names = [str(n) for n in extra["label_names"]]
+        except (OSError, KeyError, ValueError):
+            return False
+        self.ann = index
+        self._ann_names = names
+        self._ann_labels = {n: i for i, n in enumerate(names) if n in self._index}
+        return True
+
+    # ---- identities -------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1] if len(self.names) else 0
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the templates (and int8 scales)."""
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @property
+    def multi_template(self) -> bool:
+        """True if any identity keeps more than one template."""
+        return self._pad is not None
+
+    def index(self, name: str) -> int:
+        """Identity index of `name` (KeyError if not enrolled)."""
+        return self._index[name]
+
+    def _rows(self, start: int, end: int) -> np.ndarray:
+        """float32 templates start:end (a view for float32 storage)."""
+        return dequantize_rows(
+            self.matrix[start:end], self.scales[start:end] if self.scales is not None else None
+        )
+
+    def _scales_at(self, rows) -> Optional[np.ndarray]:
+        return self.scales[rows] if self.scales is not None else None
+
+    def templates(self, name: str) -> np.ndarray:
+        """(M, D) normalized float32 templates of one identity (read-only)."""
+        i = self._index[name]
+        rows = self._rows(self.offsets[i], self.offsets[i + 1])
+        rows.flags.writeable = False
+        return rows
+
+    def to_dict(self) -> Dict[str, np.ndarray]:
+        """name -> float32 template copy: (D,) for single-template identities, else (M, D)."""
+        db = {}
+        for i, n in enumerate(self.names):
+            T = self._rows(self.offsets[i], self.offsets[i + 1])
+            db[n] = T[0].copy() if len(T) == 1 else T.copy()
+        return db
+
+    def _stored_blocks(self) -> Dict[str, Tuple[np.ndarray, Optional[np.ndarray]]]:
+        """name -> (rows, scales) in storage precision, without re-quantizing."""
+        return {
+            n: (self.matrix[self.offsets[i]:self.offsets[i + 1]],
+                self._scales_at(slice(self.offsets[i], self.offsets[i + 1])))
+            for i, n in enumerate(self.names)
+        }
+
+    def add(self, name: str, embeddings: np.ndarray, samples: int = None, model: str = None) -> None:
+        """
+        Enroll or replace one identity: a (D,) template or (M, D) templates.
+
+        Args:
+            samples: Face samples the templates were computed from (for its record)
+            model: Hash of the embedding model file (for its record)
+        """
+        blocks = self._stored_blocks()
+        blocks[name] = self._prepare(embeddings)
+        names = sorted(blocks)
+        self._pack(names, [blocks[n] for n in names])
+        self._update_index(name)
+        stamp = timestamp()
+        self.records[name] = {"samples": samples, "model": model,
+                              "created": self.records.get(name, {}).get("created", stamp), "updated": stamp}
+        self._dirty.add(name)
+
+    def remove(self, name: str) -> bool:
+        """Drop one identity. Returns False if it wasn't enrolled."""
+        if name not in self._index:
+            return False
+        blocks = self._stored_blocks()
+        del blocks[name]
+        names = sorted(blocks)
+        self._pack(names, [blocks[n] for n in names])
+        self._update_index(name)
+        self.records.pop(name, None)
+        self._dirty.add(name)
+        return True
+
+    def apply_journal(self, entries: List[JournalEntry], end: int = None) -> None:
+        """
+        Apply journal entries in order, with a single repack however many there are.
+
+        Args:
+            entries: From face_journal.read_journal
+            end: Journal position after them (None = keep the current one)
+        """
+        blocks = self._stored_blocks()
+        changed = set()
+        for entry in entries:
+            if entry.op == "metadata":
+                metadata = {k: v for k, v in self.metadata.items() if k not in entry.unset}
+                metadata.update(entry.metadata)
+                self.metadata = metadata
+                continue
+            changed.add(entry.name)
+            if entry.op == "add":
+                blocks[entry.name] = self._prepare(entry.templates)
+                self.records[entry.name] = dict(entry.record or {})
+            else:
+                blocks.pop(entry.name, None)
+                self.records.pop(entry.name, None)
+        if changed:
+            names = sorted(blocks)
+            self._pack(names, [blocks[n] for n in names])
+            if self.ann is not None:
+                for name in sorted(changed):
+                    self._update_index(name)
+            elif self.wants_index():
+                self.build_index()
+        else:
+            self._load_thresholds()
+            self.version += 1
+        self.journal_entries += len(entries)
+        if end is not None:
+            self.journal_pos = end
+
+    # ---- search -----------------------------------------------------------
+
+    def search(self, queries, k: int = 1, exact: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k nearest identities per query over the whole gallery.
+
+        Args:
+            queries: (F, D) array or list of (D,) L2-normalized embeddings
+            k: Matches per query
+            exact: Brute force even if the gallery has an ANN index (large
+                   galleries are then scanned in parallel shards, see src/gallery_shards.py)
+
+        Returns:
+            indices: (F, k) rows into `names`, nearest first
+            distances: (F, k) cosine distances, ascending (for multi-template
+                       identities, aggregated per GALLERY_TEMPLATE_AGGREGATION)
+        """
+        if self.ann is not None and not exact:
+            return self._search_ann(queries, k)
+        if self._shards is not None:
+            return self._shards.search(queries, k)
+        if not self.multi_template:
+            return match_embeddings(queries, self.matrix, k, self.scales)
+        return match_templates(
+            queries, self.matrix, self.offsets, k,
+            config.GALLERY_TEMPLATE_AGGREGATION, config.GALLERY_TEMPLATE_TOP_K, self._pad, self.scales,
+        )
+
+    def search_scoped(self, queries, names: Iterable[str], k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Like search(), but only over the given identities (unknown names are ignored).
+
+        Returns:
+            indices: (F, k) rows into `names` of the whole gallery
+            distances: (F, k) cosine distances, ascending
+        """
+        ids = np.array(sorted({self._index[n] for n in names if n in self._index}), dtype=np.intp)
+        return self._search_ids(queries, ids, k)
+
+    def _search_ids(self, queries, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact search over the identities `ids` (sorted identity indices)."""
+        if not self.multi_template:
+            idx, dists = match_embeddings(queries, self.matrix[ids], k, self._scales_at(ids))
+            return ids[idx], dists
+        counts = self.offsets[ids + 1] - self.offsets[ids]
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in ids]) \
+            if len(ids) else np.zeros(0, dtype=np.intp)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.intp)
+        idx, dists = match_templates(
+            queries, self.matrix[rows], offsets, k,
+            config.GALLERY_TEMPLATE_AGGREGATION, config.GALLERY_TEMPLATE_TOP_K,
+            scales=self._scales_at(rows),
+        )
+        return ids[idx], dists
+
+    def _search_ann(self, queries, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ANN candidates from the index, re-ranked exactly with all their templates."""
+        if not isinstance(queries, np.ndarray):
+            queries = [np.asarray(e).reshape(-1) for e in queries]
+        Q = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        k = min(k, len(self.names))
+        labels, _ = self.ann.search(Q, max(config.GALLERY_ANN_CANDIDATES, k))
+        idx = np.zeros((len(Q), k), dtype=np.intp)
+        dists = np.zeros((len(Q), k), dtype=np.float32)
+        for i, row in enumerate(labels):
+            ids = {self._index.get(self._ann_names[l]) for l in row if l >= 0}
+            ids.discard(None)
+            if len(ids) >= k:
+                r_idx, r_dists = self._search_ids(Q[i:i + 1], np.array(sorted(ids), dtype=np.intp), k)
+            else:  # Probed buckets held too few identities
+                r_idx, r_dists = self.search(Q[i:i + 1], k, exact=True)
+            idx[i], dists[i] = r_idx[0], r_dists[0]
+        return idx, dists
+
+    def search_threshold(self, queries, threshold: float, k: int = 1,
+                         scope: Optional[Iterable[str]] = None) -> List[List[Tuple[str, float]]]:
+        """
+        Up to k identities within `threshold` of each query.
+
+        Args:
+            queries: (F, D) array or list of (D,) embeddings
+            threshold: Max cosine distance to accept
+            k: Max matches per query
+            scope: Restrict to these identities (None = all)
+
+        Returns:
+            Per query, [(name, distance), ...] nearest first; empty if none pass
+        """
+        if scope is None:
+            idx, dists = self.search(queries, k)
+        else:
+            idx, dists = self.search_scoped(queries, scope, k)
+        return [
+            [(self.names[i], float(d)) for i, d in zip(row_idx, row_d) if d <= threshold]
+            for row_idx, row_d in zip(idx, dists)
+        ]
+
+    def search_open_set(self, queries, threshold: float = None, k: int = 2,
+                        scope: Optional[Iterable[str]] = None) -> Tuple[np.ndarray, ...]:
+        """
+        Top-k search plus the open-set decision, vectorized over all queries.
+
+        A query is accepted when its nearest identity is within that
+        identity's threshold (calibrated per identity by `evaluate
+        --save-thresholds`, shifted by threshold - DEFAULT_DISTANCE_THRESHOLD)
+        and the second-nearest identity is at least MATCH_MIN_MARGIN further
+        away. Near-duplicate identities then come out ambiguous instead of as
+        confident false accepts.
+
+        Args:
+            queries: (F, D) array or list of (D,) embeddings
+            threshold: Live global threshold (None = DEFAULT_DISTANCE_THRESHOLD)
+            k: Identities per query (at least 2, for the margin)
+            scope: Only consider these identities, e.g. a watchlist (None = all);
+                   the margin is then to the second-nearest identity in scope
+
+        Returns:
+            indices: (F, k) identity indices, nearest first
+            distances: (F, k) float32 distances, ascending
+            margins: (F,) second-best minus best distance (inf with one identity)
+            limits: (F,) distance threshold applied to each query's nearest identity
+            accepted: (F,) bool
+        """
+        shift = 0.0 if threshold is None else threshold - config.DEFAULT_DISTANCE_THRESHOLD
+        if scope is None:
+            idx, dists = self.search(queries, max(2, k))
+        else:
+            idx, dists = self.search_scoped(queries, scope, max(2, k))
+        f = len(idx)
+        if idx.shape[1] == 0:
+            return idx, dists, np.full(f, np.inf, np.float32), np.zeros(f, np.float32), np.zeros(f, bool)
+        margins = dists[:, 1] - dists[:, 0] if idx.shape[1] > 1 else np.full(f, np.inf, np.float32)
+        limits = self.thresholds[idx[:, 0]] + np.float32(shift)
+        accepted = (dists[:, 0] <= limits) & (margins >= config.MATCH_MIN_MARGIN)
+        return idx[:, :k], dists[:, :k], margins, limits, accepted
+
+    def identify(self, queries, scope: Optional[Iterable[str]] = None) -> List[Identification]:
+        """Nearest identity, margin and calibrated threshold shift for each query (within `scope`, if given)."""
+        idx, dists, margins, limits, _ = self.search_open_set(queries, scope=scope)
+        if idx.shape[1] == 0:
+            return [Identification(None, 1.0, float("inf"), 0.0) for _ in range(len(idx))]
+        return [
+            Identification(self.names[i], float(d), float(m), float(l) - config.DEFAULT_DISTANCE_THRESHOLD)
+            for i, d, m, l in zip(idx[:, 0], dists[:, 0], margins, limits)
+        ]
+
+    def _target_separation(self, i: int) -> float:
+        """Smallest angle between identity i's templates and any other identity's (cached until the next change)."""
+        sep = self._separation.get(i)
+        if sep is None:
+            r0, r1 = self.offsets[i], self.offsets[i + 1]
+            sims = similarities(self._rows(r0, r1), self.matrix, self.scales)
+            sims[:, r0:r1] = -1.0
+            sep = self._separation[i] = float(np.arccos(np.clip(sims.max(), -1.0, 1.0)))
+        return sep
+
+    def check_target(self, queries, name: str,
+                     threshold: float = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Score queries against one enrolled identity's templates only (see identify_target).
+
+        Returns:
+            dists: (F,) distances to `name` (aggregated like search())
+            margins: (F,) lower bounds on the margin to any other identity
+            unsure: (F,) bool, neither a clear accept nor a clear reject at `threshold`
+        """
+        shift = 0.0 if threshold is None else threshold - config.DEFAULT_DISTANCE_THRESHOLD
+        Q = _as_queries(queries, self.dim)
+        i = self._index[name]
+        r0, r1 = self.offsets[i], self.offsets[i + 1]
+        sims = similarities(Q, self.matrix[r0:r1], self._scales_at(slice(r0, r1)))  # (F, M)
+        nearest = sims.max(axis=1) if len(Q) else np.zeros(0, np.float32)
+        if self._pad is not None and config.GALLERY_TEMPLATE_AGGREGATION == "topk_mean":
+            t = max(1, min(config.GALLERY_TEMPLATE_TOP_K, r1 - r0))
+            dists = 1.0 - (-np.sort(-sims, axis=1)[:, :t]).mean(axis=1)
+        else:
+            dists = 1.0 - nearest
+        # Triangle inequality on angles: any other identity is at least `gap` from the face
+        gap = np.maximum(self._target_separation(i) - np.arccos(np.clip(nearest, -1.0, 1.0)), 0.0)
+        margins = (1.0 - np.cos(gap)) - dists - TARGET_MARGIN_SLACK
+        limit = float(self.thresholds[i]) + shift
+        return dists, margins, (dists <= limit) & (margins < config.MATCH_MIN_MARGIN)
+
+    def identify_target(self, queries, name: str, threshold: float = None,
+                        scope: Optional[Iterable[str]] = None) -> List[Identification]:
+        """
+        identify() for loops that only need to know whether each face is `name`
+        (the lock target), scoring most faces against the target's templates alone.
+
+        A face beyond the target's threshold is a clear reject. A face close
+        enough that no other identity can come within MATCH_MIN_MARGIN is a
+        clear accept: every other template is at least the target's angular
+        separation from it, minus the face's angle to the target. Only faces
+        in between go through the full open-set search (over `scope` plus the
+        target, if a scope is given), so the accept/reject decision for the
+        target is the same as identify()'s.
+
+        Args:
+            queries: (F, D) array or list of (D,) embeddings
+            name: Lock target (if not enrolled, this is identify())
+            threshold: Live global threshold the clear cases are judged at
+                       (None = DEFAULT_DISTANCE_THRESHOLD)
+            scope: Identities for the full search (None = all)
+
+        Returns:
+            One Identification per query. Short-circuited faces name the target,
+            with a lower bound on the margin (never more permissive at other thresholds).
+        """
+        if name not in self._index or len(self.names) == 1:
+            return self.identify(queries, scope)
+        Q = _as_queries(queries, self.dim)
+        i = self._index[name]
+        dists, margins, unsure = self.check_target(Q, name, threshold)
+        target_shift = float(self.thresholds[i]) - config.DEFAULT_DISTANCE_THRESHOLD
+        results = [Identification(name, float(d), float(m), target_shift) for d, m in zip(dists, margins)]
+        unsure = np.flatnonzero(unsure)
+        if len(unsure):
+            full_scope = None if scope is None else {*scope, name}
+            for j, ident in zip(unsure, self.identify(Q[unsure], full_scope)):
+                results[j] = ident
+        return results
+
+    # ---- watchlists -------------------------------------------------------
+
+    @property
+    def watchlists(self) -> Dict[str, List[str]]:
+        """Named identity subsets from metadata["watchlists"] (may name people no longer enrolled)."""
+        return dict(self.metadata.get("watchlists") or {})
+
+    def watchlist(self, name: str) -> List[str]:
+        """
+        Enrolled members of a named watchlist, sorted.
+
+        Raises:
+            KeyError: If no watchlist has this name
+        """
+        return sorted(n for n in self.watchlists[name] if n in self._index)
+
+    def best_matches(self, queries) -> List[Tuple[str, float]]:
+        """Nearest identity and its distance for each query (no threshold)."""
+        idx, dists = self.search(queries, 1)
+        if idx.shape[1] == 0:
+            return [(None, 1.0)] * len(idx)
+        return [(self.names[i], float(d)) for i, d in zip(idx[:, 0], dists[:, 0])]
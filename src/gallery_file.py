@@ -0,0 +1,199 @@
+"""
+Flat gallery layout, memory-mapped from disk or placed in shared memory.
+A small JSON header, then the raw page-aligned template matrix, int8 row
+scales, identity offsets and the names. Loading maps the arrays read-only
+instead of decompressing and copying them, so it takes about the same time
+for any gallery size, and every process mapping the same bytes (file pages
+or a shared-memory segment, see src/shared_gallery.py) shares one copy.
+
+Layout:
+    magic (8 bytes) | header length (uint32 LE) | JSON header | padding
+    matrix (T, D), starting on the first page boundary after the header
+    scales (T,) float32 (int8 only) | offsets (N + 1,) int64 | names (UTF-8, "\n"-joined)
+Section positions in the header are relative to the start of the matrix.
+"""
+
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+
+GALLERY_FILE_MAGIC = b"FACEGAL\0"
+GALLERY_FILE_VERSION = 1
+PAGE_SIZE = 4096
+_PREFIX = len(GALLERY_FILE_MAGIC) + 4
+
+
+def gallery_file_path(storage: str) -> Path:
+    """Mapped gallery file for one storage precision."""
+    return config.DB_DIR / f"face_db.{storage}.gallery"
+
+
+def _align(n: int, alignment: int) -> int:
+    return (n + alignment - 1) // alignment * alignment
+
+
+def _data_offset(header_length: int) -> int:
+    """Position of the matrix: the first page boundary after the header."""
+    return _align(_PREFIX + header_length, PAGE_SIZE)
+
+
+class GalleryLayout:
+    """
+    Serialized form of one packed gallery, ready to be written to a file
+    or copied into a buffer of `nbytes` bytes.
+    """
+
+    def __init__(self, names: List[str], offsets: np.ndarray, matrix: np.ndarray,
+                 scales: Optional[np.ndarray] = None, **header):
+        """
+        Args:
+            names: Sorted identity names (no newlines)
+            offsets: (N + 1,) identity boundaries into matrix rows
+            matrix: (T, D) templates in storage precision
+            scales: (T,) float32 row scales for int8 matrices
+            **header: Extra JSON-serializable header fields (source key, metadata, ...)
+        """
+        self.matrix = np.ascontiguousarray(matrix)
+        names_blob = "\n".join(names).encode("utf-8")
+        fields = {
+            "format": GALLERY_FILE_VERSION,
+            "dtype": self.matrix.dtype.str,
+            "shape": list(self.matrix.shape),
+            "count": len(names),
+            "names_length": len(names_blob),
+            **header,
+        }
+        self.sections = {
+            "scales": np.ascontiguousarray(scales, dtype="<f4").tobytes() if scales is not None else None,
+            "offsets": np.ascontiguousarray(offsets, dtype="<i8").tobytes(),
+            "names": names_blob,
+        }
+        pos = self.matrix.nbytes
+        for key, blob in self.sections.items():
+            pos = _align(pos, 64)
+            fields[f"{key}_at"] = pos if blob is not None else None
+            pos += len(blob) if blob is not None else 0
+        self.fields = fields
+        self.head = json.dumps(fields).encode("utf-8")
+        self.data_offset = _data_offset(len(self.head))
+        self.nbytes = self.data_offset + pos
+
+    def _pieces(self):
+        """(position, uint8 array) of everything to write."""
+        yield 0, np.frombuffer(GALLERY_FILE_MAGIC + struct.pack("<I", len(self.head)) + self.head, np.uint8)
+        yield self.data_offset, self.matrix.reshape(-1).view(np.uint8)
+        for key, blob in self.sections.items():
+            if blob is not None:
+                yield self.data_offset + self.fields[f"{key}_at"], np.frombuffer(blob, np.uint8)
+
+    def write_into(self, buf) -> None:
+        """Copy into a writable buffer of at least `nbytes` bytes (e.g. shared memory)."""
+        view = np.frombuffer(buf, dtype=np.uint8, count=self.nbytes)
+        for pos, piece in self._pieces():
+            view[pos:pos + len(piece)] = piece
+
+    def write(self, path, durable: bool = False) -> None:
+        """
+        Write to a file atomically (temp file + rename). Processes that
+        already mapped the old file keep reading it until they reload;
+        the rename never changes bytes under them.
+
+        Args:
+            path: Destination file
+            durable: fsync the data before the rename (a source of truth, not a cache)
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+        with open(tmp, "wb") as f:
+            for pos, piece in self._pieces():
+                f.seek(pos)
+                f.write(piece.tobytes())
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+def write_gallery_file(path, names: List[str], offsets: np.ndarray, matrix: np.ndarray,
+                       scales: Optional[np.ndarray] = None, **header) -> None:
+    """Write a gallery file atomically (see GalleryLayout for the arguments)."""
+    GalleryLayout(names, offsets, matrix, scales, **header).write(path)
+
+
+def _parse_header(prefix: bytes, read) -> Dict:
+    """Header dict from the magic + length prefix; read(n) returns the next n bytes."""
+    if len(prefix) < _PREFIX or prefix[:len(GALLERY_FILE_MAGIC)] != GALLERY_FILE_MAGIC:
+        raise ValueError("not a gallery file")
+    (length,) = struct.unpack("<I", prefix[len(GALLERY_FILE_MAGIC):_PREFIX])
+    header = json.loads(read(length).decode("utf-8"))
+    if header.get("format") != GALLERY_FILE_VERSION:
+        raise ValueError(f"unsupported gallery file format {header.get('format')}")
+    header["data_offset"] = _data_offset(length)
+    return header
+
+
+def read_gallery_header(path) -> Dict:
+    """
+    Parse just the header of a gallery file.
+
+    Raises:
+        ValueError: If the file isn't a compatible gallery file
+    """
+    with open(path, "rb") as f:
+        try:
+            return _parse_header(f.read(_PREFIX), f.read)
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}") from None
+
+
+def parse_gallery_buffer(buf) -> Tuple[Dict, List[str], np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    Zero-copy view of a gallery layout held in a buffer (memory map, shared memory).
+
+    Returns:
+        (header, names, offsets, matrix, scales): matrix and scales are
+        read-only views into `buf`; offsets is a small copy
+
+    Raises:
+        ValueError: If the buffer isn't a compatible, complete gallery layout
+    """
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    header = _parse_header(raw[:_PREFIX].tobytes(), lambda n: raw[_PREFIX:_PREFIX + n].tobytes())
+    shape = tuple(header["shape"])
+    count = int(header["count"])
+    base = header["data_offset"]
+    if shape[0] == 0 or len(raw) < base + header["names_at"] + header["names_length"]:
+        raise ValueError("empty or truncated gallery layout")
+    matrix = np.frombuffer(buf, dtype=np.dtype(header["dtype"]), count=shape[0] * shape[1],
+                           offset=base).reshape(shape)
+    matrix.flags.writeable = False
+    scales = None
+    if header["scales_at"] is not None:
+        scales = np.frombuffer(buf, dtype="<f4", count=shape[0], offset=base + header["scales_at"])
+        scales.flags.writeable = False
+    offsets = np.frombuffer(buf, dtype="<i8", count=count + 1, offset=base + header["offsets_at"]).astype(np.intp)
+    start = base + header["names_at"]
+    names = raw[start:start + header["names_length"]].tobytes().decode("utf-8").split("\n") if count else []
+    if len(names) != count or offsets[-1] != shape[0]:
+        raise ValueError("inconsistent gallery layout")
+    return header, names, offsets, matrix, scales
+
+
+def map_gallery_file(path) -> Tuple[Dict, List[str], np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    Map a gallery file read-only (see parse_gallery_buffer for the result).
+
+    Raises:
+        ValueError: If the file isn't a compatible gallery file or is truncated
+    """
+    try:
+        return parse_gallery_buffer(np.memmap(path, dtype=np.uint8, mode="r"))
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}") from None
@@ -0,0 +1,136 @@
+"""
+Parallel exact search for very large galleries.
+The packed templates are split into contiguous shards on identity
+boundaries and the shards are scored concurrently on a thread pool (NumPy's
+matrix multiply and dtype casts release the GIL); the per-shard top-k lists
+are then merged. Results are the same as one single-threaded scan. Used by
+FaceGallery's exact search from 2 x GALLERY_SHARD_MIN_ROWS templates up.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from .matching import _as_queries, _top_k, match_embeddings, match_templates, template_pad_index
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+
+def available_cores() -> int:
+    """CPU cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not on Linux
+        return os.cpu_count() or 1
+
+
+def auto_shards(templates: int, cores: int = None) -> int:
+    """One shard per core, but no shard smaller than GALLERY_SHARD_MIN_ROWS templates."""
+    cores = cores or available_cores()
+    return max(1, min(cores, templates // max(1, config.GALLERY_SHARD_MIN_ROWS)))
+
+
+def _executor(workers: int) -> ThreadPoolExecutor:
+    """
+    Process-wide search pool with at least `workers` threads. Sized for one
+    shard per core up front, so it is normally created once. A pool outgrown
+    by an explicit GALLERY_SEARCH_SHARDS is replaced but not shut down: another
+    thread may still be mapping on it, and its idle threads exit once that
+    last reference goes.
+    """
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size < workers:
+            _pool_size = max(workers, available_cores())
+            _pool = ThreadPoolExecutor(_pool_size, thread_name_prefix="gallery-shard")
+        return _pool
+
+
+class ShardedSearch:
+    """
+    Exact k-nearest-identity search over a packed gallery, one thread per shard.
+
+    Shards are views into the gallery's matrix (no copies), so they work the
+    same on memory-mapped and shared-memory galleries.
+    """
+
+    def __init__(self, offsets: np.ndarray, matrix: np.ndarray, scales: Optional[np.ndarray] = None,
+                 shards: int = None):
+        """
+        Args:
+            offsets: (N + 1,) identity boundaries into matrix rows
+            matrix: (T, D) packed templates in storage precision
+            scales: (T,) row scales of an int8 matrix
+            shards: Shard count (None = auto_shards; clipped to the identity count)
+        """
+        n, total = len(offsets) - 1, int(offsets[-1])
+        shards = max(1, min(auto_shards(total) if shards is None else shards, n))
+        self.multi_template = bool(n) and int(np.diff(offsets).max()) > 1
+        # Identity cuts closest to equal template counts
+        cuts = np.unique(np.searchsorted(offsets, np.linspace(0, total, shards + 1), side="left"))
+        cuts[0], cuts[-1] = 0, n
+        cuts = np.unique(cuts)
+
+        self.shards: List[Tuple[int, np.ndarray, np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]] = []
+        for i0, i1 in zip(cuts[:-1], cuts[1:]):
+            r0, r1 = offsets[i0], offsets[i1]
+            local = offsets[i0:i1 + 1] - r0
+            self.shards.append((
+                int(i0), local, matrix[r0:r1],
+                scales[r0:r1] if scales is not None else None,
+                template_pad_index(local) if self.multi_template else None,
+            ))
+        self.dim = matrix.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def _search_shard(self, shard, q: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        first, offsets, matrix, scales, pad = shard
+        if not self.multi_template:
+            idx, dists = match_embeddings(q, matrix, k, scales)
+        else:
+            idx, dists = match_templates(
+                q, matrix, offsets, k,
+                config.GALLERY_TEMPLATE_AGGREGATION, config.GALLERY_TEMPLATE_TOP_K, pad, scales,
+            )
+        return idx + first, dists
+
+    def search(self, queries, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k nearest identities per query (same result as FaceGallery.search(exact=True)).
+
+        Returns:
+            indices: (F, k) identity indices, nearest first
+            distances: (F, k) cosine distances, ascending
+        """
+        q = _as_queries(queries, self.dim)
+        if len(self.shards) == 1:
+            return self._search_shard(self.shards[0], q, k)
+        pool = _executor(len(self.shards))
+        parts = list(pool.map(lambda shard: self._search_shard(shard, q, k), self.shards))
+        idx = np.concatenate([i for i, _ in parts], axis=1)
+        dists = np.concatenate([d for _, d in parts], axis=1)
+        if idx.shape[1] == 0:
+            return idx, dists
+        order, dists = _top_k(dists, min(k, idx.shape[1]))
+        return np.take_along_axis(idx, order, axis=1), dists
+
+
+def build_shards(offsets: np.ndarray, matrix: np.ndarray,
+                 scales: Optional[np.ndarray] = None) -> Optional[ShardedSearch]:
+    """
+    ShardedSearch for a gallery per GALLERY_SEARCH_SHARDS, or None if it
+    would have a single shard (the plain scan is then used).
+    """
+    shards = config.GALLERY_SEARCH_SHARDS or auto_shards(len(matrix))
+    if shards <= 1 or len(offsets) <= 2:
+        return None
+    search = ShardedSearch(offsets, matrix, scales, shards)
+    return search if len(search) > 1 else None
@@ -0,0 +1,176 @@
+"""
+Gallery hot reload.
+A background thread watches the database file (size + mtime) and loads a
+changed gallery off the frame loop, so enrollments made elsewhere reach
+running trackers and a reload never stalls the video. Enrollments appended
+to the journal (src/face_journal.py) are applied without a full reload:
+only the new entries are read. The live loop picks the new gallery up with
+poll() and swaps it in between frames. A gallery attached from shared
+memory is followed through the owner's version counter.
+"""
+
+import threading
+from typing import Optional
+
+from . import config
+from .embedding_cache import file_key
+from .face_journal import read_journal
+from .gallery import FaceGallery
+from .model_registry import gallery_model_error
+
+
+def database_key() -> str:
+    """Size + mtime of the database file ("" if missing)."""
+    try:
+        return file_key(config.DB_PATH, "stat")
+    except OSError:
+        return ""
+
+
+def journal_key() -> str:
+    """Size + mtime of the journal ("" if missing)."""
+    try:
+        return file_key(config.DB_JOURNAL_PATH, "stat")
+    except OSError:
+        return ""
+
+
+def rematch_tracks(gallery: FaceGallery, tracker, scope=None) -> None:
+    """
+    Re-match every track's cached embedding after the gallery changed.
+    Accept holds survive for names that are still enrolled.
+
+    Args:
+        scope: Identities the loop searches (None = all, see src/watchlist.py)
+    """
+    tracker.reset_identities(keep=gallery)
+    queried = [tr for tr in tracker.tracks.values() if tr.query is not None]
+    for tr, ident in zip(queried, gallery.identify([tr.query for tr in queried], scope)):
+        tr.set_identity(ident)
+
+
+class GalleryWatcher:
+    """
+    Background loader for a live FaceGallery.
+
+    Database commits are atomic renames (src/face_db.py) and shared
+    snapshots are published atomically, so a change is loaded as soon as it
+    is seen. A new gallery that fails to load, fails the model check, is empty or has a
+    different embedding size is rejected and the current one stays.
+    """
+
+    def __init__(self, gallery: FaceGallery, interval_s: float = None, enabled: bool = None,
+                 check_model: bool = True):
+        """
+        Args:
+            gallery: The gallery being searched (its storage is reused)
+            interval_s: Seconds between checks (None = config.GALLERY_WATCH_INTERVAL_S)
+            enabled: Poll on its own (None = config.GALLERY_WATCH_ENABLED); if
+                     False, only request() triggers a load
+            check_model: Refuse galleries built with a different embedding model
+        """
+        self.gallery = gallery
+        self.interval_s = config.GALLERY_WATCH_INTERVAL_S if interval_s is None else interval_s
+        self.enabled = config.GALLERY_WATCH_ENABLED if enabled is None else enabled
+        self.check_model = check_model
+
+        self._key = self._current_key()
+        self._journal_key = journal_key()
+        self._base = gallery  # Latest gallery produced; journal entries are applied to a copy of it
+        self._pending: Optional[FaceGallery] = None
+        self._forced = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="gallery-watcher", daemon=True)
+        self._thread.start()
+
+    def request(self) -> None:
+        """Load the database now (e.g. the 'r' key), even if the files look unchanged."""
+        with self._lock:
+            self._forced = True
+        self._wake.set()
+
+    def poll(self) -> Optional[FaceGallery]:
+        """The newly loaded gallery, once (None if nothing new). Non-blocking."""
+        with self._lock:
+            fresh, self._pending = self._pending, None
+        return fresh
+
+    def close(self) -> None:
+        """Stop the watcher thread."""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=1.0)
+
+    def _current_key(self) -> str:
+        shared = self.gallery.shared
+        return shared.key() if shared is not None else database_key()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval_s if self.enabled else None)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            with self._lock:
+                forced, self._forced = self._forced, False
+            key = self._current_key()
+            if forced or key != self._key:
+                self._load(key)
+            elif self.gallery.shared is None and journal_key() != self._journal_key:
+                self._replay()
+
+    def _load(self, key: str) -> None:
+        # The key is recorded even on failure so the same broken files aren't retried
+        self._key = key
+        self._journal_key = journal_key()
+        shared = self.gallery.shared
+        try:
+            if shared is not None:
+                fresh = shared.snapshot()
+                if fresh is None:
+                    self._key = ""  # Replaced while attaching; take the next one
+                    return
+                error = gallery_model_error(fresh.metadata) if self.check_model else None
+                if error:
+                    print(f"ERROR: {error}")
+                    return
+            else:
+                fresh = FaceGallery.load(check_model=self.check_model, storage=self.gallery.storage)
+        except Exception as e:
+            print(f"⚠ Gallery reload failed ({e}); keeping the current identities")
+            return
+        self._accept(fresh)
+
+    def _replay(self) -> None:
+        """Apply the journal entries appended since the last load."""
+        self._journal_key = journal_key()
+        base = self._base
+        try:
+            replay = read_journal(base.journal_base, base.journal_pos)
+            if replay is None or not replay[0]:
+                return  # Nothing new, or a new database whose key change triggers a full load
+            fresh = base.copy()
+            fresh.apply_journal(*replay)
+        except Exception as e:
+            print(f"⚠ Journal replay failed ({e}); keeping the current identities")
+            return
+        error = gallery_model_error(fresh.metadata) if self.check_model else None
+        if error:
+            print(f"ERROR: {error}")
+            return
+        self._accept(fresh)
+
+    def _accept(self, fresh: FaceGallery) -> None:
+        """Hand a new gallery to poll() unless it would break the live loop."""
+        if not len(fresh):
+            print("⚠ Reloaded gallery is empty; keeping the current identities")
+            return
+        if len(self.gallery) and fresh.dim != self.gallery.dim:
+            print(f"⚠ Reloaded gallery has {fresh.dim}-d embeddings, expected {self.gallery.dim}; "
+                  f"keeping the current identities")
+            return
+        self._base = fresh
+        with self._lock:
+            self._pending = fresh
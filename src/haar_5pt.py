@@ -8,12 +8,9 @@ from typing import Optional, List, Tuple
 import cv2
 import numpy as np
 
-try:
-    import mediapipe as mp
-except ImportError:
-    mp = None
-
 from . import config
+from .lazy_imports import mediapipe
+from .quality import FaceQuality, assess_quality
 
 
 @dataclass
@@ -25,6 +22,12 @@ class FaceDetection:
     y2: int
     score: float
     landmarks: np.ndarray  # (5, 2) float32
+    quality: Optional[FaceQuality] = None
+    
+    @property
+    def embeddable(self) -> bool:
+        """False if the quality gate says this face isn't worth embedding."""
+        return not config.QUALITY_GATE_ENABLED or self.quality is None or self.quality.passed
 
 
 class HaarMediaPipeFaceDetector:
@@ -37,8 +40,7 @@ class HaarMediaPipeFaceDetector:
         if self.haar.empty():
             raise RuntimeError(f"Failed to load Haar cascade from {cascade_path}")
         
-        if mp is None:
-            raise RuntimeError("mediapipe not installed. Run: pip install mediapipe")
+        mp = mediapipe()  # RuntimeError if not installed
         
         self.mesh = mp.solutions.face_mesh.FaceMesh(
             static_image_mode=config.FACEMESH_STATIC_MODE,
@@ -50,6 +52,27 @@ class HaarMediaPipeFaceDetector:
         
         self.min_size = min_size
     
+    def warm_up(self, runs: int = config.STARTUP_WARMUP_RUNS, frame_size=None):
+        """
+        Run Haar and FaceMesh on blank frames so the first real frame doesn't
+        pay for lazy initialization (graph setup, buffer allocation).
+        
+        Args:
+            runs: Number of dummy passes
+            frame_size: (width, height) of the dummy frame (default: camera size)
+        """
+        w, h = frame_size or (config.CAMERA_FRAME_WIDTH, config.CAMERA_FRAME_HEIGHT)
+        gray = np.zeros((h, w), dtype=np.uint8)
+        rgb = np.zeros((h, w, 3), dtype=np.uint8)
+        for _ in range(max(0, runs)):
+            self.haar.detectMultiScale(
+                gray,
+                scaleFactor=config.HAAR_SCALE_FACTOR,
+                minNeighbors=config.HAAR_MIN_NEIGHBORS,
+                minSize=self.min_size,
+            )
+            self.mesh.process(rgb)
+    
     def _bbox_from_landmarks(self, kps):
         """Build face-like bbox from 5 landmarks with padding."""
         x_min = float(np.min(kps[:, 0]))
@@ -186,7 +209,8 @@ class HaarMediaPipeFaceDetector:
                 FaceDetection(
                     x1=x1, y1=y1, x2=x2, y2=y2,
                     score=1.0,
-                    landmarks=kps.astype(np.float32)
+                    landmarks=kps.astype(np.float32),
+                    quality=assess_quality(gray, (x1, y1, x2, y2), kps),
                 )
             )
         
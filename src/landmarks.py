@@ -7,13 +7,8 @@ import sys
 import cv2
 import numpy as np
 
-try:
-    import mediapipe as mp
-except ImportError:
-    print("ERROR: mediapipe not installed. Run: pip install mediapipe")
-    sys.exit(1)
-
 from . import config
+from .lazy_imports import mediapipe
 
 
 def main():
@@ -28,6 +23,12 @@ def main():
         print(f"ERROR: Failed to load cascade from {cascade_path}")
         return False
     
+    try:
+        mp = mediapipe()
+    except RuntimeError as e:
+        print(f"ERROR: {e}")
+        return False
+    
     # Initialize FaceMesh
     mp_face_mesh = mp.solutions.face_mesh.FaceMesh(
         static_image_mode=config.FACEMESH_STATIC_MODE,
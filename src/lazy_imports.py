@@ -0,0 +1,37 @@
+"""
+On-demand imports of heavy dependencies.
+onnxruntime and mediapipe take hundreds of milliseconds to import, so modules
+load them only when a component that needs them is constructed (or a demo
+runs), not when the module itself is imported.
+"""
+
+import importlib
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def require(module: str, package: str = None):
+    """
+    Import a module on first use.
+
+    Args:
+        module: Module name (e.g. "mediapipe")
+        package: pip package to suggest if it's missing (default: module)
+
+    Raises:
+        RuntimeError: If the module isn't installed
+    """
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise RuntimeError(f"{module} not installed. Run: pip install {package or module}") from e
+
+
+def mediapipe():
+    """The mediapipe module (imported on first call)."""
+    return require("mediapipe")
+
+
+def onnxruntime():
+    """The onnxruntime module (imported on first call)."""
+    return require("onnxruntime")
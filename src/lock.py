@@ -13,25 +13,14 @@ import numpy as np
 from . import config
 from .haar_5pt import HaarMediaPipeFaceDetector, FaceDetection
 from .align import FaceAligner
-from .embed import ArcFaceEmbedder
+from .embed import ArcFaceEmbedder, EmbeddingBuffer
+from .face_tracker import FaceTracker
+from .gallery import FaceGallery
+from .gallery_watcher import GalleryWatcher
+from .watchlist import watchlist_scope
 from . import actions as action_module
 
 
-def load_database():
-    """Load enrolled face database."""
-    if not config.DB_NPZ_PATH.exists():
-        return {}
-    data = np.load(str(config.DB_NPZ_PATH), allow_pickle=True)
-    return {k: data[k].astype(np.float32) for k in data.files}
-
-
-def cosine_distance(a, b):
-    """Compute cosine distance between two vectors."""
-    a = a.reshape(-1).astype(np.float32)
-    b = b.reshape(-1).astype(np.float32)
-    return 1.0 - float(np.dot(a, b))
-
-
 def get_full_landmarks(frame):
     """Run MediaPipe Face Mesh on frame; return first face landmark list or None."""
     return action_module.get_face_mesh_landmarks(frame)
@@ -77,12 +66,17 @@ def detect_actions(frame, prev_center_x, center_x, prev_ear, prev_mouth_width,
 
 def main():
     """Face Locking: select one identity, lock onto that face, track and record actions."""
-    db = load_database()
-    if not db:
+    gallery = FaceGallery.load()
+    if not len(gallery):
         print("ERROR: No enrolled identities. Run: python -m src.enroll")
         return False
 
-    names = sorted(db.keys())
+    try:
+        scope = watchlist_scope(gallery)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return False
+    names = scope or gallery.names
     print("\nEnrolled identities:")
     for i, n in enumerate(names, 1):
         print(f"  {i}. {n}")
@@ -93,7 +87,7 @@ def main():
         choice = names[0] if names else ""
     if not choice:
         choice = names[0] if names else ""
-    if choice not in db:
+    if choice not in gallery:
         print(f"ERROR: '{choice}' not in database. Choose from: {names}")
         return False
     lock_identity = choice
@@ -105,8 +99,8 @@ def main():
     detector = HaarMediaPipeFaceDetector(min_size=config.HAAR_MIN_SIZE)
     aligner = FaceAligner()
     embedder = ArcFaceEmbedder(config.ARCFACE_MODEL_PATH)
-    embeddings_matrix = np.stack([db[n].reshape(-1) for n in names], axis=0)
-    lock_idx = names.index(lock_identity)
+    embed_buffer = EmbeddingBuffer(embedder.embedding_dim)  # Reused every frame; add_embedding copies rows
+    tracker = FaceTracker()
     threshold = config.DEFAULT_DISTANCE_THRESHOLD
 
     cap = cv2.VideoCapture(config.CAMERA_INDEX)
@@ -128,6 +122,9 @@ def main():
 
     print("\nFace Locking - When the selected face appears, system will lock. q=Quit")
 
+    # Loads database changes in the background; swapped in between frames below
+    watcher = GalleryWatcher(gallery)
+
     t0 = time.time()
     frame_count = 0
     fps = 0.0
@@ -145,18 +142,49 @@ def main():
                 t0 = time.time()
             frame_count += 1
 
+            fresh = watcher.poll()
+            if fresh is not None:
+                gallery.swap(fresh)
+                if scope is not None:
+                    try:
+                        scope = watchlist_scope(gallery)
+                    except ValueError as e:
+                        print(f"⚠ {e}; keeping the previous watchlist")
+                if lock_identity not in gallery:
+                    print("⚠", lock_identity, "is no longer enrolled; the lock will be released")
+                print(f"✓ Reloaded {len(gallery)} identities")
+
             vis = frame.copy()
             H, W = frame.shape[:2]
             faces = detector.detect(frame)
+            
+            # Reuse each track's smoothed embedding; only stale tracks are re-embedded
+            tracks = tracker.update(faces, frame_idx)
+            stale = [(face, tr) for face, tr in zip(faces, tracks)
+                     if face.embeddable and tr.needs_embedding(frame_idx)]
+            if stale:
+                out, norms = embed_buffer.views(len(stale))
+                embs, _ = embedder.embed_batch([aligner.align(frame, face.landmarks)[0] for face, _ in stale],
+                                               out=out, norms_out=norms)
+                for (_, tr), emb in zip(stale, embs):
+                    tr.mark_embedding_requested(frame_idx)
+                    tr.add_embedding(emb)
+            # Faces that passed the quality gate at least once, matched in one call
+            matchable = [(face, tr.query) for face, tr in zip(faces, tracks) if tr.query is not None]
+            # Open-set decision in the same pass: per-identity threshold and top-2 margin.
+            # Only the lock target matters here, so faces are checked against its
+            # templates first and only unclear ones search the gallery (or watchlist)
+            queries = [q for _, q in matchable]
+            if config.LOCK_FAST_PATH:
+                idents = gallery.identify_target(queries, lock_identity, threshold, scope)
+            else:
+                idents = gallery.identify(queries, scope)
+            matches = [(face, ident.name, ident.dist, ident.accepted(threshold))
+                       for (face, _), ident in zip(matchable, idents)]
 
             if not locked:
-                for face in faces:
-                    aligned, _ = aligner.align(frame, face.landmarks)
-                    query_emb, _ = embedder.embed(aligned)
-                    dists = np.array([cosine_distance(query_emb, embeddings_matrix[i]) for i in range(len(names))])
-                    best_idx = int(np.argmin(dists))
-                    best_dist = dists[best_idx]
-                    if best_idx == lock_idx and best_dist <= threshold:
+                for face, best_name, best_dist, ok in matches:
+                    if best_name == lock_identity and ok:
                         locked = True
                         fail_count = 0
                         ts = time.strftime("%Y%m%d%H%M%S", time.localtime())
@@ -176,13 +204,8 @@ def main():
             else:
                 matched_face = None
                 best_dist = 1.0
-                for face in faces:
-                    aligned, _ = aligner.align(frame, face.landmarks)
-                    query_emb, _ = embedder.embed(aligned)
-                    dists = np.array([cosine_distance(query_emb, embeddings_matrix[i]) for i in range(len(names))])
-                    idx = int(np.argmin(dists))
-                    d = dists[idx]
-                    if idx == lock_idx and d <= threshold:
+                for face, name, d, ok in matches:
+                    if name == lock_identity and ok:
                         matched_face = face
                         best_dist = d
                         fail_count = 0
@@ -255,6 +278,7 @@ def main():
             if key == ord("q"):
                 break
     finally:
+        watcher.close()
         cap.release()
         cv2.destroyAllWindows()
         if history_file:
@@ -0,0 +1,156 @@
+"""
+Embedding model registry.
+Describes each face embedder listed in config.EMBEDDING_MODELS (file, input
+size, normalization, output dimension, hash) and tags galleries with the
+model that produced them so embeddings from different models never mix.
+"""
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from . import config
+
+
+@dataclass(frozen=True)
+class EmbeddingModelSpec:
+    """How to run one embedding model."""
+    name: str
+    path: Path
+    input_size: Tuple[int, int] = config.EMBEDDING_INPUT_SIZE  # (width, height)
+    mean: float = config.EMBEDDING_PREPROCESS_MEAN
+    scale: float = config.EMBEDDING_PREPROCESS_SCALE
+    channels: str = "rgb"  # "rgb" or "bgr"
+    embedding_dim: int = config.EMBEDDING_DIM
+    sha256: Optional[str] = None  # Expected file hash (None = not pinned)
+    description: str = ""
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def file_hash(self) -> str:
+        """SHA-256 of the model file."""
+        from .embed import model_file_hash
+        return model_file_hash(self.path)
+
+    def verify(self) -> None:
+        """Raise ValueError if the file doesn't match the pinned hash."""
+        if self.sha256 and self.file_hash() != self.sha256.lower():
+            raise ValueError(
+                f"{self.path} does not match the sha256 registered for model '{self.name}'"
+            )
+
+    def preprocess_signature(self) -> str:
+        """Everything about preprocessing that changes the embedding of a crop."""
+        w, h = self.input_size
+        return (
+            f"v{config.EMBEDDING_PREPROCESS_VERSION}"
+            f"-{w}x{h}-m{self.mean}-s{self.scale}-{self.channels}"
+        )
+
+    def gallery_tag(self) -> Dict:
+        """Metadata stored with a gallery built by this model."""
+        return {
+            "name": self.name,
+            "sha256": self.file_hash() if self.exists() else None,
+            "embedding_dim": self.embedding_dim,
+            "input_size": list(self.input_size),
+        }
+
+
+def _spec_from_entry(name: str, entry: Dict) -> EmbeddingModelSpec:
+    return EmbeddingModelSpec(
+        name=name,
+        path=Path(entry["path"]),
+        input_size=tuple(entry.get("input_size", config.EMBEDDING_INPUT_SIZE)),
+        mean=float(entry.get("mean", config.EMBEDDING_PREPROCESS_MEAN)),
+        scale=float(entry.get("scale", config.EMBEDDING_PREPROCESS_SCALE)),
+        channels=entry.get("channels", "rgb"),
+        embedding_dim=int(entry.get("embedding_dim", config.EMBEDDING_DIM)),
+        sha256=entry.get("sha256"),
+        description=entry.get("description", ""),
+    )
+
+
+def registered_models() -> List[EmbeddingModelSpec]:
+    """All models in config.EMBEDDING_MODELS."""
+    return [_spec_from_entry(n, e) for n, e in config.EMBEDDING_MODELS.items()]
+
+
+def get_model_spec(name: str = None) -> EmbeddingModelSpec:
+    """
+    Look up a registered model.
+
+    Args:
+        name: Registry key (None = config.EMBEDDING_MODEL)
+    """
+    name = name or config.EMBEDDING_MODEL
+    if name not in config.EMBEDDING_MODELS:
+        raise ValueError(
+            f"Unknown embedding model '{name}'. Registered: {', '.join(config.EMBEDDING_MODELS)}"
+        )
+    return _spec_from_entry(name, config.EMBEDDING_MODELS[name])
+
+
+def spec_for_path(model_path) -> EmbeddingModelSpec:
+    """
+    Spec of the registered model stored at model_path, or a spec with the
+    default ArcFace preprocessing for unregistered files.
+    """
+    resolved = Path(model_path).resolve()
+    for spec in registered_models():
+        if spec.path.resolve() == resolved:
+            return spec
+    return EmbeddingModelSpec(name=Path(model_path).stem, path=Path(model_path))
+
+
+def load_gallery_metadata() -> Dict:
+    """Gallery metadata (header of face_db.fdb, else the legacy face_db.json), or {} if there is none."""
+    from .face_db import read_face_db_header
+
+    try:
+        if config.DB_PATH.exists():
+            return read_face_db_header(config.DB_PATH).get("metadata") or {}
+        if config.DB_JSON_PATH.exists():
+            return json.loads(config.DB_JSON_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+def gallery_model_error(metadata: Dict, spec: EmbeddingModelSpec = None) -> Optional[str]:
+    """
+    Check that a gallery was built with the given model.
+
+    Args:
+        metadata: Gallery metadata (see load_gallery_metadata)
+        spec: Model about to be used (None = active model)
+
+    Returns:
+        None if compatible, else a message explaining the mismatch
+    """
+    spec = spec or get_model_spec()
+    tag = metadata.get("model") or {"name": config.LEGACY_GALLERY_MODEL}
+    fix = "Re-enroll with this model or set EMBEDDING_MODEL back in config.py."
+
+    if tag.get("name") != spec.name:
+        return (f"Gallery was built with model '{tag.get('name')}' but the active model is "
+                f"'{spec.name}'. {fix}")
+    dim = tag.get("embedding_dim", metadata.get("embedding_dim"))
+    if dim is not None and int(dim) != spec.embedding_dim:
+        return (f"Gallery has {dim}-d embeddings but model '{spec.name}' produces "
+                f"{spec.embedding_dim}-d embeddings. {fix}")
+    if tag.get("sha256") and spec.exists() and tag["sha256"] != spec.file_hash():
+        return (f"Model file {spec.path} changed since the gallery was built "
+                f"(hash mismatch). {fix}")
+    return None
+
+
+def check_gallery_model(spec: EmbeddingModelSpec = None) -> bool:
+    """Print an ERROR and return False if the saved gallery doesn't match the model."""
+    error = gallery_model_error(load_gallery_metadata(), spec)
+    if error:
+        print(f"ERROR: {error}")
+        return False
+    return True
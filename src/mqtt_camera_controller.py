@@ -4,9 +4,11 @@ Publishes camera movement commands to ESP8266 servo controller.
 """
 
 import json
+import threading
 import time
 from typing import Optional
-import paho.mqtt.client as mqtt
+
+from .lazy_imports import require
 
 
 class MQTTCameraController:
@@ -42,6 +44,7 @@ class MQTTCameraController:
         self.current_angle = 90  # Center position
         self.is_connected = False
         self.last_status = {}
+        self._connect_done = threading.Event()  # Set once the broker answered (either way)
         
         # Movement parameters
         self.min_angle = 0
@@ -49,6 +52,7 @@ class MQTTCameraController:
         self.center_angle = 90
         
         # Initialize MQTT client
+        mqtt = require("paho.mqtt.client", "paho-mqtt")
         self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="FaceRecognition_Controller")
         
         if username and password:
@@ -68,6 +72,20 @@ class MQTTCameraController:
         except Exception as e:
             print(f"✗ Failed to connect to MQTT broker: {e}")
             print(f"  Make sure broker is running at {broker_host}:{broker_port}")
+            self._connect_done.set()
+    
+    def wait_for_connection(self, timeout: float) -> bool:
+        """
+        Block until the broker accepts or rejects the connection.
+        
+        Args:
+            timeout: Max seconds to wait
+        
+        Returns:
+            True if connected
+        """
+        self._connect_done.wait(timeout)
+        return self.is_connected
     
     def _on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback when connected to MQTT broker."""
@@ -79,6 +97,7 @@ class MQTTCameraController:
             print(f"  Subscribed to: {self.topic_status}")
         else:
             print(f"✗ Connection failed with code {rc}")
+        self._connect_done.set()
     
     def _on_disconnect(self, client, userdata, rc):
         """Callback when disconnected from MQTT broker."""
@@ -0,0 +1,298 @@
+"""
+Offline (bulk) embedding engine.
+Embeds many aligned crops from disk: a thread pool decodes the JPEGs while
+batched ONNX inference runs across worker processes, each pinned to its share
+of the CPU cores. Crops already in the embedding cache are not recomputed.
+Used for enrollment re-scans, threshold evaluation and tests.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import cv2
+
+from . import config
+from .embed import ArcFaceEmbedder, EmbeddingBuffer, model_file_hash, quantized_model_path
+from .embedding_cache import EmbeddingCache, clear_cache
+from .model_registry import spec_for_path
+
+# Per-process embedder and output buffer, created by _init_worker() in each pool worker
+_WORKER_EMBEDDER: Optional[ArcFaceEmbedder] = None
+_WORKER_BUFFER: Optional[EmbeddingBuffer] = None
+
+
+def read_crop(path) -> Optional[np.ndarray]:
+    """Read one aligned crop (None if unreadable or wrongly sized)."""
+    img = cv2.imread(str(path))
+    if img is None or img.shape[:2] != config.EMBEDDING_INPUT_SIZE:
+        return None
+    return img
+
+
+def _init_worker(model_path, quantized: bool, intra_op_threads: int):
+    """Pool initializer: one session per process, limited to its share of cores."""
+    global _WORKER_EMBEDDER, _WORKER_BUFFER
+    cv2.setNumThreads(1)
+    config.ONNX_INTRA_OP_THREADS = intra_op_threads
+    config.ONNX_INTER_OP_THREADS = 1
+    _WORKER_EMBEDDER = ArcFaceEmbedder(model_path, quantized=quantized)
+    _WORKER_BUFFER = EmbeddingBuffer(_WORKER_EMBEDDER.embedding_dim)
+
+
+def _embed_in_worker(crops: np.ndarray) -> np.ndarray:
+    """Pool task: embed one (B, H, W, 3) uint8 batch (the result is pickled, so the buffer is reused)."""
+    out, norms = _WORKER_BUFFER.views(len(crops))
+    embs, _ = _WORKER_EMBEDDER.embed_batch(list(crops), out=out, norms_out=norms)
+    return embs
+
+
+def resolve_workers(workers: int = 0) -> Tuple[int, int]:
+    """
+    Pick (worker processes, intra-op threads per worker) for this machine.
+
+    Args:
+        workers: Requested process count (0 = auto: half the cores, at least 1)
+    """
+    cores = os.cpu_count() or 1
+    if workers <= 0:
+        workers = max(1, cores // 2)
+    workers = min(workers, cores)
+    return workers, max(1, cores // workers)
+
+
+class OfflineEmbedder:
+    """
+    Bulk embedder for crops stored on disk.
+
+    Small jobs (< OFFLINE_MIN_CROPS_FOR_POOL) run in-process, reusing
+    `embedder` if given, since starting worker processes and loading a model
+    in each costs more than it saves.
+    """
+
+    def __init__(
+        self,
+        model_path=config.ARCFACE_MODEL_PATH,
+        quantized=None,
+        workers: int = config.OFFLINE_EMBED_WORKERS,
+        decode_threads: int = config.OFFLINE_DECODE_THREADS,
+        batch_size: int = config.EMBEDDING_BATCH_SIZE,
+        embedder: Optional[ArcFaceEmbedder] = None,
+        verbose: bool = True,
+        use_cache: bool = None,
+    ):
+        """
+        Args:
+            model_path: FP32 ArcFace ONNX model
+            quantized: Use the INT8 variant (None = config.EMBEDDING_USE_INT8)
+            workers: Inference processes (0 = auto)
+            decode_threads: Threads decoding JPEGs
+            batch_size: Crops per inference task
+            embedder: Existing in-process embedder to reuse for small jobs
+            verbose: Print progress and throughput
+            use_cache: Reuse/store embeddings in the on-disk cache
+                       (None = config.EMBED_CACHE_ENABLED)
+        """
+        self.model_path = model_path
+        self.quantized = config.EMBEDDING_USE_INT8 if quantized is None else bool(quantized)
+        self.workers, self.threads_per_worker = resolve_workers(workers)
+        self.decode_threads = max(1, decode_threads)
+        self.batch_size = max(1, batch_size)
+        self.verbose = verbose
+        self._embedder = embedder
+        self.use_cache = config.EMBED_CACHE_ENABLED if use_cache is None else bool(use_cache)
+        self._cache: Optional[EmbeddingCache] = None
+        self.last_stats: Dict[str, float] = {}
+
+    def _local_embedder(self) -> ArcFaceEmbedder:
+        if self._embedder is None:
+            self._embedder = ArcFaceEmbedder(self.model_path, quantized=self.quantized)
+        return self._embedder
+
+    def _progress(self, done: int, total: int, t0: float):
+        if not self.verbose:
+            return
+        elapsed = max(time.perf_counter() - t0, 1e-9)
+        print(f"\r  Embedding: {done}/{total} crops ({done / elapsed:.0f} crops/s)", end="", flush=True)
+
+    def _open_cache(self) -> Optional[EmbeddingCache]:
+        if not self.use_cache:
+            return None
+        if self._cache is None:
+            spec = spec_for_path(self.model_path)
+            model_file = quantized_model_path(self.model_path) if self.quantized else Path(self.model_path)
+            try:
+                self._cache = EmbeddingCache(
+                    model_file, model_file_hash(model_file),
+                    spec.preprocess_signature(), dim=spec.embedding_dim,
+                )
+            except OSError as e:
+                print(f"⚠ Embedding cache disabled ({e})")
+                self.use_cache = False
+        return self._cache
+
+    def embed_paths(self, paths: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Decode and embed crops from disk, reusing cached embeddings where the
+        file, model and preprocessing are unchanged.
+
+        Args:
+            paths: Image paths
+
+        Returns:
+            embeddings: (M, D) L2-normalized float32, one row per valid image, in order
+            valid: (N,) bool mask of which paths produced a row
+        """
+        paths = list(paths)
+        n = len(paths)
+        t0 = time.perf_counter()
+
+        cache = self._open_cache()
+        if cache is not None:
+            cached, hit, keys = cache.lookup(paths)
+        else:
+            cached, hit, keys = None, np.zeros(n, dtype=bool), [None] * n
+        miss = np.flatnonzero(~hit)
+
+        computed, computed_ok, use_pool = self._embed_files([paths[i] for i in miss])
+        computed_idx = miss[computed_ok]
+
+        if cache is not None and len(computed) and computed.shape[1] == cache.dim:
+            cache.put([paths[i] for i in computed_idx], [keys[i] for i in computed_idx], computed)
+            try:
+                cache.save()
+            except OSError as e:
+                print(f"⚠ Could not write embedding cache ({e})")
+
+        valid = hit.copy()
+        valid[computed_idx] = True
+        dim = computed.shape[1] if len(computed) else (cached.shape[1] if cached is not None else config.EMBEDDING_DIM)
+        full = np.empty((n, dim), dtype=np.float32)
+        if hit.any():
+            full[hit] = cached
+        full[computed_idx] = computed
+        embeddings = full[valid]
+
+        elapsed = time.perf_counter() - t0
+        self.last_stats = {
+            "images": n,
+            "embedded": len(embeddings),
+            "from_cache": int(hit.sum()),
+            "computed": len(computed),
+            "seconds": elapsed,
+            "crops_per_sec": len(embeddings) / elapsed if elapsed > 0 else 0.0,
+            "workers": self.workers if use_pool else 1,
+            "threads_per_worker": self.threads_per_worker if use_pool else config.ONNX_INTRA_OP_THREADS,
+        }
+        if self.verbose:
+            mode = (f"{self.workers} workers x {self.threads_per_worker} threads"
+                    if use_pool else "in-process")
+            print(f"✓ Embedded {len(embeddings)}/{n} crops in {elapsed:.1f}s "
+                  f"({int(hit.sum())} from cache, {self.last_stats['crops_per_sec']:.0f} crops/s, {mode})")
+        return embeddings, valid
+
+    def _embed_files(self, paths: List) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """Decode + embed without the cache. Returns (embeddings, valid, used_pool)."""
+        n = len(paths)
+        valid = np.zeros(n, dtype=bool)
+        t0 = time.perf_counter()
+        use_pool = self.workers > 1 and n >= config.OFFLINE_MIN_CROPS_FOR_POOL
+
+        pool = None
+        if use_pool:
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.model_path, self.quantized, self.threads_per_worker),
+            )
+
+        # Rows of the readable crops, in order; in-process batches are embedded straight into it
+        embeddings: Optional[np.ndarray] = None
+        futures = []
+        done = 0
+        try:
+            batch: List[np.ndarray] = []
+
+            def flush():
+                nonlocal done, embeddings
+                if not batch:
+                    return
+                if pool is not None:
+                    futures.append(pool.submit(_embed_in_worker, np.stack(batch)))
+                else:
+                    embedder = self._local_embedder()
+                    if embeddings is None:
+                        embeddings = np.empty((n, embedder.embedding_dim), dtype=np.float32)
+                    embedder.embed_batch(batch, out=embeddings[done:done + len(batch)])
+                    done += len(batch)
+                    self._progress(done, n, t0)
+                batch.clear()
+
+            # cv2.imread releases the GIL, so decoding overlaps with inference
+            with ThreadPoolExecutor(max_workers=self.decode_threads) as decoders:
+                for i, img in enumerate(decoders.map(read_crop, paths)):
+                    if img is None:
+                        continue
+                    valid[i] = True
+                    batch.append(img)
+                    if len(batch) >= self.batch_size:
+                        flush()
+                flush()
+
+            for future in futures:
+                embs = future.result()
+                if embeddings is None:
+                    embeddings = np.empty((n, embs.shape[1]), dtype=np.float32)
+                embeddings[done:done + len(embs)] = embs
+                done += len(embs)
+                self._progress(done, n, t0)
+            if self.verbose and done:
+                print()
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+        if embeddings is None:
+            embeddings = np.zeros((0, config.EMBEDDING_DIM), dtype=np.float32)
+        return embeddings[:done], valid, use_pool
+
+
+def main():
+    """Embed every enrolled crop and report throughput."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk-embed enrollment crops")
+    parser.add_argument("--workers", type=int, default=config.OFFLINE_EMBED_WORKERS,
+                        help="Inference processes (0 = auto)")
+    parser.add_argument("--decode-threads", type=int, default=config.OFFLINE_DECODE_THREADS)
+    parser.add_argument("--batch-size", type=int, default=config.EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--no-cache", action="store_true", help="Ignore the embedding cache")
+    parser.add_argument("--clear-cache", action="store_true", help="Delete the embedding cache first")
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        clear_cache()
+        print(f"✓ Cleared {config.EMBED_CACHE_DIR}")
+
+    paths = sorted(config.ENROLL_DIR.glob("*/*.jpg"))
+    if not paths:
+        print(f"ERROR: No crops found under {config.ENROLL_DIR}.")
+        return False
+
+    engine = OfflineEmbedder(
+        workers=args.workers,
+        decode_threads=args.decode_threads,
+        batch_size=args.batch_size,
+        use_cache=not args.no_cache,
+    )
+    engine.embed_paths(paths)
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,98 @@
+"""
+Cheap face-quality scoring.
+Rejects blurry, tiny or strongly turned faces before they reach alignment and
+ArcFace, using only data the detector already has (gray frame, box, 5 points).
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from . import config
+
+
+@dataclass
+class FaceQuality:
+    """Quality measurements for one detected face."""
+    sharpness: float  # Variance of Laplacian on the gray face ROI
+    eye_distance: float  # Pixels between the eye landmarks
+    yaw: float  # Nose offset from the eye midpoint, in eye distances (0 = frontal)
+    roll: float  # Eye-line angle in degrees
+    area: int  # Box area in pixels
+    passed: bool
+    reason: str = ""  # First failed check ("" if passed)
+
+
+def estimate_pose(kps: np.ndarray) -> Tuple[float, float, float]:
+    """
+    Rough yaw/roll from 5 landmarks (left eye, right eye, nose, mouth L, mouth R).
+
+    Returns:
+        eye_distance (px), yaw (signed ratio), roll (degrees)
+    """
+    left_eye, right_eye, nose = kps[0], kps[1], kps[2]
+    dx, dy = float(right_eye[0] - left_eye[0]), float(right_eye[1] - left_eye[1])
+    eye_distance = math.hypot(dx, dy)
+    roll = math.degrees(math.atan2(dy, dx))
+
+    # Project the nose onto the eye line: frontal faces have it near the middle
+    mid = (left_eye + right_eye) / 2.0
+    if eye_distance < 1e-6:
+        return eye_distance, 0.0, roll
+    yaw = ((nose[0] - mid[0]) * dx + (nose[1] - mid[1]) * dy) / (eye_distance ** 2)
+    return eye_distance, float(yaw), roll
+
+
+def sharpness(gray: np.ndarray, box: Tuple[int, int, int, int]) -> float:
+    """Variance of the Laplacian over the face box, measured at a fixed size."""
+    x1, y1, x2, y2 = box
+    roi = gray[max(0, y1):max(0, y2), max(0, x1):max(0, x2)]
+    if roi.size == 0:
+        return 0.0
+    size = config.QUALITY_SHARPNESS_SIZE
+    roi = cv2.resize(roi, (size, size), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(roi, cv2.CV_32F).var())
+
+
+def assess_quality(gray: np.ndarray, box: Tuple[int, int, int, int], kps: np.ndarray) -> FaceQuality:
+    """
+    Score a detected face against the QUALITY_* / MIN_* thresholds in config.
+
+    Args:
+        gray: Grayscale frame
+        box: (x1, y1, x2, y2) face box
+        kps: (5, 2) landmarks
+
+    Returns:
+        FaceQuality with `passed` and the first failing `reason`
+    """
+    x1, y1, x2, y2 = box
+    area = max(0, x2 - x1) * max(0, y2 - y1)
+    eye_distance, yaw, roll = estimate_pose(kps)
+
+    reason = ""
+    if area < config.MIN_FACE_BBOX_AREA:
+        reason = "too small"
+    elif eye_distance < config.MIN_EYE_DISTANCE:
+        reason = "eyes too close"
+    elif abs(yaw) > config.QUALITY_MAX_YAW:
+        reason = "turned away"
+    elif abs(roll) > config.QUALITY_MAX_ROLL_DEG:
+        reason = "head tilted"
+
+    sharp = sharpness(gray, box)
+    if not reason and sharp < config.QUALITY_MIN_SHARPNESS:
+        reason = "blurry"
+
+    return FaceQuality(
+        sharpness=sharp,
+        eye_distance=eye_distance,
+        yaw=yaw,
+        roll=roll,
+        area=area,
+        passed=not reason,
+        reason=reason,
+    )
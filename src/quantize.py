@@ -0,0 +1,291 @@
+"""
+INT8 quantization of the ArcFace embedder.
+Builds embedder_arcface_int8.onnx from the FP32 model, calibrated on the aligned
+crops under data/enroll, and checks that recognition accuracy still holds.
+"""
+
+import sys
+import time
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+
+from . import config
+from . import lazy_imports
+from .embed import ArcFaceEmbedder, preprocess_batch, quantized_model_path
+from .offline_embed import OfflineEmbedder
+from .model_registry import spec_for_path
+from .evaluate import (
+    load_people_data,
+    load_crops,
+    embed_people,
+    distance_distributions,
+    far_frr,
+    stats_str,
+)
+
+
+def _quantization():
+    """onnxruntime.quantization (imported on first call)."""
+    return lazy_imports.require("onnxruntime.quantization", "onnxruntime onnx")
+
+
+class EnrollmentCalibrationReader:
+    """
+    Feeds preprocessed enrollment crops to the static quantization calibrator.
+    Counts as a CalibrationDataReader by having get_next(), so onnxruntime
+    isn't needed to define it.
+    """
+
+    def __init__(self, input_name: str, crops_per_person: int, batch_size: int = 8, spec=None):
+        self.input_name = input_name
+        self.batch_size = max(1, batch_size)
+
+        crops = []
+        for name, img_paths in sorted(load_people_data().items()):
+            # Spread picks over the whole capture session to cover more poses
+            step = max(1, len(img_paths) // max(1, crops_per_person))
+            crops.extend(load_crops(img_paths[::step][:crops_per_person]))
+
+        self.num_crops = len(crops)
+        self._batches = [
+            preprocess_batch(crops[i:i + self.batch_size], spec=spec)
+            for i in range(0, len(crops), self.batch_size)
+        ]
+        self._iter = iter(self._batches)
+
+    def get_next(self):
+        x = next(self._iter, None)
+        if x is None:
+            return None
+        return {self.input_name: x}
+
+    def rewind(self):
+        self._iter = iter(self._batches)
+
+
+def _model_input(model_path: Path):
+    """Return (input name, fixed batch size or None) of an ONNX model."""
+    ort = lazy_imports.onnxruntime()
+    sess = ort.InferenceSession(str(model_path), providers=["CPUExecutionProvider"])
+    inp = sess.get_inputs()[0]
+    batch_dim = inp.shape[0]
+    fixed = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else None
+    return inp.name, fixed
+
+
+def quantize_model(
+    model_path=config.ARCFACE_MODEL_PATH,
+    output_path=None,
+    mode: str = None,
+    crops_per_person: int = None,
+) -> Path:
+    """
+    Produce an INT8 copy of the ArcFace model.
+
+    Args:
+        model_path: FP32 ONNX model
+        output_path: Destination (None = <model>_int8.onnx next to the model)
+        mode: "static" (QDQ, calibrated on enrollment crops) or "dynamic"
+        crops_per_person: Calibration crops per enrolled person
+
+    Returns:
+        Path to the quantized model
+    """
+    model_path = Path(model_path)
+    output_path = Path(output_path) if output_path else quantized_model_path(model_path)
+    mode = mode or config.QUANT_MODE
+    if crops_per_person is None:
+        crops_per_person = config.QUANT_CALIBRATION_CROPS_PER_PERSON
+
+    if not model_path.exists():
+        raise FileNotFoundError(f"Model not found: {model_path}")
+    quant = _quantization()
+
+    if mode == "dynamic":
+        # Weights only; activations are quantized on the fly per call
+        quant.quantize_dynamic(
+            str(model_path), str(output_path),
+            weight_type=quant.QuantType.QUInt8,
+        )
+        return output_path
+
+    if mode != "static":
+        raise ValueError(f"Unknown quantization mode '{mode}'. Choose 'static' or 'dynamic'.")
+
+    input_name, fixed_batch = _model_input(model_path)
+    reader = EnrollmentCalibrationReader(
+        input_name, crops_per_person, batch_size=fixed_batch or 8,
+        spec=spec_for_path(model_path),
+    )
+    if reader.num_crops == 0:
+        raise RuntimeError(
+            f"No calibration crops found under {config.ENROLL_DIR}. Enroll someone first."
+        )
+    print(f"Calibrating on {reader.num_crops} enrollment crops...")
+
+    # Shape inference + graph cleanup gives the quantizer a better graph to work on
+    source = model_path
+    prep_path = output_path.with_name(output_path.stem + ".prep.onnx")
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+        quant_pre_process(str(model_path), str(prep_path))
+        source = prep_path
+    except Exception as e:
+        print(f"⚠ Pre-processing skipped ({e}); quantizing the original graph")
+
+    try:
+        quant.quantize_static(
+            str(source), str(output_path), reader,
+            quant_format=quant.QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=quant.QuantType.QUInt8,
+            weight_type=quant.QuantType.QInt8,
+            calibrate_method=quant.CalibrationMethod.MinMax,
+        )
+    finally:
+        prep_path.unlink(missing_ok=True)
+
+    return output_path
+
+
+def _single_face_latency_ms(embedder: ArcFaceEmbedder, crop: np.ndarray, runs: int = 30) -> float:
+    """Median latency of embedding one face, in milliseconds."""
+    embedder.embed(crop)  # warm-up
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        embedder.embed(crop)
+        times.append((time.perf_counter() - t) * 1000.0)
+    return float(np.median(times))
+
+
+def check_accuracy(model_path=config.ARCFACE_MODEL_PATH, threshold: float = None) -> Dict:
+    """
+    Compare the INT8 model against FP32 on the enrollment data.
+    Uses the same genuine/impostor analysis as src.evaluate.
+
+    Returns:
+        Report dict with distance drift, FAR/FRR at the threshold, latency,
+        and "passed" according to the QUANT_* accuracy gates.
+    """
+    if threshold is None:
+        threshold = config.DEFAULT_DISTANCE_THRESHOLD
+
+    people_data = load_people_data()
+    if not people_data:
+        raise RuntimeError("No enrollment samples found. Run enrollment first.")
+
+    # One session per precision: the bulk pass runs on it in-process and it times latency
+    fp32 = ArcFaceEmbedder(model_path, quantized=False)
+    int8 = ArcFaceEmbedder(model_path, quantized=True)
+
+    emb32 = embed_people(OfflineEmbedder(model_path, quantized=False, embedder=fp32), people_data)
+    emb8 = embed_people(OfflineEmbedder(model_path, quantized=True, embedder=int8), people_data)
+    if not emb32:
+        raise RuntimeError("Not enough valid embeddings.")
+
+    # Per-crop agreement between the two models
+    cosines = np.concatenate([np.sum(emb32[n] * emb8[n], axis=1) for n in emb32])
+
+    gen32, imp32 = distance_distributions(emb32)
+    gen8, imp8 = distance_distributions(emb8)
+    far32, frr32 = far_frr(gen32, imp32, threshold)
+    far8, frr8 = far_frr(gen8, imp8, threshold)
+
+    sample = load_crops(next(iter(people_data.values())))[0]
+    lat32 = _single_face_latency_ms(fp32, sample)
+    lat8 = _single_face_latency_ms(int8, sample)
+
+    def mean_or_zero(a):
+        return float(a.mean()) if len(a) else 0.0
+
+    report = {
+        "threshold": float(threshold),
+        "num_people": len(emb32),
+        "num_crops": int(len(cosines)),
+        "embedding_cosine_mean": float(cosines.mean()),
+        "embedding_cosine_min": float(cosines.min()),
+        "genuine_fp32": gen32,
+        "impostor_fp32": imp32,
+        "genuine_int8": gen8,
+        "impostor_int8": imp8,
+        "genuine_drift": mean_or_zero(gen8) - mean_or_zero(gen32),
+        "impostor_drift": mean_or_zero(imp8) - mean_or_zero(imp32),
+        "far_fp32": far32,
+        "frr_fp32": frr32,
+        "far_int8": far8,
+        "frr_int8": frr8,
+        "latency_fp32_ms": lat32,
+        "latency_int8_ms": lat8,
+        "speedup": lat32 / lat8 if lat8 > 0 else 0.0,
+    }
+    report["passed"] = (
+        report["embedding_cosine_mean"] >= config.QUANT_MIN_EMBEDDING_COSINE
+        and far8 - far32 <= config.QUANT_MAX_FAR_INCREASE
+        and frr8 - frr32 <= config.QUANT_MAX_FRR_INCREASE
+    )
+    return report
+
+
+def print_report(report: Dict) -> None:
+    """Print an accuracy/latency comparison produced by check_accuracy()."""
+    print("\n" + "="*60)
+    print("INT8 vs FP32 ACCURACY CHECK")
+    print("="*60)
+    print(f"People: {report['num_people']} | Crops: {report['num_crops']}")
+    print(f"cos(FP32, INT8) per crop: mean={report['embedding_cosine_mean']:.4f} "
+          f"min={report['embedding_cosine_min']:.4f} "
+          f"(gate >= {config.QUANT_MIN_EMBEDDING_COSINE:.2f})")
+    print(f"\nGenuine  FP32: {stats_str(report['genuine_fp32'])}")
+    print(f"Genuine  INT8: {stats_str(report['genuine_int8'])}")
+    print(f"Impostor FP32: {stats_str(report['impostor_fp32'])}")
+    print(f"Impostor INT8: {stats_str(report['impostor_int8'])}")
+    print(f"\nMean distance drift: genuine {report['genuine_drift']:+.4f} | "
+          f"impostor {report['impostor_drift']:+.4f}")
+    print(f"\nAt threshold {report['threshold']:.2f}:")
+    print(f"  FP32: FAR {report['far_fp32']:6.2f}% | FRR {report['frr_fp32']:6.2f}%")
+    print(f"  INT8: FAR {report['far_int8']:6.2f}% | FRR {report['frr_int8']:6.2f}%")
+    print(f"\nSingle-face latency: FP32 {report['latency_fp32_ms']:.1f} ms | "
+          f"INT8 {report['latency_int8_ms']:.1f} ms | speedup {report['speedup']:.2f}x")
+    print("\n" + "="*60)
+    if report["passed"]:
+        print("✓ INT8 model PASSED. Set EMBEDDING_USE_INT8 = True in config.py to use it.")
+    else:
+        print("✗ INT8 model FAILED the accuracy gates. Keep EMBEDDING_USE_INT8 = False.")
+    print("="*60)
+
+
+def main():
+    """Quantize the ArcFace model and run the accuracy check."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build and validate an INT8 ArcFace embedder")
+    parser.add_argument("--mode", choices=["static", "dynamic"], default=config.QUANT_MODE,
+                        help="Quantization mode (default: %(default)s)")
+    parser.add_argument("--crops-per-person", type=int, default=config.QUANT_CALIBRATION_CROPS_PER_PERSON,
+                        help="Calibration crops per enrolled person")
+    parser.add_argument("--threshold", type=float, default=config.DEFAULT_DISTANCE_THRESHOLD,
+                        help="Distance threshold for FAR/FRR comparison")
+    parser.add_argument("--check-only", action="store_true",
+                        help="Skip quantization; only compare an existing INT8 model")
+    args = parser.parse_args()
+
+    if not args.check_only:
+        t0 = time.time()
+        out = quantize_model(mode=args.mode, crops_per_person=args.crops_per_person)
+        print(f"✓ Wrote {out} ({time.time() - t0:.1f}s)")
+    elif not quantized_model_path(config.ARCFACE_MODEL_PATH).exists():
+        print(f"ERROR: No INT8 model at {quantized_model_path(config.ARCFACE_MODEL_PATH)}. "
+              f"Run without --check-only to build it.")
+        return False
+
+    report = check_accuracy(threshold=args.threshold)
+    print_report(report)
+    return report["passed"]
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
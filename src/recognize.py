@@ -8,28 +8,22 @@ import json
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 import cv2
-import numpy as np
 
 
 from . import config
 from .haar_5pt import HaarMediaPipeFaceDetector
 from .align import FaceAligner
 from .embed import ArcFaceEmbedder
+from .face_tracker import FaceTracker
+from .async_embedder import AsyncEmbedder
+from .gallery import FaceGallery
+from .gallery_watcher import GalleryWatcher, rematch_tracks
+from .watchlist import watchlist_scope
 
 from . import actions as action_module
 from .activity_logger import ActivityLogger
 
 
-def load_database():
-    """Load enrolled face database."""
-    if not config.DB_NPZ_PATH.exists():
-        print("ERROR: Database not found. Run enrollment first.")
-        return {}
-    
-    data = np.load(str(config.DB_NPZ_PATH), allow_pickle=True)
-    return {k: data[k].astype(np.float32) for k in data.files}
-
-
 def choose_lock_identity(names: list) -> Optional[str]:
     """
     Prompt user to choose one identity to lock to, or none (recognize all).
@@ -65,39 +59,37 @@ def choose_lock_identity(names: list) -> Optional[str]:
     return None
 
 
-def cosine_distance(a: np.ndarray, b: np.ndarray) -> float:
-    """Compute cosine distance."""
-    a = a.reshape(-1).astype(np.float32)
-    b = b.reshape(-1).astype(np.float32)
-    similarity = float(np.dot(a, b))
-    return 1.0 - similarity
-
-
-def main(start_fullscreen: bool = False):
+def main(start_fullscreen: bool = False, watchlist: str = None):
     """
     Live recognition pipeline.
     
     Args:
         start_fullscreen: If True, start in fullscreen mode
+        watchlist: Only search this watchlist's identities (None = config.WATCHLIST)
     """
-    db = load_database()
+    gallery = FaceGallery.load()
     
-    if not db:
+    if not len(gallery):
         print("ERROR: No enrolled identities found. Run enrollment first.")
         return False
     
-    print(f"✓ Loaded {len(db)} enrolled identities")
+    print(f"✓ Loaded {len(gallery)} enrolled identities")
+    try:
+        scope = watchlist_scope(gallery, watchlist)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return False
+    if scope is not None:
+        print(f"✓ Watchlist: searching {len(scope)} of {len(gallery)} identities")
     
     detector = HaarMediaPipeFaceDetector(min_size=config.HAAR_MIN_SIZE)
     aligner = FaceAligner()
     embedder = ArcFaceEmbedder(config.ARCFACE_MODEL_PATH)
-    
-    # Pre-stack embeddings for fast matching
-    names = sorted(db.keys())
-    embeddings_matrix = np.stack([db[n].reshape(-1) for n in names], axis=0)
+    tracker = FaceTracker()
+    async_embedder = AsyncEmbedder(embedder, synchronous=not config.ASYNC_EMBEDDING)
     
     # Optional: lock = highlight one person as "(locked)" while still recognizing everyone
-    lock_name: Optional[str] = choose_lock_identity(names)
+    lock_name: Optional[str] = choose_lock_identity(scope or gallery.names)
     
     # Initialize activity logger if person is locked
     activity_logger: Optional[ActivityLogger] = None
@@ -135,7 +127,7 @@ def main(start_fullscreen: bool = False):
     print("Window: Large resizable window (can be maximized)")
     print("Controls:")
     print("  q  - Quit")
-    print("  r  - Reload database")
+    print("  r  - Reload database (changes are also picked up automatically)")
     print("  l  - Clear lock (accept all)")
     print("  f  - Toggle fullscreen (RECOMMENDED for full screen)")
     print("  +  - Increase threshold (more accepts)")
@@ -165,6 +157,9 @@ def main(start_fullscreen: bool = False):
         cv2.setWindowProperty(window_name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
         print("Starting in FULLSCREEN mode (press 'f' to exit fullscreen)")
     
+    # Loads database changes in the background; swapped in between frames below
+    watcher = GalleryWatcher(gallery)
+    
     try:
         import time
         t0 = time.time()
@@ -184,6 +179,23 @@ def main(start_fullscreen: bool = False):
                 frame_count = 0
                 t0 = time.time()
             
+            fresh = watcher.poll()
+            if fresh is not None:
+                gallery.swap(fresh)
+                if scope is not None:
+                    try:
+                        scope = watchlist_scope(gallery, watchlist)
+                    except ValueError as e:
+                        print(f"⚠ {e}; keeping the previous watchlist")
+                rematch_tracks(gallery, tracker, scope)
+                if lock_name and lock_name not in gallery:
+                    if activity_logger:
+                        activity_logger.save_summary()
+                        activity_logger = None
+                    lock_name = None
+                    print("Lock cleared (locked person no longer in database)")
+                print(f"✓ Reloaded {len(gallery)} identities")
+            
             vis = frame.copy()
             faces = detector.detect(frame)
             
@@ -200,19 +212,44 @@ def main(start_fullscreen: bool = False):
             # Decay action display
             action_display = [(label, n - 1) for label, n in action_display if n > 1]
             
-            for face_idx, face in enumerate(faces):
-                # Align + embed
-                aligned, _ = aligner.align(frame, face.landmarks)
-                query_emb, _ = embedder.embed(aligned)
-                
-                # Match
-                dists = np.array([cosine_distance(query_emb, embeddings_matrix[i]) for i in range(len(names))])
-                best_idx = int(np.argmin(dists))
-                best_dist = dists[best_idx]
-                best_match_name = names[best_idx]
+            # Track faces; re-embed only tracks whose cached embedding is stale
+            # (new face, refresh interval, or pose/scale change), not in flight, and
+            # good enough to match (blurry/tiny/profile faces are deferred)
+            tracks = tracker.update(faces, frame_idx)
+            to_embed = [(face, tr) for face, tr in zip(faces, tracks)
+                        if face.embeddable and tr.needs_embedding(frame_idx)
+                        and not async_embedder.is_pending(tr.track_id)]
+            if to_embed:
+                for _, tr in to_embed:
+                    tr.mark_embedding_requested(frame_idx)
+                async_embedder.submit(
+                    [aligner.align(frame, face.landmarks)[0] for face, _ in to_embed],
+                    frame_idx, [tr.track_id for _, tr in to_embed],
+                )
+            
+            # Match finished embeddings; faces keep their last identity meanwhile
+            finished = []
+            for result in async_embedder.poll():
+                tr = tracker.get(result.track_id)
+                if tr is None or result.frame_id < tr.identity_frame:
+                    continue
+                tr.add_embedding(result.embedding)  # smoothed over SMOOTHING_WINDOW
+                finished.append((tr, result.frame_id))
+            # Crops dropped by a full queue: ask again next frame, not after EMBED_REFRESH_FRAMES
+            for track_id in async_embedder.dropped_tracks():
+                tr = tracker.get(track_id)
+                if tr is not None and not async_embedder.is_pending(track_id):
+                    tr.cancel_embedding_request()
+            # One vectorized pass scores every finished face against the gallery (or the
+            # watchlist), with its top-2 margin and the best identity's calibrated threshold
+            matches = gallery.identify([tr.query for tr, _ in finished], scope)
+            for (tr, frame_id), ident in zip(finished, matches):
+                tr.set_identity(ident, frame_id)
+            
+            for face_idx, (face, tr) in enumerate(zip(faces, tracks)):
+                accepted, best_match_name, best_dist = tr.decide(threshold)
                 
                 # Decision: recognize all enrolled people; lock only adds a "(locked)" label for the chosen one
-                accepted = best_dist <= threshold
                 if accepted:
                     name = best_match_name
                     confidence = 1.0 - best_dist
@@ -225,8 +262,10 @@ def main(start_fullscreen: bool = False):
                         display_name = name
                         is_locked_person = False
                 else:
+                    # Ambiguous faces (a near-duplicate identity is too close) are
+                    # rejected like unknowns: no logging, no servo moves
                     name = "Unknown"
-                    display_name = "Unknown"
+                    display_name = "Uncertain" if tr.ambiguous(threshold) else "Unknown"
                     confidence = 0
                     color = (0, 0, 255)
                     is_locked_person = False
@@ -286,7 +325,11 @@ def main(start_fullscreen: bool = False):
             
             # Header (show lock status)
             lock_status = f"Lock: {lock_name}" if lock_name else "Lock: (none)"
-            header = f"{lock_status} | Thresh: {threshold:.2f} | IDs: {len(names)} | FPS: {fps:.1f}"
+            emb_stats = async_embedder.stats()
+            header = (
+                f"{lock_status} | Thresh: {threshold:.2f} | IDs: {len(gallery)} | FPS: {fps:.1f}"
+                f" | Emb Q: {emb_stats['queue_depth']} {emb_stats['last_latency_ms']:.0f}ms"
+            )
             cv2.putText(
                 vis, header, (10, 30),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2
@@ -342,13 +385,8 @@ def main(start_fullscreen: bool = False):
             if key == ord("q"):
                 break
             elif key == ord("r"):
-                db = load_database()
-                names = sorted(db.keys())
-                embeddings_matrix = np.stack([db[n].reshape(-1) for n in names], axis=0)
-                if lock_name and lock_name not in names:
-                    lock_name = None
-                    print("Lock cleared (locked person no longer in database)")
-                print(f"✓ Reloaded {len(db)} identities")
+                watcher.request()
+                print("Reloading database in the background...")
             elif key == ord("l"):
                 # Save activity log before clearing lock
                 if activity_logger:
@@ -376,6 +414,8 @@ def main(start_fullscreen: bool = False):
         if activity_logger:
             activity_logger.save_summary()
         
+        watcher.close()
+        async_embedder.close()
         cap.release()
         cv2.destroyAllWindows()
     
@@ -392,7 +432,8 @@ if __name__ == "__main__":
         action="store_true",
         help="Start in fullscreen mode"
     )
+    parser.add_argument("--watchlist", help="Only search this watchlist (see: python -m src.watchlist)")
     args = parser.parse_args()
     
-    success = main(start_fullscreen=args.fullscreen)
+    success = main(start_fullscreen=args.fullscreen, watchlist=args.watchlist)
     sys.exit(0 if success else 1)
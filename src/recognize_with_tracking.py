@@ -8,25 +8,20 @@ import json
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 import cv2
-import numpy as np
 
 from . import config
 from .haar_5pt import HaarMediaPipeFaceDetector
 from .align import FaceAligner
 from .embed import ArcFaceEmbedder
+from .face_tracker import FaceTracker
+from .async_embedder import AsyncEmbedder
+from .gallery import FaceGallery
+from .gallery_watcher import GalleryWatcher, rematch_tracks
+from .watchlist import watchlist_scope
 from . import actions as action_module
 from .activity_logger import ActivityLogger
 from .mqtt_camera_controller import MQTTCameraController
-
-
-def load_database():
-    """Load enrolled face database."""
-    if not config.DB_NPZ_PATH.exists():
-        print("ERROR: Database not found. Run enrollment first.")
-        return {}
-    
-    data = np.load(str(config.DB_NPZ_PATH), allow_pickle=True)
-    return {k: data[k].astype(np.float32) for k in data.files}
+from .startup import StartupTimer, open_camera
 
 
 def choose_lock_identity(names: list) -> Optional[str]:
@@ -61,19 +56,47 @@ def choose_lock_identity(names: list) -> Optional[str]:
     return None
 
 
-def cosine_distance(a: np.ndarray, b: np.ndarray) -> float:
-    """Compute cosine distance."""
-    a = a.reshape(-1).astype(np.float32)
-    b = b.reshape(-1).astype(np.float32)
-    similarity = float(np.dot(a, b))
-    return 1.0 - similarity
+def _build_detector() -> HaarMediaPipeFaceDetector:
+    detector = HaarMediaPipeFaceDetector(min_size=config.HAAR_MIN_SIZE)
+    detector.warm_up()
+    return detector
+
+
+def _build_embedder() -> ArcFaceEmbedder:
+    embedder = ArcFaceEmbedder(config.ARCFACE_MODEL_PATH)
+    embedder.warm_up()
+    return embedder
+
+
+def _connect_mqtt(broker: str, port: int) -> Optional[MQTTCameraController]:
+    """Connect to the broker; None if it doesn't answer within MQTT_CONNECT_TIMEOUT."""
+    print(f"\n🎥 Initializing MQTT camera tracking...")
+    try:
+        controller = MQTTCameraController(broker_host=broker, broker_port=port)
+        if controller.wait_for_connection(config.MQTT_CONNECT_TIMEOUT):
+            print("✓ Camera tracking enabled!")
+            controller.center()  # Center camera at start
+            return controller
+        print("⚠ MQTT not connected - tracking disabled")
+    except Exception as e:
+        print(f"⚠ Could not initialize MQTT: {e}")
+    return None
+
+
+def _abort_startup(timer: StartupTimer, camera_future) -> None:
+    """Release the camera if startup fails after it was opened."""
+    cap, _ = camera_future.result()
+    if cap is not None:
+        cap.release()
+    timer.shutdown()
 
 
 def main(
     start_fullscreen: bool = False,
     enable_mqtt: bool = True,
     mqtt_broker: str = None,
-    mqtt_port: int = None
+    mqtt_port: int = None,
+    watchlist: str = None
 ):
     """
     Live recognition with MQTT camera tracking.
@@ -83,6 +106,7 @@ def main(
         enable_mqtt: Enable MQTT camera tracking
         mqtt_broker: MQTT broker hostname/IP (None = use config default)
         mqtt_port: MQTT broker port (None = use config default)
+        watchlist: Only search this watchlist's identities (None = config.WATCHLIST)
     """
     # Use config defaults if not specified
     if mqtt_broker is None:
@@ -90,43 +114,38 @@ def main(
     if mqtt_port is None:
         mqtt_port = config.MQTT_BROKER_PORT
     
-    db = load_database()
+    # Independent steps start right away; the lock prompt below runs while
+    # the models load and the camera opens
+    timer = StartupTimer()
+    gallery_future = timer.submit("database", FaceGallery.load)
+    detector_future = timer.submit("detector + warm-up", _build_detector)
+    embedder_future = timer.submit("ArcFace + warm-up", _build_embedder)
+    camera_future = timer.submit("camera", open_camera)
     
-    if not db:
+    gallery = gallery_future.result()
+    
+    if not len(gallery):
         print("ERROR: No enrolled identities found. Run enrollment first.")
+        _abort_startup(timer, camera_future)
         return False
     
-    print(f"✓ Loaded {len(db)} enrolled identities")
-    
-    detector = HaarMediaPipeFaceDetector(min_size=config.HAAR_MIN_SIZE)
-    aligner = FaceAligner()
-    embedder = ArcFaceEmbedder(config.ARCFACE_MODEL_PATH)
-    
-    names = sorted(db.keys())
-    embeddings_matrix = np.stack([db[n].reshape(-1) for n in names], axis=0)
+    print(f"✓ Loaded {len(gallery)} enrolled identities")
+    try:
+        scope = watchlist_scope(gallery, watchlist)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        _abort_startup(timer, camera_future)
+        return False
+    if scope is not None:
+        print(f"✓ Watchlist: searching {len(scope)} of {len(gallery)} identities")
     
-    lock_name: Optional[str] = choose_lock_identity(names)
+    with timer.measure("lock prompt", user_input=True):
+        lock_name: Optional[str] = choose_lock_identity(scope or gallery.names)
     
-    # Initialize MQTT camera controller
-    mqtt_controller: Optional[MQTTCameraController] = None
+    # Initialize MQTT camera controller (connects in the background)
+    mqtt_future = None
     if enable_mqtt and lock_name:
-        print(f"\n🎥 Initializing MQTT camera tracking...")
-        try:
-            mqtt_controller = MQTTCameraController(
-                broker_host=mqtt_broker,
-                broker_port=mqtt_port
-            )
-            import time
-            time.sleep(1)  # Wait for connection
-            if mqtt_controller.is_connected:
-                print("✓ Camera tracking enabled!")
-                mqtt_controller.center()  # Center camera at start
-            else:
-                print("⚠ MQTT not connected - tracking disabled")
-                mqtt_controller = None
-        except Exception as e:
-            print(f"⚠ Could not initialize MQTT: {e}")
-            mqtt_controller = None
+        mqtt_future = timer.submit("MQTT", _connect_mqtt, mqtt_broker, mqtt_port)
     
     # Initialize activity logger
     activity_logger: Optional[ActivityLogger] = None
@@ -137,27 +156,27 @@ def main(
     else:
         print("Lock: (none) – all enrolled identities shown by name")
     
-    # Camera setup
-    cap = None
-    for attempt in range(3):
-        cap = cv2.VideoCapture(config.CAMERA_INDEX)
-        if cap.isOpened():
-            break
-        cap.release()
-        if attempt < 2:
-            print(f"Attempt {attempt + 1}/3: Camera not ready, retrying...")
-            import time
-            time.sleep(1)
+    try:
+        detector = detector_future.result()
+        embedder = embedder_future.result()
+    except Exception:
+        _abort_startup(timer, camera_future)
+        raise
+    aligner = FaceAligner()
+    tracker = FaceTracker()
+    async_embedder = AsyncEmbedder(embedder, synchronous=not config.ASYNC_EMBEDDING)
     
-    if not cap or not cap.isOpened():
-        print("ERROR: Cannot open camera after 3 attempts.")
+    mqtt_controller: Optional[MQTTCameraController] = mqtt_future.result() if mqtt_future else None
+    
+    # Camera setup
+    cap, test_frame = camera_future.result()
+    timer.shutdown()
+    if cap is None:
+        print(f"ERROR: Cannot open camera after {config.CAMERA_OPEN_ATTEMPTS} attempts.")
+        async_embedder.close()
         return False
     
     # Get frame dimensions for tracking calculations
-    ret, test_frame = cap.read()
-    if not ret:
-        print("ERROR: Cannot read from camera")
-        return False
     frame_height, frame_width = test_frame.shape[:2]
     print(f"✓ Camera resolution: {frame_width}x{frame_height}")
     
@@ -166,7 +185,7 @@ def main(
     print("\n🎬 Live Recognition with Camera Tracking")
     print("Controls:")
     print("  q  - Quit")
-    print("  r  - Reload database")
+    print("  r  - Reload database (changes are also picked up automatically)")
     print("  l  - Clear lock")
     print("  f  - Toggle fullscreen")
     print("  c  - Center camera")
@@ -213,11 +232,15 @@ def main(
         cv2.setWindowProperty(window_name, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
         print("Starting in FULLSCREEN mode")
     
+    # Loads database changes in the background; swapped in between frames below
+    watcher = GalleryWatcher(gallery)
+    
     try:
         import time
         t0 = time.time()
         frame_count = 0
         fps = 0
+        first_recognition_done = False
         
         while True:
             ret, frame = cap.read()
@@ -226,12 +249,34 @@ def main(
             
             frame_idx += 1
             frame_count += 1
+            if frame_idx == 1:
+                timer.mark("first frame")
+                timer.report()
             elapsed = time.time() - t0
             if elapsed >= 1.0:
                 fps = frame_count / elapsed
                 frame_count = 0
                 t0 = time.time()
             
+            fresh = watcher.poll()
+            if fresh is not None:
+                gallery.swap(fresh)
+                if scope is not None:
+                    try:
+                        scope = watchlist_scope(gallery, watchlist)
+                    except ValueError as e:
+                        print(f"⚠ {e}; keeping the previous watchlist")
+                rematch_tracks(gallery, tracker, scope)
+                if lock_name and lock_name not in gallery:
+                    if activity_logger:
+                        activity_logger.save_summary()
+                        activity_logger = None
+                    lock_name = None
+                    if mqtt_controller:
+                        mqtt_controller.center()
+                    print("Lock cleared (locked person no longer in database)")
+                print(f"✓ Reloaded {len(gallery)} identities")
+            
             vis = frame.copy()
             faces = detector.detect(frame)
             
@@ -251,16 +296,54 @@ def main(
             locked_person_found = False
             locked_face_center = None
             
-            for face_idx, face in enumerate(faces):
-                aligned, _ = aligner.align(frame, face.landmarks)
-                query_emb, _ = embedder.embed(aligned)
-                
-                dists = np.array([cosine_distance(query_emb, embeddings_matrix[i]) for i in range(len(names))])
-                best_idx = int(np.argmin(dists))
-                best_dist = dists[best_idx]
-                best_match_name = names[best_idx]
+            # Track faces; re-embed only tracks whose cached embedding is stale
+            # (new face, refresh interval, or pose/scale change), not in flight, and
+            # good enough to match (blurry/tiny/profile faces are deferred);
+            # inference runs in the background so the servo loop never waits on it
+            tracks = tracker.update(faces, frame_idx)
+            to_embed = [(face, tr) for face, tr in zip(faces, tracks)
+                        if face.embeddable and tr.needs_embedding(frame_idx)
+                        and not async_embedder.is_pending(tr.track_id)]
+            if to_embed:
+                for _, tr in to_embed:
+                    tr.mark_embedding_requested(frame_idx)
+                async_embedder.submit(
+                    [aligner.align(frame, face.landmarks)[0] for face, _ in to_embed],
+                    frame_idx, [tr.track_id for _, tr in to_embed],
+                )
+            
+            finished = []
+            for result in async_embedder.poll():
+                tr = tracker.get(result.track_id)
+                if tr is None or result.frame_id < tr.identity_frame:
+                    continue
+                tr.add_embedding(result.embedding)  # smoothed over SMOOTHING_WINDOW
+                finished.append((tr, result.frame_id))
+            # Crops dropped by a full queue: ask again next frame, not after EMBED_REFRESH_FRAMES
+            for track_id in async_embedder.dropped_tracks():
+                tr = tracker.get(track_id)
+                if tr is not None and not async_embedder.is_pending(track_id):
+                    tr.cancel_embedding_request()
+            # One vectorized pass scores every finished face against the gallery (or the
+            # watchlist), with its top-2 margin and the best identity's calibrated threshold.
+            # With a lock, faces are checked against the locked person first; only faces
+            # that might be them with a close runner-up need the full search
+            queries = [tr.query for tr, _ in finished]
+            if lock_name and config.LOCK_FAST_PATH:
+                matches = gallery.identify_target(queries, lock_name, threshold, scope)
+            else:
+                matches = gallery.identify(queries, scope)
+            for (tr, frame_id), ident in zip(finished, matches):
+                tr.set_identity(ident, frame_id)
+                if not first_recognition_done:
+                    first_recognition_done = True
+                    t = timer.mark("first recognition")
+                    print(f"✓ First recognition {t:.2f}s after launch "
+                          f"({timer.user_wait:.1f}s of it waiting for input)")
+            
+            for face_idx, (face, tr) in enumerate(zip(faces, tracks)):
+                accepted, best_match_name, best_dist = tr.decide(threshold)
                 
-                accepted = best_dist <= threshold
                 if accepted:
                     name = best_match_name
                     confidence = 1.0 - best_dist
@@ -275,8 +358,17 @@ def main(
                         display_name = name
                         is_locked_person = False
                 else:
+                    # Ambiguous faces (a near-duplicate identity is too close) are
+                    # rejected like unknowns: no logging, no servo moves
                     name = "Unknown"
-                    display_name = "Unknown"
+                    if tr.ambiguous(threshold):
+                        display_name = "Uncertain"
+                    elif lock_name and config.LOCK_FAST_PATH and best_match_name == lock_name:
+                        # Fast-path rejects were only compared with the target, so this
+                        # may be another enrolled person: don't claim they're unknown
+                        display_name = f"not {lock_name}"
+                    else:
+                        display_name = "Unknown"
                     confidence = 0
                     color = (0, 0, 255)
                     is_locked_person = False
@@ -436,7 +528,11 @@ def main(
             # Header
             lock_status = f"Lock: {lock_name}" if lock_name else "Lock: (none)"
             mqtt_status = "📡 MQTT: ON" if (mqtt_controller and mqtt_controller.is_connected) else "📡 MQTT: OFF"
-            header = f"{lock_status} | {mqtt_status} | Thresh: {threshold:.2f} | IDs: {len(names)} | FPS: {fps:.1f}"
+            emb_stats = async_embedder.stats()
+            header = (
+                f"{lock_status} | {mqtt_status} | Thresh: {threshold:.2f} | IDs: {len(gallery)} | FPS: {fps:.1f}"
+                f" | Emb Q: {emb_stats['queue_depth']} {emb_stats['last_latency_ms']:.0f}ms"
+            )
             cv2.putText(
                 vis, header, (10, 30),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2
@@ -498,12 +594,8 @@ def main(
             if key == ord("q"):
                 break
             elif key == ord("r"):
-                db = load_database()
-                names = sorted(db.keys())
-                embeddings_matrix = np.stack([db[n].reshape(-1) for n in names], axis=0)
-                if lock_name and lock_name not in names:
-                    lock_name = None
-                print(f"✓ Reloaded {len(db)} identities")
+                watcher.request()
+                print("Reloading database in the background...")
             elif key == ord("l"):
                 if activity_logger:
                     activity_logger.save_summary()
@@ -555,6 +647,8 @@ def main(
             mqtt_controller.center()  # Center camera before exit
             mqtt_controller.disconnect()
         
+        watcher.close()
+        async_embedder.close()
         cap.release()
         cv2.destroyAllWindows()
     
@@ -570,12 +664,14 @@ if __name__ == "__main__":
     parser.add_argument("--no-mqtt", action="store_true", help="Disable MQTT tracking")
     parser.add_argument("--broker", default="localhost", help="MQTT broker hostname/IP")
     parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument("--watchlist", help="Only search this watchlist (see: python -m src.watchlist)")
     args = parser.parse_args()
     
     success = main(
         start_fullscreen=args.fullscreen,
         enable_mqtt=not args.no_mqtt,
         mqtt_broker=args.broker,
-        mqtt_port=args.port
+        mqtt_port=args.port,
+        watchlist=args.watchlist
     )
     sys.exit(0 if success else 1)
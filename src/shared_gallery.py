@@ -0,0 +1,292 @@
+"""
+Shared-memory gallery for multi-process worker pools.
+One owner process publishes gallery snapshots into multiprocessing.shared_memory
+segments (the flat layout of src/gallery_file.py). Any number of worker
+processes attach to them without copying and follow updates through a
+version counter, so memory stays flat as workers are added.
+
+Run the owner: python -m src.shared_gallery
+Workers: set SHARED_GALLERY_ENABLED = True; FaceGallery.load() then attaches,
+and GalleryWatcher follows the version counter instead of the database files.
+If the owner restarts, workers find its new control block by name (checked
+at most every CONTROL_RECHECK_S) and move to its snapshots.
+
+Snapshots carry no ANN index (the IVF layout isn't part of the shared
+format), so workers search them exactly / sharded even when the owner's own
+gallery would use the index; each worker building its own would cost the
+memory sharing is meant to save.
+"""
+
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional
+
+from . import config
+from .gallery import FaceGallery
+from .gallery_file import GalleryLayout, parse_gallery_buffer
+
+# Control block: seq (uint64, odd while being written) | version (uint64) | name length (uint32) | name
+_CONTROL = struct.Struct("<QQI")
+CONTROL_SIZE = 256
+CONTROL_RECHECK_S = 1.0  # How often readers look for a control block re-created by a restarted owner
+
+# Segments created by this process: the resource tracker must keep them registered
+_owned = set()
+
+
+def _control_name(name: str) -> str:
+    return f"{name}_ctl"
+
+
+class _Segment(shared_memory.SharedMemory):
+    """Attached segment that may outlive its last close() attempt."""
+
+    def __del__(self):
+        try:
+            self.close()
+        except BufferError:
+            pass  # Gallery arrays still view it; the mapping goes away with them
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing segment without letting this process's exit unlink it."""
+    try:
+        return _Segment(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = _Segment(name=name)
+        if os.name == "posix" and shm._name not in _owned:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _read_control(buf) -> Optional[tuple]:
+    """(version, segment name) from a consistent read of the control block, or None."""
+    for _ in range(100):
+        seq, version, length = _CONTROL.unpack_from(buf, 0)
+        if seq % 2 == 0:
+            segment = bytes(buf[_CONTROL.size:_CONTROL.size + length]).decode("ascii")
+            if _CONTROL.unpack_from(buf, 0)[0] == seq:
+                return (version, segment) if version else None
+        time.sleep(0.0001)  # Owner is mid-publish
+    return None
+
+
+class SharedGalleryPublisher:
+    """
+    Owner side: publishes FaceGallery snapshots for workers to attach to.
+
+    Each publish() writes a new segment and then flips the control block,
+    so a worker only ever sees complete snapshots. The newest
+    SHARED_GALLERY_KEEP segments stay linked; older ones are unlinked (workers
+    that still use them keep their mapping until they move on).
+    """
+
+    def __init__(self, name: str = None):
+        """
+        Args:
+            name: Shared-memory name prefix (None = config.SHARED_GALLERY_NAME)
+        """
+        self.name = name or config.SHARED_GALLERY_NAME
+        try:
+            self._control = shared_memory.SharedMemory(name=_control_name(self.name), create=True,
+                                                       size=CONTROL_SIZE)
+            self._control.buf[:CONTROL_SIZE] = bytes(CONTROL_SIZE)
+            _owned.add(self._control._name)
+        except FileExistsError:
+            # Left over from an owner that died; take it over and keep counting from its version
+            self._control = shared_memory.SharedMemory(name=_control_name(self.name))
+        self.version = _CONTROL.unpack_from(self._control.buf, 0)[1]
+        self._segments: List[shared_memory.SharedMemory] = []
+
+    def publish(self, gallery: FaceGallery) -> int:
+        """
+        Publish a snapshot of `gallery`. Returns its version.
+        """
+        version = self.version + 1
+        layout = GalleryLayout(
+            gallery.names, gallery.offsets, gallery.matrix, gallery.scales,
+            version=version,
+            budget=gallery.template_budget,
+            metadata=gallery.metadata,
+        )
+        segment = shared_memory.SharedMemory(
+            name=f"{self.name}_v{version}_{os.getpid()}", create=True, size=layout.nbytes
+        )
+        layout.write_into(segment.buf)
+        _owned.add(segment._name)
+        seg_name = segment.name.lstrip("/").encode("ascii")
+
+        # Seqlock: readers retry while seq is odd or changed under them
+        buf = self._control.buf
+        seq = _CONTROL.unpack_from(buf, 0)[0]
+        struct.pack_into("<Q", buf, 0, seq + 1)
+        buf[_CONTROL.size:_CONTROL.size + len(seg_name)] = seg_name
+        struct.pack_into("<QI", buf, 8, version, len(seg_name))
+        struct.pack_into("<Q", buf, 0, seq + 2)
+        self.version = version
+
+        self._segments.append(segment)
+        while len(self._segments) > max(1, config.SHARED_GALLERY_KEEP):
+            old = self._segments.pop(0)
+            old.close()
+            old.unlink()
+        return version
+
+    def close(self) -> None:
+        """Unlink every snapshot and the control block (workers keep what they mapped)."""
+        for segment in self._segments:
+            segment.close()
+            segment.unlink()
+        self._segments = []
+        self._control.close()
+        self._control.unlink()
+
+
+class SharedGalleryReader:
+    """
+    Worker side: attaches to the owner's current snapshot, zero-copy.
+
+    Galleries returned by snapshot() view the shared segment directly
+    (read-only); add/remove on them builds a private copy as usual.
+    """
+
+    def __init__(self, name: str = None):
+        """
+        Args:
+            name: Shared-memory name prefix (None = config.SHARED_GALLERY_NAME)
+
+        Raises:
+            FileNotFoundError: If no owner has published under this name
+        """
+        self.name = name or config.SHARED_GALLERY_NAME
+        self._control = _attach(_control_name(self.name))
+        self._checked = time.monotonic()
+        self._generation = 0  # Control blocks attached so far, minus one
+        self._segments: Dict[str, shared_memory.SharedMemory] = {}
+        self._retired: List[shared_memory.SharedMemory] = []
+
+    def key(self) -> str:
+        """Changes whenever the owner publishes (cheap: reads the control block)."""
+        if time.monotonic() - self._checked >= CONTROL_RECHECK_S:
+            self._reattach()
+        current = _read_control(self._control.buf)
+        return f"shm:{self._generation}:{current[0]}" if current else ""
+
+    def _reattach(self) -> None:
+        """
+        Switch to the control block now under our name once ours is unlinked.
+        When an owner dies its resource tracker unlinks the control block and
+        the next owner creates a fresh one; the mapping we hold would never
+        change again.
+        """
+        self._checked = time.monotonic()
+        if os.name != "posix" or os.fstat(self._control._fd).st_nlink:
+            return  # Still linked (Windows keeps it alive while we hold it, so a new owner reuses it)
+        try:
+            fresh = _attach(_control_name(self.name))
+        except FileNotFoundError:
+            return  # No owner right now; keep the last snapshot
+        old, self._control = self._control, fresh
+        self._generation += 1
+        try:
+            old.close()
+        except BufferError:
+            pass
+        # A new owner counts versions from 1 again, and with the same pid reuses segment names
+        self._retired.extend(self._segments.values())
+        self._segments = {}
+
+    def snapshot(self) -> Optional[FaceGallery]:
+        """
+        The owner's current gallery, or None if nothing is published.
+        It has no ANN index (see the module docstring).
+
+        Raises:
+            ValueError: If the segment doesn't hold a valid gallery
+        """
+        self._reattach()
+        current = _read_control(self._control.buf)
+        if current is None:
+            return None
+        version, segment_name = current
+        segment = self._segments.get(segment_name)
+        if segment is None:
+            try:
+                segment = _attach(segment_name)
+            except FileNotFoundError:
+                return None  # Already replaced by a newer snapshot; caught on the next check
+            self._segments[segment_name] = segment
+            self._release_old(keep=segment_name)
+        header, names, offsets, matrix, scales = parse_gallery_buffer(segment.buf)
+        gallery = FaceGallery(metadata=header.get("metadata"), template_budget=header.get("budget"),
+                              build_index=False, storage=matrix.dtype.name)
+        gallery._adopt(names, offsets, matrix, scales)
+        gallery.shared = self
+        return gallery
+
+    def _release_old(self, keep: str) -> None:
+        """Close segments other than the newest two once no array views them any more."""
+        for name in list(self._segments)[:-2]:
+            if name != keep:
+                self._retired.append(self._segments.pop(name))
+        still_used = []
+        for segment in self._retired:
+            try:
+                segment.close()
+            except BufferError:
+                still_used.append(segment)  # A gallery still views it
+        self._retired = still_used
+
+
+def attach_shared_gallery(storage: str = None) -> Optional[FaceGallery]:
+    """
+    Current shared snapshot if an owner is publishing one (in `storage`
+    precision, if given), else None.
+    """
+    try:
+        gallery = SharedGalleryReader().snapshot()
+    except (FileNotFoundError, ValueError):
+        return None
+    if gallery is None or (storage is not None and gallery.storage != storage):
+        return None
+    return gallery
+
+
+def main():
+    """Owner process: publish the gallery and re-publish whenever the database changes."""
+    from .gallery_watcher import GalleryWatcher
+
+    gallery = FaceGallery.load(shared=False)
+    if not len(gallery):
+        print("ERROR: No enrolled identities found. Run enrollment first.")
+        return False
+    publisher = SharedGalleryPublisher()
+    version = publisher.publish(gallery)
+    print(f"✓ Published {len(gallery)} identities as '{publisher.name}' v{version} "
+          f"({gallery.nbytes / 1e6:.1f} MB, {gallery.storage})")
+    print("Workers with SHARED_GALLERY_ENABLED = True attach to it. Ctrl+C to stop.")
+
+    watcher = GalleryWatcher(gallery)
+    try:
+        while True:
+            fresh = watcher.poll()
+            if fresh is not None:
+                gallery.swap(fresh)
+                version = publisher.publish(gallery)
+                print(f"✓ Published {len(gallery)} identities v{version}")
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        publisher.close()
+    print("✓ Shared gallery stopped.")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,119 @@
+"""
+Startup helpers for the live pipelines.
+Runs independent initialization steps (database, detector, embedder, camera,
+MQTT) concurrently and reports how long each one took.
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from . import config
+
+
+class StartupTimer:
+    """Records when each startup step ran, relative to launch."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.steps: List[Tuple[str, float, float]] = []  # (name, start, end) in seconds
+        self.marks: List[Tuple[str, float]] = []
+        self.user_wait = 0.0  # Time spent waiting for keyboard input
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def now(self) -> float:
+        """Seconds since launch."""
+        return time.perf_counter() - self.t0
+
+    @contextmanager
+    def measure(self, name: str, user_input: bool = False):
+        """Time a block. Time in user_input blocks is reported separately."""
+        start = self.now()
+        try:
+            yield
+        finally:
+            end = self.now()
+            with self._lock:
+                self.steps.append((name, start, end))
+                if user_input:
+                    self.user_wait += end - start
+
+    def submit(self, name: str, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Run fn in the background (or inline when PARALLEL_STARTUP is off) and time it.
+
+        Returns:
+            Future with fn's result
+        """
+        def run():
+            with self.measure(name):
+                return fn(*args, **kwargs)
+
+        if not config.PARALLEL_STARTUP:
+            f = Future()
+            try:
+                f.set_result(run())
+            except Exception as e:
+                f.set_exception(e)
+            return f
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=5, thread_name_prefix="startup")
+        return self._pool.submit(run)
+
+    def mark(self, name: str) -> float:
+        """Record a milestone (e.g. first frame) and return its time since launch."""
+        t = self.now()
+        with self._lock:
+            self.marks.append((name, t))
+        return t
+
+    def shutdown(self):
+        """Release the worker threads (waits for running steps)."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def report(self) -> None:
+        """Print the timing breakdown."""
+        print("\n" + "="*60)
+        print("STARTUP TIMING" + (" (parallel)" if config.PARALLEL_STARTUP else " (sequential)"))
+        print("="*60)
+        for name, start, end in sorted(self.steps, key=lambda s: s[1]):
+            print(f"  {name:<22} {end - start:6.2f}s   ({start:5.2f}s → {end:5.2f}s)")
+        for name, t in self.marks:
+            line = f"  {name:<22} at {t:5.2f}s"
+            if self.user_wait > 0:
+                line += f" ({self.user_wait:.1f}s of it waiting for input)"
+            print(line)
+        print("="*60)
+
+
+def open_camera(
+    index: int = config.CAMERA_INDEX,
+    attempts: int = config.CAMERA_OPEN_ATTEMPTS,
+    retry_delay: float = config.CAMERA_OPEN_RETRY_DELAY,
+) -> Tuple[Optional[cv2.VideoCapture], Optional[np.ndarray]]:
+    """
+    Open the camera, retrying while it isn't ready, and grab one frame.
+
+    Returns:
+        (capture, first frame), or (None, None) if the camera never delivered a frame
+    """
+    for attempt in range(attempts):
+        cap = cv2.VideoCapture(index)
+        if cap.isOpened():
+            ret, frame = cap.read()
+            if ret:
+                return cap, frame
+        cap.release()
+        if attempt < attempts - 1:
+            print(f"Attempt {attempt + 1}/{attempts}: Camera not ready, retrying...")
+            time.sleep(retry_delay)
+    return None, None
@@ -0,0 +1,108 @@
+"""
+Named watchlists: subsets of the enrolled identities stored in the gallery
+metadata (face_db.fdb, "watchlists"). A camera started with a watchlist
+only searches its members, a handful of dot products per face instead of
+a scan of the whole gallery.
+
+Usage:
+    python -m src.watchlist                      # list watchlists
+    python -m src.watchlist set lobby Alice Bob  # create or replace
+    python -m src.watchlist delete lobby
+"""
+
+import sys
+from typing import List, Optional
+
+from . import config
+from .gallery import FaceGallery
+
+
+def watchlist_scope(gallery: FaceGallery, name: str = None) -> Optional[List[str]]:
+    """
+    Identities a live loop searches: the enrolled members of watchlist `name`,
+    or None (the whole gallery) if no watchlist is selected.
+
+    Args:
+        gallery: Loaded gallery
+        name: Watchlist name (None = config.WATCHLIST)
+
+    Raises:
+        ValueError: If the watchlist isn't defined or has no enrolled members
+    """
+    name = config.WATCHLIST if name is None else name
+    if not name:
+        return None
+    if name not in gallery.watchlists:
+        defined = ", ".join(sorted(gallery.watchlists)) or "(none)"
+        raise ValueError(f"No watchlist '{name}' (defined: {defined}). Create it with: python -m src.watchlist set")
+    scope = gallery.watchlist(name)
+    if not scope:
+        raise ValueError(f"Watchlist '{name}' has no enrolled members")
+    return scope
+
+
+def list_watchlists() -> bool:
+    """Print every watchlist with its members (unenrolled members marked)."""
+    gallery = FaceGallery.load(check_model=False, storage="float32", shared=False)
+    watchlists = gallery.watchlists
+    if not watchlists:
+        print("No watchlists defined. Create one with: python -m src.watchlist set NAME PERSON...")
+        return True
+    for name in sorted(watchlists):
+        members = [n if n in gallery else f"{n} (not enrolled)" for n in watchlists[name]]
+        print(f"{name}: {', '.join(members) or '(empty)'}")
+    return True
+
+
+def set_watchlist(name: str, members: List[str]) -> bool:
+    """Create or replace a watchlist; every member must be enrolled."""
+    gallery = FaceGallery.load(check_model=False, storage="float32", shared=False)
+    missing = [n for n in members if n not in gallery]
+    if missing:
+        print(f"ERROR: Not enrolled: {', '.join(missing)}")
+        return False
+    watchlists = gallery.watchlists
+    watchlists[name] = sorted(set(members))
+    gallery.save_metadata({**gallery.metadata, "watchlists": watchlists})
+    print(f"✓ Watchlist '{name}': {len(watchlists[name])} identities")
+    return True
+
+
+def delete_watchlist(name: str) -> bool:
+    """Remove a watchlist."""
+    gallery = FaceGallery.load(check_model=False, storage="float32", shared=False)
+    watchlists = gallery.watchlists
+    if watchlists.pop(name, None) is None:
+        print(f"ERROR: No watchlist '{name}'")
+        return False
+    metadata = {**gallery.metadata, "watchlists": watchlists}
+    if not watchlists:
+        del metadata["watchlists"]
+    gallery.save_metadata(metadata)
+    print(f"✓ Deleted watchlist '{name}'")
+    return True
+
+
+def main():
+    """Command-line entry point."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage named watchlists (identity subsets per camera)")
+    sub = parser.add_subparsers(dest="command")
+    p_set = sub.add_parser("set", help="Create or replace a watchlist")
+    p_set.add_argument("name")
+    p_set.add_argument("members", nargs="+", help="Enrolled identity names")
+    p_delete = sub.add_parser("delete", help="Remove a watchlist")
+    p_delete.add_argument("name")
+    args = parser.parse_args()
+
+    if args.command == "set":
+        return set_watchlist(args.name, args.members)
+    if args.command == "delete":
+        return delete_watchlist(args.name)
+    return list_watchlists()
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
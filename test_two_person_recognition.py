@@ -5,16 +5,15 @@ Simulates face recognition by testing embeddings from the database.
 """
 
 import sys
-import numpy as np
 from pathlib import Path
-import cv2
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from src import config
 from src.align import FaceAligner
-from src.embed import ArcFaceEmbedder
+from src.offline_embed import OfflineEmbedder
+from src.gallery import FaceGallery
 
 
 def test_two_person_recognition():
@@ -25,15 +24,15 @@ def test_two_person_recognition():
     print("=" * 60)
     
     # Load database
-    if not config.DB_NPZ_PATH.exists():
+    if not config.DB_PATH.exists() and not config.DB_NPZ_PATH.exists():
         print("ERROR: Database not found. Run enrollment first.")
         return False
+    gallery = FaceGallery.load()
+    if not len(gallery):
+        print("ERROR: No enrolled identities found")
+        return False
     
-    data = np.load(str(config.DB_NPZ_PATH), allow_pickle=True)
-    db = {k: data[k].astype(np.float32) for k in data.files}
-    
-    names = sorted(db.keys())
-    print(f"\n✓ Loaded database with {len(db)} identities: {', '.join(names)}\n")
+    print(f"\n✓ Loaded database with {len(gallery)} identities: {', '.join(gallery.names)}\n")
     
     # Test with two different people
     test_pairs = [
@@ -43,7 +42,7 @@ def test_two_person_recognition():
     ]
     
     aligner = FaceAligner()
-    embedder = ArcFaceEmbedder(config.ARCFACE_MODEL_PATH)
+    engine = OfflineEmbedder(config.ARCFACE_MODEL_PATH, verbose=False)
     
     print("Testing recognition accuracy with aligned face samples:\n")
     
@@ -69,57 +68,39 @@ def test_two_person_recognition():
         
         print(f"\n{person1} samples:")
         person1_recognized_count = 0
-        for i, sample_path in enumerate(person1_samples, 1):
-            img = cv2.imread(str(sample_path))
-            if img is None or img.shape[:2] != config.EMBEDDING_INPUT_SIZE:
+        person1_embs, person1_ok = engine.embed_paths(person1_samples)
+        person1_valid = []
+        for i, ok in enumerate(person1_ok, 1):
+            if not ok:
                 print(f"  Sample {i}: ⚠ Invalid image")
                 continue
-            
-            try:
-                emb, _ = embedder.embed(img)
-                
-                # Recognize against database
-                dists = np.array([1.0 - float(np.dot(emb.reshape(-1), db[n].reshape(-1))) 
-                                for n in names])
-                best_idx = int(np.argmin(dists))
-                best_name = names[best_idx]
-                best_dist = dists[best_idx]
-                
-                match = "✓ CORRECT" if best_name == person1 else "✗ WRONG"
-                print(f"  Sample {i}: Recognized as '{best_name}' (dist={best_dist:.4f}) {match}")
-                
-                if best_name == person1:
-                    person1_recognized_count += 1
-                    
-            except Exception as e:
-                print(f"  Sample {i}: Error - {e}")
+            person1_valid.append(i)
+        
+        # Recognize all samples against the database at once
+        matches = gallery.best_matches(person1_embs)
+        for i, (best_name, best_dist) in zip(person1_valid, matches):
+            match = "✓ CORRECT" if best_name == person1 else "✗ WRONG"
+            print(f"  Sample {i}: Recognized as '{best_name}' (dist={best_dist:.4f}) {match}")
+            if best_name == person1:
+                person1_recognized_count += 1
         
         print(f"\n{person2} samples:")
         person2_recognized_count = 0
-        for i, sample_path in enumerate(person2_samples, 1):
-            img = cv2.imread(str(sample_path))
-            if img is None or img.shape[:2] != config.EMBEDDING_INPUT_SIZE:
+        person2_embs, person2_ok = engine.embed_paths(person2_samples)
+        person2_valid = []
+        for i, ok in enumerate(person2_ok, 1):
+            if not ok:
                 print(f"  Sample {i}: ⚠ Invalid image")
                 continue
-            
-            try:
-                emb, _ = embedder.embed(img)
-                
-                # Recognize against database
-                dists = np.array([1.0 - float(np.dot(emb.reshape(-1), db[n].reshape(-1))) 
-                                for n in names])
-                best_idx = int(np.argmin(dists))
-                best_name = names[best_idx]
-                best_dist = dists[best_idx]
-                
-                match = "✓ CORRECT" if best_name == person2 else "✗ WRONG"
-                print(f"  Sample {i}: Recognized as '{best_name}' (dist={best_dist:.4f}) {match}")
-                
-                if best_name == person2:
-                    person2_recognized_count += 1
-                    
-            except Exception as e:
-                print(f"  Sample {i}: Error - {e}")
+            person2_valid.append(i)
+        
+        # Recognize all samples against the database at once
+        matches = gallery.best_matches(person2_embs)
+        for i, (best_name, best_dist) in zip(person2_valid, matches):
+            match = "✓ CORRECT" if best_name == person2 else "✗ WRONG"
+            print(f"  Sample {i}: Recognized as '{best_name}' (dist={best_dist:.4f}) {match}")
+            if best_name == person2:
+                person2_recognized_count += 1
         
         # Summary for this pair
         total_person1 = len(person1_samples)